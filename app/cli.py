@@ -0,0 +1,96 @@
+"""
+Chạy API ở chế độ production với nhiều worker process
+
+    python -m app.cli --workers 4 --port 8000 --state-dir ./state
+
+Mỗi worker import app.main riêng nên có workflow, client Gemini và metrics
+riêng. Trạng thái cần dùng chung được chuyển sang SQLite trong --state-dir
+(trừ khi biến môi trường tương ứng đã được set):
+
+- chart cache và analysis store: worker nào cũng dùng lại được kết quả của worker khác
+- result store: history của một session đọc được từ mọi worker
+- job store: GET /jobs/{id} trả lời được từ mọi worker, job được claim trước khi chạy
+- quota Gemini (RPM/TPM): một token bucket cho cả API key thay vì mỗi worker một bucket
+
+SIGTERM/Ctrl+C: uvicorn ngừng nhận kết nối, chờ request đang xử lý tối đa
+--drain-timeout giây, rồi mỗi worker chờ job/workflow đang chạy (SHUTDOWN_DRAIN_SECONDS).
+"""
+import argparse
+import logging
+import os
+from typing import List, Optional
+
+import uvicorn
+
+from app.services.structured_logging import configure_logging
+
+logger = logging.getLogger("app.cli")
+
+
+def configure_shared_state(state_dir: str, drain_timeout: float) -> None:
+    """Set mặc định cho các backend dùng chung; biến môi trường đã set thì giữ nguyên"""
+    os.makedirs(state_dir, exist_ok=True)
+    defaults = {
+        "CHART_CACHE_BACKEND": "sqlite",
+        "CHART_CACHE_PATH": os.path.join(state_dir, "chart_cache.sqlite3"),
+        "ANALYSIS_STORE_BACKEND": "sqlite",
+        "ANALYSIS_STORE_PATH": os.path.join(state_dir, "analyses.sqlite3"),
+        "RESULT_STORE_BACKEND": "sqlite",
+        "RESULT_STORE_PATH": os.path.join(state_dir, "results.sqlite3"),
+        "JOB_STORE_BACKEND": "sqlite",
+        "JOB_STORE_PATH": os.path.join(state_dir, "jobs.sqlite3"),
+        "GEMINI_QUOTA_BACKEND": "sqlite",
+        "GEMINI_QUOTA_PATH": os.path.join(state_dir, "gemini_quota.sqlite3"),
+        "SHUTDOWN_DRAIN_SECONDS": str(drain_timeout),
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # Worker khởi động song song: không worker nào được requeue job "running" của worker khác
+    os.environ["JOB_RECOVER_INTERRUPTED"] = "false"
+
+
+def requeue_interrupted_jobs() -> None:
+    """Đưa job bị gián đoạn ở lần chạy trước về queued, một lần trước khi khởi động worker"""
+    from app.services.job_queue import create_job_store
+
+    store = create_job_store()
+    requeued = store.requeue_interrupted()
+    if requeued:
+        logger.info("Requeued interrupted jobs", extra={"requeued": requeued})
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the IELTS analysis API with multiple worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--state-dir", default=os.getenv("STATE_DIR", "state"),
+                        help="directory for the SQLite files shared by all workers")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="seconds to wait for in-flight requests, workflows and jobs on shutdown")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Worker kế thừa biến môi trường: log của app cùng level với uvicorn
+    os.environ.setdefault("LOG_LEVEL", args.log_level.upper())
+    configure_logging()
+    configure_shared_state(args.state_dir, args.drain_timeout)
+    requeue_interrupted_jobs()
+    logger.info("Starting workers", extra={
+        "workers": args.workers, "host": args.host, "port": args.port, "state_dir": args.state_dir
+    })
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.drain_timeout,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
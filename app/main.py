@@ -1,14 +1,33 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import base64
-import io
-from PIL import Image
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
 import uvicorn
-import traceback
 
-from app.models.schemas import AnalysisRequest, AnalysisResponse
-from app.services.langgraph_workflow import IELTSAnalysisWorkflow
+from app.models.schemas import AnalysisRequest, AnalysisResponse, RegenerateRequest
+from app.services.langgraph_workflow import IELTSAnalysisWorkflow, SPECIALIZED_CHART_TYPES
+from app.services.image_processing import (
+    SNIFF_BYTES, ImageTooLargeError, PreparedImage, UnsupportedImageError,
+    check_base64_image, prepare_image, prepare_base64_image, sniff_image_format
+)
+from app.services.job_queue import create_job_queue, QueueFullError
+from app.services.gemini_scheduler import get_gemini_scheduler
+from app.services.request_context import request_id, request_tenant, request_deadline, request_session
+from app.services.batch_runner import BatchInputError, create_batch_runner, items_from_archive, items_from_uploads
+from app.services.blob_store import IMAGE_BLOBS
+from app.services.upload_limits import RequestSizeLimitMiddleware, create_request_size_limits
+from app.services.metrics import REGISTRY, HTTP_REQUEST_LATENCY, HTTP_REQUESTS_IN_FLIGHT, WORKFLOWS_IN_FLIGHT
+from app.services.structured_logging import configure_logging, shutdown_logging
+
+# Log JSON qua queue (ghi stdout trong thread riêng), cấu hình trước khi tạo workflow
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Tạo FastAPI app
 app = FastAPI(
@@ -17,7 +36,10 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Chặn body quá lớn trước khi FastAPI đọc/parse form
+app.add_middleware(RequestSizeLimitMiddleware, **create_request_size_limits())
 # Configure CORS for React frontend
+# Thêm sau cùng để là middleware ngoài cùng: response 413 cũng có header CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # React dev server
@@ -26,8 +48,111 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "120"))
+# Thời gian tối đa chờ workflow/job đang chạy khi shutdown
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+# X-Request-ID của client dài hơn thì bị cắt
+MAX_REQUEST_ID_CHARS = 128
+
+@app.middleware("http")
+async def bind_request_context(request, call_next):
+    """
+    Gắn context của request: request id (X-Request-ID hoặc tự sinh, có trong mọi
+    dòng log của request và trả lại trong response header), tenant (để scheduler
+    chia quota Gemini công bằng), session (X-Session-ID, nhóm history kết quả)
+    và deadline (client có thể rút ngắn bằng header X-Request-Timeout, tính bằng giây)
+    """
+    rid = request.headers.get("X-Request-ID", "")[:MAX_REQUEST_ID_CHARS] or uuid.uuid4().hex
+    request_id.set(rid)
+    request_tenant.set(request.headers.get("X-Tenant-ID", "default"))
+    request_session.set(request.headers.get("X-Session-ID"))
+    timeout = REQUEST_TIMEOUT_SECONDS
+    try:
+        timeout = min(timeout, float(request.headers.get("X-Request-Timeout", timeout)))
+    except ValueError:
+        pass
+    request_deadline.set(time.monotonic() + timeout)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = rid
+    return response
+
+@app.middleware("http")
+async def record_http_metrics(request, call_next):
+    """Latency theo route template (không theo path thật, tránh label /jobs/<id> vô hạn)"""
+    started_at = time.perf_counter()
+    status = 500
+    with HTTP_REQUESTS_IN_FLIGHT.track_inprogress():
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_REQUEST_LATENCY.observe(
+                time.perf_counter() - started_at,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=str(status)
+            )
+
 # Initialize workflow
 workflow = IELTSAnalysisWorkflow()
+job_queue = create_job_queue(workflow)
+batch_runner = create_batch_runner(workflow)
+
+# Gauge đọc lúc scrape từ các component đã có sẵn stats
+REGISTRY.callback_gauge(
+    "ielts_model_queue_depth", "Model calls waiting for RPM/TPM quota",
+    lambda: get_gemini_scheduler().stats()["queued_total"]
+)
+REGISTRY.callback_gauge(
+    "ielts_jobs_pending", "Background jobs waiting for a worker", lambda: job_queue.stats()["pending"]
+)
+REGISTRY.callback_gauge(
+    "ielts_jobs_running", "Background jobs currently running", lambda: job_queue.stats()["running"]
+)
+REGISTRY.callback_gauge(
+    "ielts_image_blobs", "Prepared images held for in-flight workflows", lambda: IMAGE_BLOBS.stats()["items"]
+)
+REGISTRY.callback_gauge(
+    "ielts_image_blob_bytes", "Bytes of prepared images held for in-flight workflows",
+    lambda: IMAGE_BLOBS.stats()["bytes"]
+)
+REGISTRY.callback_gauge(
+    "ielts_model_circuit_open", "1 while the Gemini circuit breaker is open",
+    lambda: workflow.gemini_service.breaker.state == "open"
+)
+
+_background_tasks = set()
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+@app.on_event("startup")
+async def warm_up_model_provider():
+    # Không chặn startup: request đầu tiên vẫn chạy được nếu warmup chưa xong
+    task = asyncio.create_task(workflow.gemini_service.provider.warmup())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("shutdown")
+async def drain_in_flight_work():
+    # Uvicorn đã ngừng nhận kết nối; chờ job và workflow còn chạy (stream, task nền) xong
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    await job_queue.stop(drain_timeout=SHUTDOWN_DRAIN_SECONDS)
+    while WORKFLOWS_IN_FLIGHT.value() > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if WORKFLOWS_IN_FLIGHT.value() > 0:
+        logger.warning("Shutting down with workflows still running", extra={"workflows": WORKFLOWS_IN_FLIGHT.value()})
+
+@app.on_event("shutdown")
+async def close_model_provider():
+    await workflow.gemini_service.provider.aclose()
+
+@app.on_event("shutdown")
+async def flush_logs():
+    shutdown_logging()
 
 @app.get("/")
 async def root():
@@ -40,19 +165,24 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
+    """
+    Detailed health check
+    
+    Chỉ đọc trạng thái của provider/circuit breaker đang chạy: không khởi tạo lại
+    SDK và không gọi mạng, nên probe thường xuyên vẫn rẻ.
+    """
     try:
-        # Test Gemini service initialization
-        from app.services.gemini_service import GeminiService
-        gemini_service = GeminiService()
+        provider_health = workflow.gemini_service.provider.health()
+        circuit_open = workflow.gemini_service.breaker.state == "open"
         
         return {
-            "status": "healthy",
+            "status": "degraded" if circuit_open else "healthy",
             "services": {
                 "fastapi": "running",
-                "gemini": "connected",
+                "gemini": "unavailable" if circuit_open else "connected",
                 "langgraph": "initialized"
-            }
+            },
+            "model_provider": provider_health
         }
     except Exception as e:
         return {
@@ -65,10 +195,59 @@ async def health_check():
             }
         }
 
+def _add_candidates(response: dict, result: dict, include_candidates: bool) -> None:
+    """
+    Attach best-of-N info: per-candidate scores always, full essays only on request
+    """
+    candidates = result.get("essay_candidates")
+    if not candidates:
+        return
+    if include_candidates:
+        response["data"]["essay_candidates"] = candidates
+    response["metadata"]["candidate_scores"] = [
+        {
+            "variant": candidate["variant"],
+            "selected": candidate.get("selected", False),
+            "score": candidate.get("score"),
+            "error": candidate.get("error")
+        }
+        for candidate in candidates
+    ]
+
+async def _prepare_upload(chart_image: UploadFile) -> PreparedImage:
+    """
+    Validate an uploaded chart image and run it through the image pipeline
+    """
+    # Validate file type
+    if not chart_image.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=400, 
+            detail="File must be an image (PNG, JPG, JPEG, etc.)"
+        )
+    
+    # Nhận dạng định dạng từ vài byte đầu, trước khi decode cả file
+    head = await chart_image.read(SNIFF_BYTES)
+    if sniff_image_format(head) is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Unsupported image format (PNG, JPEG, GIF, WEBP, BMP or TIFF expected)"
+        )
+    
+    try:
+        # Decode ảnh đúng một lần từ file upload (spooled), CPU-bound nên chạy trong worker thread
+        return await asyncio.to_thread(prepare_image, chart_image.file)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
 @app.post("/analyze", response_model=dict)
 async def analyze_ielts_task(
     task_description: str = Form(..., description="IELTS Writing Task 1 description"),
-    chart_image: UploadFile = File(..., description="Chart/graph image file")
+    chart_image: UploadFile = File(..., description="Chart/graph image file"),
+    variants: int = Form(1, description="Number of essays to generate in parallel (best one is returned)"),
+    include_candidates: bool = Form(False, description="Return every essay candidate, not only scores")
 ):
     """
     Analyze IELTS Writing Task 1 with chart image
@@ -80,52 +259,24 @@ async def analyze_ielts_task(
     """
     
     try:
-        # Validate file type
-        if not chart_image.content_type.startswith('image/'):
-            raise HTTPException(
-                status_code=400, 
-                detail="File must be an image (PNG, JPG, JPEG, etc.)"
-            )
-        
-        # Read and validate image
-        image_data = await chart_image.read()
-        
-        try:
-            # Validate image can be opened
-            image = Image.open(io.BytesIO(image_data))
-            image.verify()  # Verify it's a valid image
-            
-            # Re-open image after verify (verify closes the file)
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Convert to RGB if necessary (for JPEG compatibility)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            image.save(buffer, format='JPEG', quality=95)
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid image file: {str(e)}"
-            )
+        prepared_image = await _prepare_upload(chart_image)
         
         # Process through LangGraph workflow
-        print(f"🚀 Processing IELTS analysis request...")
-        print(f"📝 Task: {task_description[:100]}...")
-        print(f"🖼️ Image size: {len(image_data)} bytes")
+        logger.info("Processing IELTS analysis request", extra={
+            "task": task_description[:100],
+            "image_bytes": prepared_image.original_size,
+            "prepared_bytes": prepared_image.size
+        })
         
         result = await workflow.process_request(
             task_description=task_description,
-            image_base64=image_base64
+            image=prepared_image,
+            num_variants=variants
         )
         
         if not result.get("success"):
             raise HTTPException(
-                status_code=500,
+                status_code=result.get("status_code", 500),
                 detail=f"Analysis failed: {result.get('error', 'Unknown error')}"
             )
         
@@ -141,25 +292,180 @@ async def analyze_ielts_task(
                 "task_description": task_description,
                 "image_info": {
                     "filename": chart_image.filename,
-                    "size_bytes": len(image_data),
-                    "content_type": chart_image.content_type
-                }
+                    "size_bytes": prepared_image.original_size,
+                    "content_type": chart_image.content_type,
+                    **prepared_image.info()
+                },
+                "analysis_id": result.get("analysis_id"),
+                "result_id": result.get("result_id"),
+                "chart_prediction": result.get("chart_prediction"),
+                "node_timings": result.get("node_timings", {}),
+                "token_usage": result.get("token_usage", {})
             }
         }
+        _add_candidates(response, result, include_candidates)
         
-        print(f"✅ Analysis completed successfully in {result['processing_time']:.2f}s")
         return response
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Unexpected error: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        # Traceback được format trong thread ghi log, không phải trên event loop
+        logger.exception("Unexpected error in /analyze")
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
 
+@app.post("/analyze-stream")
+async def analyze_ielts_stream(
+    task_description: str = Form(..., description="IELTS Writing Task 1 description"),
+    chart_image: UploadFile = File(..., description="Chart/graph image file")
+):
+    """
+    Streaming version of /analyze using Server-Sent Events
+    
+    Events:
+    - node: a workflow step finished (validate_input, analyze_chart, ...)
+    - token: a chunk of essay text from the model
+    - result: final result, same shape as the /analyze data
+    """
+    prepared_image = await _prepare_upload(chart_image)
+    
+    async def event_stream():
+        got_result = False
+        async for event in workflow.astream_request(task_description, prepared_image):
+            event_type = event.pop("event")
+            if event_type == "result":
+                got_result = True
+                if event.get("success"):
+                    event["image_info"] = prepared_image.info()
+            yield f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        if not got_result:
+            # Workflow chết giữa chừng: client vẫn nhận một result lỗi thay vì stream bị cắt
+            event = {"success": False, "error": "Workflow execution failed: stream ended without a result"}
+            yield f"event: result\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Tắt buffering của nginx để event tới client ngay
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.post("/analyze-batch", response_model=dict)
+async def analyze_ielts_batch(
+    task_descriptions: List[str] = Form([], description="One task description per chart image"),
+    chart_images: List[UploadFile] = File([], description="Chart/graph image files"),
+    archive: Optional[UploadFile] = File(None, description="Zip of images with tasks.json or one .txt per image")
+):
+    """
+    Analyze many charts in one call
+    
+    Send either chart_images + task_descriptions (same order, same count) or a zip
+    archive. Items run concurrently with a bounded semaphore and a global rate
+    limit; results come back in input order with per-item timings and errors.
+    """
+    if archive is not None:
+        try:
+            items = await asyncio.to_thread(items_from_archive, archive.file)
+        except (BatchInputError, ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
+    else:
+        try:
+            items = items_from_uploads(chart_images, task_descriptions)
+        except BatchInputError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        batch_result = await batch_runner.run(items)
+    except BatchInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.info("Batch completed", extra={
+        "succeeded": batch_result["succeeded"],
+        "failed": batch_result["failed"],
+        "total_time": round(batch_result["total_time"], 4)
+    })
+    return {
+        "success": batch_result["failed"] == 0,
+        "data": batch_result
+    }
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    task_description: str = Form(..., description="IELTS Writing Task 1 description"),
+    chart_image: UploadFile = File(..., description="Chart/graph image file")
+):
+    """
+    Submit an analysis job and return immediately with its id
+    
+    Poll GET /jobs/{job_id} for status and GET /jobs/{job_id}/result for the result.
+    """
+    prepared_image = await _prepare_upload(chart_image)
+    try:
+        job_id = await job_queue.submit(task_description, prepared_image)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Job status and per-node progress
+    """
+    job = await job_queue.get(job_id, tenant=request_tenant.get())
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("result", None)
+    return job
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Result of a finished job (202 while the job is still queued or running)
+    """
+    job = await job_queue.get(job_id, tenant=request_tenant.get())
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job["status"] == "failed":
+        raise HTTPException(
+            status_code=500,
+            detail=f"Analysis failed: {job.get('error') or 'Unknown error'}"
+        )
+    if job["status"] != "succeeded":
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job_id, "status": job["status"], "progress": job["progress"]}
+        )
+    
+    result = job["result"]
+    return {
+        "success": True,
+        "data": {
+            "chart_analysis": result["chart_analysis"],
+            "ielts_writing": result["ielts_writing"],
+            "processing_time": result["processing_time"]
+        }
+    }
+
+@app.get("/jobs-stats")
+async def get_job_stats():
+    """
+    Queue depth and worker utilisation of the job queue
+    """
+    return job_queue.stats()
+
 @app.post("/analyze-json", response_model=dict)
 async def analyze_ielts_json(request: AnalysisRequest):
     """
@@ -172,35 +478,180 @@ async def analyze_ielts_json(request: AnalysisRequest):
                 detail="image_base64 is required"
             )
         
+        try:
+            # Prefix, độ dài, giới hạn kích thước và magic bytes: không decode cả chuỗi,
+            # payload hỏng bị từ chối ngay trên event loop
+            check_base64_image(request.image_base64)
+            # Decode + chuẩn hoá (cùng pipeline với /analyze) trong worker thread
+            prepared_image = await asyncio.to_thread(prepare_base64_image, request.image_base64)
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except UnsupportedImageError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=str(e)
+            )
+        
         result = await workflow.process_request(
             task_description=request.task_description,
-            image_base64=request.image_base64
+            image=prepared_image,
+            num_variants=request.variants
         )
         
         if not result.get("success"):
             raise HTTPException(
-                status_code=500,
+                status_code=result.get("status_code", 500),
                 detail=f"Analysis failed: {result.get('error', 'Unknown error')}"
             )
         
-        return {
+        response = {
             "success": True,
             "data": {
                 "chart_analysis": result["chart_analysis"],
                 "ielts_writing": result["ielts_writing"],
                 "processing_time": result["processing_time"]
+            },
+            "metadata": {
+                "image_info": prepared_image.info(),
+                "analysis_id": result.get("analysis_id"),
+                "result_id": result.get("result_id"),
+                "chart_prediction": result.get("chart_prediction"),
+                "node_timings": result.get("node_timings", {}),
+                "token_usage": result.get("token_usage", {})
             }
         }
+        _add_candidates(response, result, request.include_candidates)
+        return response
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in JSON endpoint: {str(e)}")
+        logger.exception("Unexpected error in /analyze-json")
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
 
+@app.get("/analyses/{analysis_id}")
+async def get_analysis(analysis_id: str):
+    """
+    Stored chart analysis for a previous request
+    """
+    record = (
+        await workflow.analysis_store.load(analysis_id, tenant=request_tenant.get())
+        if workflow.analysis_store else None
+    )
+    if record is None:
+        raise HTTPException(status_code=404, detail="Analysis not found or expired")
+    return record
+
+@app.post("/analyses/{analysis_id}/regenerate", response_model=dict)
+async def regenerate_essay(analysis_id: str, request: Optional[RegenerateRequest] = None):
+    """
+    Write a new essay from a stored chart analysis
+    
+    Skips the vision call: only the essay generation step runs, optionally
+    aimed at a different band score.
+    """
+    target_band = request.target_band if request else None
+    result = await workflow.regenerate(analysis_id, target_band=target_band)
+    
+    if not result.get("success"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=f"Regeneration failed: {result.get('error', 'Unknown error')}"
+        )
+    
+    return {
+        "success": True,
+        "data": {
+            "chart_analysis": result["chart_analysis"],
+            "ielts_writing": result["ielts_writing"],
+            "processing_time": result["processing_time"]
+        },
+        "metadata": {
+            "task_description": result["task_description"],
+            "analysis_id": analysis_id,
+            "result_id": result.get("result_id"),
+            "target_band": target_band,
+            "node_timings": result.get("node_timings", {}),
+            "token_usage": result.get("token_usage", {})
+        }
+    }
+
+@app.get("/results")
+async def list_results(
+    session_id: Optional[str] = Query(None, description="Session to list (defaults to the X-Session-ID header)"),
+    image_sha256: Optional[str] = Query(None, description="Only results for this image"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """
+    Paginated history of stored results, newest first
+    
+    Scoped to the caller's tenant and one session (session_id or X-Session-ID is
+    required, so a caller cannot list other users' history). Only summaries are
+    returned; fetch the full analysis and essay with GET /results/{result_id}.
+    """
+    if workflow.result_history is None:
+        raise HTTPException(status_code=404, detail="Result history is disabled")
+    session_id = session_id or request_session.get()
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id or X-Session-ID header is required")
+    try:
+        return await workflow.result_history.page(
+            request_tenant.get(),
+            session_id=session_id,
+            image_sha256=image_sha256,
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/results/{result_id}")
+async def get_result(result_id: str):
+    """
+    A stored result: chart analysis, essay, timings and token usage of a previous run
+    """
+    record = None
+    if workflow.result_history is not None:
+        record = await workflow.result_history.get(result_id, request_tenant.get())
+    if record is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return record
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """
+    Hit/miss counters and size of the chart analysis cache
+    """
+    if workflow.chart_cache is None:
+        return {"enabled": False}
+    stats = await asyncio.to_thread(workflow.chart_cache.stats)
+    return {"enabled": True, **stats}
+
+@app.get("/scheduler-stats")
+async def get_scheduler_stats():
+    """
+    Queue depth per priority/tenant and quota usage of the Gemini scheduler
+    """
+    stats = get_gemini_scheduler().stats()
+    stats["resilience"] = {
+        "analyze_chart": workflow.gemini_service.chart_caller.stats(),
+        "generate_writing": workflow.gemini_service.writing_caller.stats()
+    }
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus metrics: node/model/HTTP latency histograms, payload sizes, cache hits, in-flight gauges
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/workflow-info")
 async def get_workflow_info():
     """
@@ -216,22 +667,38 @@ async def get_workflow_info():
                 "description": "Validate input task description and image"
             },
             {
-                "step": 2, 
+                "step": 2,
+                "name": "classify_chart",
+                "description": "Guess the chart type on CPU and pick the analysis prompt"
+            },
+            {
+                "step": 3, 
                 "name": "analyze_chart",
-                "description": "Analyze chart image using Gemini Vision API"
+                "description": "Analyze chart image using Gemini Vision API",
+                "variants": [f"analyze_{chart_type}" for chart_type in SPECIALIZED_CHART_TYPES]
             },
             {
-                "step": 3,
+                "step": 4,
                 "name": "process_data", 
                 "description": "Process and structure extracted data"
             },
             {
-                "step": 4,
+                "step": 5,
                 "name": "generate_writing",
-                "description": "Generate IELTS Writing Task 1 essay"
+                "description": "Generate IELTS Writing Task 1 essay (when variants=1)"
             },
             {
                 "step": 5,
+                "name": "generate_variant",
+                "description": "Generate one of N essay variants in parallel (when variants>1)"
+            },
+            {
+                "step": 6,
+                "name": "select_essay",
+                "description": "Score the essay variants and keep the best one"
+            },
+            {
+                "step": 7,
                 "name": "finalize_result",
                 "description": "Finalize and format results"
             }
@@ -245,6 +712,7 @@ async def get_workflow_info():
     }
 
 if __name__ == "__main__":
+    # Chế độ dev (1 process, auto-reload); production: python -m app.cli --workers N
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0", 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from enum import Enum
 
@@ -10,9 +10,21 @@ class ChartType(str, Enum):
     MIXED_CHART = "mixed_chart"
     UNKNOWN = "unknown"
 
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
 class AnalysisRequest(BaseModel):
     task_description: str
     image_base64: Optional[str] = None
+    # Số bài viết sinh song song (best-of-N); các bài còn lại trả về nếu include_candidates
+    variants: int = 1
+    include_candidates: bool = False
+
+class RegenerateRequest(BaseModel):
+    target_band: Optional[float] = Field(None, ge=0, le=9)
 
 class ChartAnalysis(BaseModel):
     chart_type: ChartType
@@ -23,6 +35,8 @@ class ChartAnalysis(BaseModel):
     trends: List[str]
     comparisons: List[str]
     insights: Optional[List[str]] = None
+    # Dữ kiện tính sẵn từ raw_data bởi numeric_engine
+    computed_facts: Optional[List[str]] = None
     raw_data: Optional[Dict[str, Any]] = None
 
 class IELTSWritingResponse(BaseModel):
@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from app.services.metrics import CACHE_REQUESTS
+
+
+def normalize_task_description(task_description: str) -> str:
+    """Chuẩn hoá đề bài để các biến thể khoảng trắng/hoa thường dùng chung cache"""
+    return " ".join(task_description.lower().split())
+
+
+class CacheBackend(ABC):
+    """
+    Interface cho backend lưu cache
+
+    Values are JSON-serializable dicts. Backends store them serialized so that
+    callers always get a fresh copy (workflow nodes mutate the dicts they receive).
+    """
+
+    # True nếu get/set làm I/O blocking và nên chạy trong worker thread
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU cache with TTL and entry/byte limits"""
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at, payload)
+        self._entries: "OrderedDict[str, Tuple[Optional[float], str]]" = OrderedDict()
+        self._total_bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(payload)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        if len(payload) > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, payload)
+            self._total_bytes += len(payload)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, payload = self._entries.pop(key)
+        self._total_bytes -= len(payload)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """On-disk cache backed by SQLite, evicting least recently used entries by size"""
+
+    blocking = True
+
+    def __init__(self, path: str = "chart_cache.sqlite3", max_entries: int = 10000,
+                 max_bytes: int = 256 * 1024 * 1024, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at)"
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, created_at = row
+            if self.ttl_seconds and created_at + self.ttl_seconds < now:
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(payload)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now, now),
+                )
+                self._evict_locked()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict_locked(self) -> None:
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT key, size FROM cache_entries ORDER BY accessed_at ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (row[0],))
+            count -= 1
+            total -= row[1]
+            self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": count,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self._evictions,
+        }
+
+
+class ChartAnalysisCache:
+    """
+    Content-addressed cache cho kết quả analyze_chart
+
+    Key = sha256 của bytes ảnh + sha256 của đề bài đã chuẩn hoá + prompt đã dùng,
+    nên cùng một biểu đồ với cùng đề bài sẽ trả về ngay mà không gọi Gemini Vision.
+    """
+
+    # v2: thêm tên prompt (prompt riêng theo loại biểu đồ) vào key
+    KEY_VERSION = "v2"
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, image_hash: str, task_description: str, prompt_name: str = "chart_analysis") -> str:
+        """
+        image_hash là sha256 hex của bytes ảnh (PreparedImage.sha256)
+
+        prompt_name: template đã dùng để phân tích; kết quả từ prompt chung và
+        prompt riêng theo loại biểu đồ không dùng lẫn cho nhau.
+        """
+        task_hash = hashlib.sha256(
+            normalize_task_description(task_description).encode("utf-8")
+        ).hexdigest()
+        return f"chart:{self.KEY_VERSION}:{prompt_name}:{image_hash}:{task_hash}"
+
+    def _record_lookup(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache="chart_analysis", result="hit" if hit else "miss")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.backend.get(key)
+        self._record_lookup(value is not None)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.backend.set(key, value)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.backend.blocking:
+            value = await asyncio.to_thread(self.backend.get, key)
+        else:
+            value = self.backend.get(key)
+        self._record_lookup(value is not None)
+        return value
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.set, key, value)
+        else:
+            self.backend.set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+def create_chart_cache() -> Optional[ChartAnalysisCache]:
+    """
+    Tạo cache từ biến môi trường
+
+    CHART_CACHE_BACKEND: memory (mặc định) | sqlite | none
+    """
+    backend_name = os.getenv("CHART_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("CHART_CACHE_TTL_SECONDS", "604800")) or None
+
+    if backend_name == "none":
+        return None
+    if backend_name == "sqlite":
+        backend = SQLiteCacheBackend(
+            path=os.getenv("CHART_CACHE_PATH", "chart_cache.sqlite3"),
+            max_entries=int(os.getenv("CHART_CACHE_MAX_ENTRIES", "10000")),
+            max_bytes=int(os.getenv("CHART_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+            ttl_seconds=ttl,
+        )
+    elif backend_name == "memory":
+        backend = MemoryCacheBackend(
+            max_entries=int(os.getenv("CHART_CACHE_MAX_ENTRIES", "512")),
+            max_bytes=int(os.getenv("CHART_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=ttl,
+        )
+    else:
+        raise ValueError(f"Unknown CHART_CACHE_BACKEND: {backend_name}")
+
+    return ChartAnalysisCache(backend)
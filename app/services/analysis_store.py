@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.services.analysis_cache import CacheBackend, MemoryCacheBackend, SQLiteCacheBackend
+
+
+class AnalysisStore:
+    """
+    Lưu chart_analysis đã xử lý (sau process_data) theo analysis_id
+
+    Cho phép viết lại bài (biến thể khác, band khác) mà không chạy lại bước
+    phân tích ảnh bằng Gemini Vision. Dùng lại các CacheBackend của chart cache,
+    nên có sẵn TTL và giới hạn số entry.
+    """
+
+    KEY_PREFIX = "analysis:v1:"
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    async def _call(self, func, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def save(self, task_description: str, chart_analysis: Dict[str, Any],
+                   image_sha256: Optional[str] = None,
+                   essay_candidates: Optional[List[Dict[str, Any]]] = None,
+                   tenant: str = "default") -> str:
+        analysis_id = uuid.uuid4().hex
+        await self._call(self.backend.set, self.KEY_PREFIX + analysis_id, {
+            "analysis_id": analysis_id,
+            "task_description": task_description,
+            "chart_analysis": chart_analysis,
+            "image_sha256": image_sha256,
+            # Các bài viết best-of-N (kể cả bài không được chọn), nếu có
+            "essay_candidates": essay_candidates,
+            "tenant": tenant,
+            "created_at": time.time(),
+        })
+        return analysis_id
+
+    async def load(self, analysis_id: str, tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Analysis theo id; với tenant thì analysis của tenant khác coi như không tồn tại"""
+        record = await self._call(self.backend.get, self.KEY_PREFIX + analysis_id)
+        if record is not None and tenant is not None and record.get("tenant", "default") != tenant:
+            return None
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        return self.backend.stats()
+
+
+def create_analysis_store() -> Optional[AnalysisStore]:
+    """
+    Tạo analysis store từ biến môi trường
+
+    ANALYSIS_STORE_BACKEND: memory (mặc định) | sqlite | none
+    """
+    backend_name = os.getenv("ANALYSIS_STORE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("ANALYSIS_STORE_TTL_SECONDS", "86400")) or None
+
+    if backend_name == "none":
+        return None
+    if backend_name == "sqlite":
+        backend = SQLiteCacheBackend(
+            path=os.getenv("ANALYSIS_STORE_PATH", "analyses.sqlite3"),
+            max_entries=int(os.getenv("ANALYSIS_STORE_MAX_ENTRIES", "100000")),
+            max_bytes=int(os.getenv("ANALYSIS_STORE_MAX_BYTES", str(512 * 1024 * 1024))),
+            ttl_seconds=ttl,
+        )
+    elif backend_name == "memory":
+        backend = MemoryCacheBackend(
+            max_entries=int(os.getenv("ANALYSIS_STORE_MAX_ENTRIES", "2000")),
+            max_bytes=int(os.getenv("ANALYSIS_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=ttl,
+        )
+    else:
+        raise ValueError(f"Unknown ANALYSIS_STORE_BACKEND: {backend_name}")
+
+    return AnalysisStore(backend)
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Any, List, Optional, IO, Tuple, Union
+
+from app.services.image_processing import SNIFF_BYTES, prepare_image, sniff_image_format
+from app.services.rate_limiter import AsyncTokenBucket
+from app.services.request_context import Priority, request_priority, request_deadline
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
+# Giới hạn kích thước mỗi ảnh trong batch: file upload multipart và file giải nén
+# trong zip (chống zip bomb). BATCH_MAX_ARCHIVE_MEMBER_BYTES là tên cũ.
+MAX_ITEM_BYTES = int(os.getenv(
+    "BATCH_MAX_ITEM_BYTES", os.getenv("BATCH_MAX_ARCHIVE_MEMBER_BYTES", str(20 * 1024 * 1024))
+))
+
+
+class BatchInputError(ValueError):
+    """Raised when a batch request is malformed (bad archive, mismatched fields, too many items)"""
+
+
+@dataclass
+class BatchItem:
+    index: int
+    filename: str
+    task_description: str
+    # Lấy ảnh (bytes hoặc file đã mở) lúc item được chạy, không đọc hết cả batch vào RAM từ đầu
+    load: Callable[[], Awaitable[Union[bytes, IO[bytes]]]]
+
+
+def _file_size(file: IO[bytes]) -> int:
+    position = file.tell()
+    size = file.seek(0, os.SEEK_END)
+    file.seek(position)
+    return size
+
+
+def items_from_uploads(uploads: List[Any], task_descriptions: List[str]) -> List[BatchItem]:
+    """
+    Build batch items from multipart uploads (cùng thứ tự, cùng số lượng với task_descriptions)
+
+    Ảnh không được đọc vào bộ nhớ: item trả về file spooled của upload để
+    prepare_image đọc thẳng, như /analyze. File lớn hơn MAX_ITEM_BYTES bị từ chối.
+    """
+    if not uploads or not task_descriptions:
+        raise BatchInputError("Provide chart_images and task_descriptions, or a zip archive")
+    if len(uploads) != len(task_descriptions):
+        raise BatchInputError(f"Got {len(uploads)} images but {len(task_descriptions)} task descriptions")
+
+    items = []
+    for index, (upload, task_description) in enumerate(zip(uploads, task_descriptions)):
+        size = upload.size if upload.size is not None else _file_size(upload.file)
+        if size > MAX_ITEM_BYTES:
+            raise BatchInputError(f"Image too large: {upload.filename} ({size} bytes, max {MAX_ITEM_BYTES})")
+
+        async def load(file=upload.file) -> IO[bytes]:
+            file.seek(0)
+            return file
+
+        items.append(BatchItem(index=index, filename=upload.filename, task_description=task_description, load=load))
+    return items
+
+
+def _manifest_entries(text: str) -> List[Tuple[str, str]]:
+    """(tên ảnh, đề bài) từ tasks.json; BatchInputError nếu sai format"""
+    try:
+        manifest = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise BatchInputError(f"tasks.json is not valid JSON: {str(e)}") from e
+
+    if isinstance(manifest, dict):
+        entries = list(manifest.items())
+    elif isinstance(manifest, list):
+        entries = []
+        for position, entry in enumerate(manifest):
+            if not isinstance(entry, dict) or "image" not in entry or "task_description" not in entry:
+                raise BatchInputError(
+                    f"tasks.json entry {position} must be an object with image and task_description"
+                )
+            entries.append((entry["image"], entry["task_description"]))
+    else:
+        raise BatchInputError("tasks.json must be an object or a list of objects")
+
+    for name, task_description in entries:
+        if not isinstance(name, str) or not isinstance(task_description, str):
+            raise BatchInputError(f"tasks.json: image and task_description must be strings ({name!r})")
+    return entries
+
+
+def items_from_archive(archive: IO[bytes]) -> List[BatchItem]:
+    """
+    Build batch items from a zip archive
+
+    Đề bài lấy từ tasks.json ({"chart1.png": "task..."} hoặc
+    [{"image": "chart1.png", "task_description": "task..."}]) nếu có, nếu không
+    thì từ file .txt cùng tên với ảnh (chart1.png + chart1.txt).
+    """
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile as e:
+        raise BatchInputError(f"Invalid zip archive: {str(e)}") from e
+
+    members = {info.filename: info for info in zf.infolist() if not info.is_dir()}
+    for info in members.values():
+        if info.file_size > MAX_ITEM_BYTES:
+            raise BatchInputError(f"Archive member too large: {info.filename}")
+
+    def read_text(name: str) -> str:
+        return zf.read(members[name]).decode("utf-8").strip()
+
+    if "tasks.json" in members:
+        entries = _manifest_entries(read_text("tasks.json"))
+    else:
+        entries = []
+        for name in sorted(members):
+            base, ext = os.path.splitext(name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                if f"{base}.txt" not in members:
+                    raise BatchInputError(f"Missing task description for {name} ({base}.txt)")
+                entries.append((name, read_text(f"{base}.txt")))
+
+    items = []
+    for index, (name, task_description) in enumerate(entries):
+        if name not in members:
+            raise BatchInputError(f"Image listed in tasks.json not found in archive: {name}")
+
+        async def load(info=members[name]) -> bytes:
+            return await asyncio.to_thread(zf.read, info)
+
+        items.append(BatchItem(index=index, filename=name, task_description=task_description, load=load))
+    return items
+
+
+class BatchRunner:
+    """
+    Chạy nhiều chart qua IELTSAnalysisWorkflow đồng thời, có giới hạn
+
+    Tất cả item dùng chung một workflow (và do đó một GeminiService/client).
+    `max_concurrency` giới hạn số item chạy cùng lúc trong một batch; rate_limiter
+    (dùng chung toàn process) giới hạn tốc độ bắt đầu workflow của mọi batch.
+    """
+
+    def __init__(self, workflow, max_concurrency: int = 4,
+                 rate_limiter: Optional[AsyncTokenBucket] = None, max_items: int = 50,
+                 item_timeout: float = 120.0):
+        self.workflow = workflow
+        self.item_timeout = item_timeout
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.max_items = max_items
+
+    async def run(self, items: List[BatchItem]) -> Dict[str, Any]:
+        if not items:
+            raise BatchInputError("Batch is empty")
+        if len(items) > self.max_items:
+            raise BatchInputError(f"Batch has {len(items)} items, maximum is {self.max_items}")
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        start_time = time.time()
+        results = await asyncio.gather(*(self._run_item(item, semaphore) for item in items))
+        succeeded = sum(1 for result in results if result["success"])
+        return {
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "total_time": time.time() - start_time,
+        }
+
+    async def _run_item(self, item: BatchItem, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        # Mỗi item chạy trong task riêng (gather), nên chỉ ảnh hưởng đến item này
+        request_priority.set(Priority.BATCH)
+        submitted_at = time.time()
+        timings: Dict[str, float] = {}
+        result: Dict[str, Any] = {
+            "index": item.index,
+            "filename": item.filename,
+            "task_description": item.task_description,
+        }
+
+        async with semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            started_at = time.time()
+            timings["queue_wait"] = started_at - submitted_at
+            # Deadline tính cho từng item, không phải cho cả batch
+            request_deadline.set(time.monotonic() + self.item_timeout)
+            try:
+                image_data = await item.load()
+                # Như /analyze: nhận dạng theo magic bytes trước khi decode cả ảnh
+                if isinstance(image_data, bytes):
+                    head = image_data[:SNIFF_BYTES]
+                else:
+                    head = image_data.read(SNIFF_BYTES)
+                    image_data.seek(0)
+                if sniff_image_format(head) is None:
+                    raise ValueError("Unsupported image format (PNG, JPEG, GIF, WEBP, BMP or TIFF expected)")
+                prepared_image = await asyncio.to_thread(prepare_image, image_data)
+                del image_data
+                timings["image_preprocessing"] = time.time() - started_at
+
+                workflow_result = await self.workflow.process_request(
+                    task_description=item.task_description,
+                    image=prepared_image
+                )
+                timings["workflow"] = workflow_result.get("processing_time", 0.0)
+
+                if workflow_result.get("success"):
+                    result["success"] = True
+                    result["data"] = {
+                        "chart_analysis": workflow_result["chart_analysis"],
+                        "ielts_writing": workflow_result["ielts_writing"],
+                        "processing_time": workflow_result["processing_time"]
+                    }
+                    result["image_info"] = prepared_image.info()
+                else:
+                    result["success"] = False
+                    result["error"] = workflow_result.get("error", "Unknown error")
+
+            except ValueError as e:
+                result["success"] = False
+                result["error"] = str(e)
+            except Exception as e:
+                logger.exception("Batch item failed", extra={"item": item.index})
+                result["success"] = False
+                result["error"] = f"Internal error: {str(e)}"
+
+        timings["total"] = time.time() - submitted_at
+        result["timings"] = timings
+        return result
+
+
+def create_batch_runner(workflow) -> BatchRunner:
+    rate_limit = float(os.getenv("BATCH_RATE_LIMIT_PER_MINUTE", "60"))
+    rate_limiter = None
+    if rate_limit > 0:
+        rate_limiter = AsyncTokenBucket.per_minute(
+            rate_limit, burst=float(os.getenv("BATCH_RATE_LIMIT_BURST", "10"))
+        )
+    return BatchRunner(
+        workflow,
+        max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", "4")),
+        rate_limiter=rate_limiter,
+        max_items=int(os.getenv("BATCH_MAX_ITEMS", "50")),
+        item_timeout=float(os.getenv("BATCH_ITEM_TIMEOUT_SECONDS", "120")),
+    )
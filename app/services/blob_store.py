@@ -0,0 +1,66 @@
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Generic, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class BlobNotFoundError(KeyError):
+    """Handle không tồn tại hoặc request sở hữu blob đã kết thúc"""
+
+
+class BlobStore(Generic[T]):
+    """
+    Giữ các object lớn (ảnh đã chuẩn hoá) của request đang chạy, tham chiếu bằng handle
+
+    State của LangGraph chỉ mang handle (chuỗi ngắn) nên việc copy/merge state
+    sau mỗi bước không đụng tới bytes của ảnh, và chỉ node cần ảnh mới lấy ra.
+    Blob thuộc về request đã put nó: hold() giải phóng khi request kết thúc,
+    kể cả khi lỗi hoặc bị huỷ, nên store không giữ ảnh của request đã xong.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._blobs: Dict[str, T] = {}
+        self._sizes: Dict[str, int] = {}
+        # Node sync chạy trong thread pool của LangGraph
+        self._lock = threading.Lock()
+
+    def put(self, blob: T, size: int = 0) -> str:
+        handle = f"{self.name}:{uuid.uuid4().hex}"
+        with self._lock:
+            self._blobs[handle] = blob
+            self._sizes[handle] = size
+        return handle
+
+    def get(self, handle: str) -> T:
+        with self._lock:
+            try:
+                return self._blobs[handle]
+            except KeyError:
+                raise BlobNotFoundError(handle) from None
+
+    def release(self, handle: Optional[str]) -> None:
+        if handle is None:
+            return
+        with self._lock:
+            self._blobs.pop(handle, None)
+            self._sizes.pop(handle, None)
+
+    @contextmanager
+    def hold(self, blob: Optional[T], size: int = 0) -> Iterator[Optional[str]]:
+        """put() trong phạm vi một request; blob None cho handle None"""
+        handle = self.put(blob, size) if blob is not None else None
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"items": len(self._blobs), "bytes": sum(self._sizes.values())}
+
+
+# Ảnh của các workflow đang chạy (mỗi process một store)
+IMAGE_BLOBS: BlobStore = BlobStore("image")
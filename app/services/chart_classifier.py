@@ -0,0 +1,231 @@
+import io
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.models.schemas import ChartType
+from app.services.image_processing import PreparedImage
+from app.services.metrics import CHART_PREDICTIONS, CHART_CLASSIFY_LATENCY
+
+# Cạnh dài nhất của ảnh thu nhỏ dùng để phân loại
+CLASSIFY_SIZE = 256
+# Khác biệt so với màu nền để coi là nội dung (0-255)
+FOREGROUND_THRESHOLD = 24
+# Pixel "có màu": saturation và value tối thiểu (HSV 0-255)
+COLOR_MIN_SATURATION = 70
+COLOR_MIN_VALUE = 60
+# Dưới ngưỡng này trả về unknown (dùng prompt chung)
+MIN_CONFIDENCE = float(os.getenv("CHART_CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+
+
+@dataclass
+class ChartPrediction:
+    chart_type: str
+    confidence: float
+    # Loại của từng biểu đồ khi ảnh có nhiều biểu đồ (mixed_chart)
+    components: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "chart_type": self.chart_type,
+            "confidence": round(self.confidence, 3),
+            "components": self.components,
+        }
+
+
+UNKNOWN = ChartPrediction(ChartType.UNKNOWN.value, 0.0)
+
+
+def _load_rgb(image: PreparedImage) -> np.ndarray:
+    with Image.open(io.BytesIO(image.data)) as source:
+        # draft: JPEG decode thẳng ở độ phân giải thấp
+        source.draft("RGB", (CLASSIFY_SIZE * 2, CLASSIFY_SIZE * 2))
+        thumb = source.convert("RGB")
+        thumb.thumbnail((CLASSIFY_SIZE, CLASSIFY_SIZE), Image.BOX)
+        return np.asarray(thumb, dtype=np.int32)
+
+
+def _masks(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(foreground, colored): khác màu nền, và có màu (không phải chữ/trục/lưới xám)"""
+    h, w, _ = rgb.shape
+    corners = [tuple(rgb[0, 0]), tuple(rgb[0, w - 1]), tuple(rgb[h - 1, 0]), tuple(rgb[h - 1, w - 1])]
+    background = np.array(max(set(corners), key=corners.count), dtype=np.int32)
+    foreground = np.abs(rgb - background).max(axis=2) > FOREGROUND_THRESHOLD
+
+    high = rgb.max(axis=2)
+    low = rgb.min(axis=2)
+    saturation = np.where(high > 0, (high - low) * 255 // np.maximum(high, 1), 0)
+    colored = foreground & (saturation >= COLOR_MIN_SATURATION) & (high >= COLOR_MIN_VALUE)
+    return foreground, colored
+
+
+def _runs(occupied: np.ndarray) -> List[Tuple[int, int]]:
+    """Các đoạn liên tiếp True [start, end) của mảng bool 1 chiều"""
+    edges = np.diff(np.concatenate(([0], occupied.astype(np.int8), [0])))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _run_counts(mask: np.ndarray) -> np.ndarray:
+    """Số đoạn True liên tiếp trong mỗi cột của mask 2 chiều"""
+    return mask[0].astype(np.int32) + (mask[1:] & ~mask[:-1]).sum(axis=0)
+
+
+def _largest_run(counts: np.ndarray) -> Tuple[int, int]:
+    """Đoạn dài nhất mà số pixel mỗi cột/hàng >= 20% cực đại (bỏ chú thích, chữ nhỏ)"""
+    runs = _runs(counts >= max(1, 0.2 * counts.max()))
+    return max(runs, key=lambda run: run[1] - run[0]) if runs else (0, 0)
+
+
+def _pie_score(foreground: np.ndarray, colored: np.ndarray) -> float:
+    """
+    Khối lớn nhất gần như một hình tròn đặc: trong đường tròn nội tiếp kín, 4 góc trống
+
+    Dùng foreground (không chỉ pixel có màu) để nhận cả pie màu nhạt/xám.
+    """
+    if colored.sum() < 200 and foreground.sum() < 2000:
+        return 0.0
+    # Khối lớn nhất theo chiều ngang rồi chiều dọc (bỏ chú thích, tiêu đề đứng riêng)
+    left, right = _largest_run(foreground.sum(axis=0))
+    top, bottom = _largest_run(foreground[:, left:right].sum(axis=1))
+    height, width = bottom - top, right - left
+    if min(height, width) < 20 or not 0.8 <= width / height <= 1.25:
+        return 0.0
+    box = foreground[top:bottom, left:right]
+    yy, xx = np.mgrid[0:height, 0:width]
+    dist = ((yy - height / 2 + 0.5) / (height / 2)) ** 2 + ((xx - width / 2 + 0.5) / (width / 2)) ** 2
+    inside = box[dist <= 0.8].mean()
+    corners = box[dist >= 1.3].mean() if (dist >= 1.3).any() else 1.0
+    return float(np.clip((inside - 0.7) / 0.2, 0, 1) * np.clip((0.3 - corners) / 0.2, 0, 1))
+
+
+def _bar_score(colored: np.ndarray) -> float:
+    """
+    Cột màu đặc mọc từ cùng một đường đáy (thử cả cột dọc và thanh ngang)
+
+    Mỗi cột pixel cắt qua một bar là một đoạn màu liền; đáy của các đoạn đó gần
+    như trùng nhau. Đường kẻ (line chart) mảnh, hình tròn (pie) không chung đáy.
+    """
+    best = 0.0
+    # Thanh ngang: lật trái-phải rồi transpose để gốc bên trái thành "đáy"
+    for mask in (colored, colored[:, ::-1].T):
+        counts = mask.sum(axis=0)
+        occupied = counts >= 3
+        if occupied.sum() < 10:
+            continue
+        # Cột cắt qua đúng một đoạn màu liền
+        solid = occupied & (_run_counts(mask) == 1)
+        if solid.sum() < 10:
+            continue
+        bottoms = mask.shape[0] - 1 - np.argmax(mask[::-1], axis=0)[solid]
+        aligned = np.mean(np.abs(bottoms - np.median(bottoms)) <= 2)
+        # Phần lớn các bar có chiều cao khác nhau; toàn bộ cùng chiều cao là một khối đặc
+        tops_vary = len(np.unique(counts[solid])) > 2
+        score = (solid.sum() / occupied.sum()) * np.clip((aligned - 0.5) / 0.4, 0, 1) * (1.0 if tops_vary else 0.5)
+        best = max(best, float(score))
+    return best
+
+
+def _line_score(colored: np.ndarray) -> float:
+    """Nét có màu mảnh trải dài theo chiều ngang: ít pixel mỗi cột, phủ phần lớn chiều rộng"""
+    columns = colored.sum(axis=0)
+    occupied = columns > 0
+    if occupied.sum() < 10 or colored.mean() > 0.12:
+        return 0.0
+    # Độ dày trung bình của mỗi nét cắt qua cột (điểm đánh dấu làm dày thêm ở vài cột)
+    thickness = columns[occupied] / np.maximum(1, _run_counts(colored)[occupied])
+    median_thickness = float(np.median(thickness))
+    # Độ phủ trong phạm vi ngang của vùng màu
+    xs = np.nonzero(occupied)[0]
+    coverage = occupied[xs.min():xs.max() + 1].mean()
+    span = (xs.max() - xs.min() + 1) / colored.shape[1]
+    return float(
+        np.clip((6 - median_thickness) / 3, 0, 1)
+        * np.clip((coverage - 0.6) / 0.3, 0, 1)
+        * np.clip((span - 0.2) / 0.3, 0, 1)
+    )
+
+
+def _table_score(foreground: np.ndarray, colored: np.ndarray) -> float:
+    """Lưới kẻ ngang/dọc chạy gần hết bảng, gần như không có vùng màu"""
+    ys, xs = np.nonzero(foreground)
+    if len(xs) < 100:
+        return 0.0
+    region = foreground[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+    horizontal = _runs(region.mean(axis=1) >= 0.7)
+    vertical = _runs(region.mean(axis=0) >= 0.7)
+    colored_fraction = colored.mean()
+    if len(horizontal) < 3 or len(vertical) < 2:
+        return 0.0
+    return float(min(1.0, (len(horizontal) - 1) / 4) * np.clip((0.15 - colored_fraction) / 0.1, 0, 1))
+
+
+def _classify_region(foreground: np.ndarray, colored: np.ndarray) -> ChartPrediction:
+    scores = {
+        ChartType.PIE_CHART.value: _pie_score(foreground, colored),
+        ChartType.BAR_CHART.value: _bar_score(colored),
+        ChartType.LINE_CHART.value: _line_score(colored),
+        ChartType.TABLE.value: _table_score(foreground, colored),
+    }
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, runner_up) = ranked[0], ranked[1]
+    # Hai loại cùng khớp thì giảm độ tin cậy
+    confidence = best_score * (1 - 0.5 * runner_up)
+    return ChartPrediction(best, confidence)
+
+
+def _split_panels(foreground: np.ndarray) -> Optional[Tuple[slice, slice]]:
+    """Tìm khe trống (dọc hoặc ngang) chia ảnh thành hai biểu đồ"""
+    for axis in (0, 1):
+        # Cột/hàng gần như trống (tiêu đề chung chạy ngang qua khe chỉ chiếm vài pixel)
+        profile = foreground.mean(axis=axis) >= 0.04
+        size = len(profile)
+        gaps = [(start, end) for start, end in _runs(~profile)
+                if end - start >= max(3, size // 50) and size * 0.25 <= (start + end) / 2 <= size * 0.75]
+        if gaps:
+            start, end = max(gaps, key=lambda gap: gap[1] - gap[0])
+            middle = (start + end) // 2
+            if axis == 0:
+                return (np.s_[:, :middle], np.s_[:, middle:])
+            return (np.s_[:middle, :], np.s_[middle:, :])
+    return None
+
+
+def classify_chart(image: PreparedImage) -> ChartPrediction:
+    """
+    Đoán loại biểu đồ bằng heuristic trên ảnh thu nhỏ, chỉ dùng CPU
+
+    Pie: hình tròn đặc có màu; bar: các khối chữ nhật chung đáy; line: nét màu
+    mảnh trải ngang; table: lưới kẻ, không có màu. Ảnh có khe trống chia đôi được
+    phân loại từng nửa: hai loại khác nhau thì là mixed_chart. Độ tin cậy dưới
+    CHART_CLASSIFIER_MIN_CONFIDENCE thì trả về unknown để dùng prompt chung.
+    CPU-bound (~10-30ms): gọi qua asyncio.to_thread từ node async.
+    """
+    started_at = time.perf_counter()
+    try:
+        foreground, colored = _masks(_load_rgb(image))
+    except Exception:
+        return UNKNOWN
+
+    prediction = _classify_region(foreground, colored)
+    panels = _split_panels(foreground)
+    if panels is not None:
+        parts = [_classify_region(foreground[panel], colored[panel]) for panel in panels]
+        if (all(part.confidence >= MIN_CONFIDENCE for part in parts)
+                and parts[0].chart_type != parts[1].chart_type):
+            prediction = ChartPrediction(
+                ChartType.MIXED_CHART.value,
+                min(part.confidence for part in parts),
+                components=[part.chart_type for part in parts],
+            )
+
+    if prediction.confidence < MIN_CONFIDENCE:
+        prediction = ChartPrediction(ChartType.UNKNOWN.value, prediction.confidence)
+    CHART_CLASSIFY_LATENCY.observe(time.perf_counter() - started_at)
+    CHART_PREDICTIONS.inc(chart_type=prediction.chart_type)
+    return prediction
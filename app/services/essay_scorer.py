@@ -0,0 +1,83 @@
+import re
+from typing import Any, Dict, List
+
+# Độ dài khuyến nghị cho Writing Task 1
+MIN_WORDS = 150
+MAX_WORDS = 200
+# Số linking word khác nhau để đạt điểm tối đa
+TARGET_LINKING_WORDS = 6
+
+LINKING_WORDS = (
+    "while", "whereas", "however", "in contrast", "by contrast", "similarly", "likewise",
+    "furthermore", "moreover", "in addition", "additionally", "meanwhile", "overall",
+    "in comparison", "on the other hand", "although", "conversely", "subsequently",
+    "following this", "thereafter", "finally", "respectively", "as a result", "consequently",
+)
+
+_WORD_RE = re.compile(r"[A-Za-z0-9%.'-]+")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_LINKING_RES = [(word, re.compile(r"\b" + re.escape(word) + r"\b")) for word in LINKING_WORDS]
+_STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "at", "to", "for", "and", "or", "by", "with", "from",
+    "is", "was", "were", "are", "be", "been", "which", "that", "this", "its", "their", "than",
+}
+
+# Trọng số các tiêu chí trong điểm tổng
+WEIGHTS = {"data_coverage": 0.4, "word_count": 0.3, "linking_diversity": 0.3}
+
+
+def count_words(text: str) -> int:
+    return len(_WORD_RE.findall(text))
+
+
+def _word_count_score(word_count: int) -> float:
+    """1.0 trong khoảng 150-200 từ, giảm tuyến tính về 0 khi lệch 50 từ"""
+    if MIN_WORDS <= word_count <= MAX_WORDS:
+        return 1.0
+    distance = MIN_WORDS - word_count if word_count < MIN_WORDS else word_count - MAX_WORDS
+    return max(0.0, 1.0 - distance / 50.0)
+
+
+def _point_covered(point: str, essay_lower: str, essay_numbers: set) -> bool:
+    """
+    Một data point được coi là đã nhắc tới nếu mọi con số của nó xuất hiện trong bài,
+    hoặc (khi không có số) ít nhất một nửa số từ nội dung xuất hiện
+    """
+    numbers = {number.replace(",", ".") for number in _NUMBER_RE.findall(point)}
+    if numbers:
+        return numbers <= essay_numbers
+    words = [w for w in _WORD_RE.findall(point.lower()) if w not in _STOPWORDS and len(w) > 2]
+    if not words:
+        return True
+    return sum(1 for word in words if word in essay_lower) >= len(words) / 2
+
+
+def score_essay(ielts_writing: Dict[str, Any], chart_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Chấm điểm nhanh một bài viết (0-1), không gọi model
+
+    Tiêu chí: số từ trong khoảng 150-200, độ phủ key_data_points của chart_analysis,
+    và số linking word khác nhau. Dùng để chọn bài tốt nhất trong các biến thể.
+    """
+    essay = ielts_writing.get("full_essay") or ""
+    essay_lower = essay.lower()
+    essay_numbers = {number.replace(",", ".") for number in _NUMBER_RE.findall(essay)}
+
+    word_count = count_words(essay)
+    key_points: List[str] = [p for p in chart_analysis.get("key_data_points") or [] if isinstance(p, str)]
+    covered = sum(1 for point in key_points if _point_covered(point, essay_lower, essay_numbers))
+    linking_used = sorted(word for word, pattern in _LINKING_RES if pattern.search(essay_lower))
+
+    criteria = {
+        "word_count": _word_count_score(word_count),
+        "data_coverage": covered / len(key_points) if key_points else 1.0,
+        "linking_diversity": min(1.0, len(linking_used) / TARGET_LINKING_WORDS),
+    }
+    return {
+        "total": round(sum(WEIGHTS[name] * value for name, value in criteria.items()), 4),
+        **{name: round(value, 4) for name, value in criteria.items()},
+        "words": word_count,
+        "data_points_covered": covered,
+        "data_points_total": len(key_points),
+        "linking_words": linking_used,
+    }
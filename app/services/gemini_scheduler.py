@@ -0,0 +1,178 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Any, Optional, Tuple
+
+from app.services.rate_limiter import SQLiteTokenBucket, TokenBucket
+from app.services.request_context import Priority, request_priority, request_tenant
+
+# Gemini 1.5 tính mỗi ảnh là 258 token
+IMAGE_TOKENS = 258
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token từ độ dài text (~4 ký tự/token)"""
+    return max(1, len(text) // 4)
+
+
+class GeminiScheduler:
+    """
+    Điều phối các lời gọi Gemini theo quota requests/phút và tokens/phút
+
+    Mỗi lời gọi phải acquire() trước khi gửi. Khi hết quota, lời gọi được xếp
+    hàng thay vì bắn ra và nhận lỗi 429:
+    - ưu tiên INTERACTIVE trước BATCH
+    - trong cùng mức ưu tiên, chia lượt round-robin giữa các tenant
+
+    `bucket_factory(name, limit_per_minute)` tạo bucket cho "rpm"/"tpm"; mặc định
+    là TokenBucket trong process, SQLiteTokenBucket khi quota dùng chung giữa các worker.
+    """
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 1_000_000,
+                 bucket_factory: Optional[Callable[[str, float], TokenBucket]] = None):
+        bucket_factory = bucket_factory or (lambda name, limit: TokenBucket.per_minute(limit))
+        self.rpm_bucket = bucket_factory("rpm", requests_per_minute) if requests_per_minute > 0 else None
+        self.tpm_bucket = bucket_factory("tpm", tokens_per_minute) if tokens_per_minute > 0 else None
+        # priority -> tenant -> deque[(estimated_tokens, enqueued_at, future)]
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[Tuple[int, float, asyncio.Future]]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.dispatched = 0
+        self.total_queue_time = 0.0
+        self.tokens_estimated = 0
+        self.tokens_used = 0
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.rpm_bucket is not None:
+            wait = max(wait, self.rpm_bucket.time_until(1))
+        if self.tpm_bucket is not None:
+            wait = max(wait, self.tpm_bucket.time_until(tokens))
+        return wait
+
+    def _consume(self, tokens: int) -> None:
+        if self.rpm_bucket is not None:
+            self.rpm_bucket.consume(1)
+        if self.tpm_bucket is not None:
+            self.tpm_bucket.consume(tokens)
+        self.dispatched += 1
+        self.tokens_estimated += tokens
+
+    def _has_waiters(self) -> bool:
+        return any(queue for tenants in self._queues.values() for queue in tenants.values())
+
+    def _next_waiter(self) -> Optional[Tuple[Priority, str]]:
+        """Tenant kế tiếp được phục vụ: mức ưu tiên cao nhất, tenant đầu vòng round-robin"""
+        for priority in Priority:
+            tenants = self._queues[priority]
+            for tenant in list(tenants):
+                queue = tenants[tenant]
+                # Bỏ qua các lời gọi đã bị huỷ (client ngắt kết nối, hết deadline)
+                while queue and queue[0][2].done():
+                    queue.popleft()
+                if queue:
+                    return priority, tenant
+                del tenants[tenant]
+        return None
+
+    async def acquire(self, estimated_tokens: int, priority: Optional[Priority] = None,
+                      tenant: Optional[str] = None) -> float:
+        """
+        Chờ đến lượt gửi một request ước tính `estimated_tokens` token
+
+        priority/tenant mặc định lấy từ request context. Trả về thời gian đã chờ
+        trong hàng đợi (giây).
+        """
+        priority = request_priority.get() if priority is None else priority
+        tenant = request_tenant.get() if tenant is None else tenant
+
+        # Fast path: không ai đang chờ và còn quota
+        if not self._has_waiters() and self._wait_time(estimated_tokens) == 0:
+            self._consume(estimated_tokens)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        self._queues[priority].setdefault(tenant, deque()).append((estimated_tokens, enqueued_at, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        return await future
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            next_waiter = self._next_waiter()
+            if next_waiter is None:
+                return
+            priority, tenant = next_waiter
+            tokens, enqueued_at, future = self._queues[priority][tenant][0]
+
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                # Sau khi ngủ chọn lại từ đầu, vì có thể đã có request ưu tiên cao hơn
+                await asyncio.sleep(wait)
+                continue
+
+            self._queues[priority][tenant].popleft()
+            self._consume(tokens)
+            queue_time = time.monotonic() - enqueued_at
+            self.total_queue_time += queue_time
+            future.set_result(queue_time)
+            # Round-robin: tenant vừa được phục vụ xuống cuối hàng
+            self._queues[priority].move_to_end(tenant)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Bù chênh lệch giữa token ước tính và token thực tế model báo về"""
+        if actual_tokens is None:
+            return
+        self.tokens_used += actual_tokens
+        if self.tpm_bucket is not None and actual_tokens > estimated_tokens:
+            self.tpm_bucket.consume(actual_tokens - estimated_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        queue_depth = {
+            priority.name.lower(): {
+                tenant: sum(1 for _, _, future in queue if not future.done())
+                for tenant, queue in tenants.items()
+            }
+            for priority, tenants in self._queues.items()
+        }
+        return {
+            "queue_depth": queue_depth,
+            "queued_total": sum(sum(t.values()) for t in queue_depth.values()),
+            "dispatched": self.dispatched,
+            "avg_queue_time": self.total_queue_time / self.dispatched if self.dispatched else 0.0,
+            "tokens_estimated": self.tokens_estimated,
+            "tokens_used": self.tokens_used,
+            "rpm_available": self.rpm_bucket.available if self.rpm_bucket else None,
+            "tpm_available": self.tpm_bucket.available if self.tpm_bucket else None,
+        }
+
+
+_scheduler: Optional[GeminiScheduler] = None
+
+
+def get_gemini_scheduler() -> GeminiScheduler:
+    """
+    Scheduler dùng chung trong process (quota tính theo API key, không theo instance)
+
+    GEMINI_QUOTA_BACKEND: memory (mặc định, quota riêng từng process) | sqlite
+    (quota dùng chung giữa các worker process qua GEMINI_QUOTA_PATH)
+    """
+    global _scheduler
+    if _scheduler is None:
+        backend_name = os.getenv("GEMINI_QUOTA_BACKEND", "memory").lower()
+        if backend_name == "sqlite":
+            path = os.getenv("GEMINI_QUOTA_PATH", "gemini_quota.sqlite3")
+            bucket_factory = lambda name, limit: SQLiteTokenBucket.per_minute(path, name, limit)
+        elif backend_name == "memory":
+            bucket_factory = None
+        else:
+            raise ValueError(f"Unknown GEMINI_QUOTA_BACKEND: {backend_name}")
+        _scheduler = GeminiScheduler(
+            requests_per_minute=float(os.getenv("GEMINI_RPM", "60")),
+            tokens_per_minute=float(os.getenv("GEMINI_TPM", "1000000")),
+            bucket_factory=bucket_factory,
+        )
+    return _scheduler
@@ -1,201 +1,291 @@
-import google.generativeai as genai
-import base64
-import io
-from PIL import Image
-from typing import Optional, Dict, Any
-import json
+from typing import Optional, Dict, Any, Callable, List, Tuple
+import logging
 import os
-from dotenv import load_dotenv
+import time
 
-load_dotenv()
+from app.models.schemas import ChartAnalysis, IELTSWritingResponse
+from app.services.image_processing import PreparedImage
+from app.services.model_provider import ModelProvider, get_model_provider
+from app.services.gemini_scheduler import get_gemini_scheduler, estimate_tokens, IMAGE_TOKENS
+from app.services.resilience import PartialStreamError, create_resilient_caller, get_circuit_breaker
+from app.services.metrics import (
+    MODEL_CALL_ERRORS, MODEL_NETWORK_LATENCY, MODEL_PAYLOAD_BYTES, MODEL_QUEUE_LATENCY, MODEL_TOKENS,
+    STRUCTURED_OUTPUTS
+)
+from app.services.structured_output import StructuredOutput, build_reask_prompt, validate_structured
+from app.services.prompts import render_chart_prompt, render_writing_prompt
+from app.services.request_context import add_token_usage
+
+logger = logging.getLogger(__name__)
+
+# Số token output dự kiến, dùng để ước lượng TPM trước khi gọi
+CHART_OUTPUT_TOKENS = 1024
+WRITING_OUTPUT_TOKENS = 768
+REASK_OUTPUT_TOKENS = 384
+# Số lần hỏi lại tối đa khi JSON thiếu field bắt buộc (0 = tắt)
+MAX_REASKS = int(os.getenv("STRUCTURED_OUTPUT_MAX_REASKS", "1"))
 
 class GeminiService:
-    def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
-        
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        self.vision_model = genai.GenerativeModel('gemini-1.5-flash')
+    def __init__(self, provider: Optional[ModelProvider] = None):
+        # Provider (và client SDK bên trong) dùng chung toàn process, không tạo lại mỗi instance
+        self.provider = provider or get_model_provider()
+        self.model = self.provider.model("writing")
+        self.vision_model = self.provider.model("vision")
+        # Scheduler dùng chung toàn process: giới hạn RPM/TPM, ưu tiên interactive
+        self.scheduler = get_gemini_scheduler()
+        # Retry/hedging/circuit breaker cho các lời gọi async
+        self.breaker = get_circuit_breaker("gemini")
+        self.chart_caller = create_resilient_caller("analyze_chart", self.breaker)
+        self.writing_caller = create_resilient_caller("generate_writing", self.breaker)
 
-    def analyze_chart_image(self, image_base64: str, task_description: str) -> Dict[str, Any]:
+    async def _generate_async(self, call: str, model, contents, estimated_tokens: int, timeout: float, **kwargs):
         """
-        Phân tích biểu đồ từ ảnh và trích xuất thông tin
+        Gọi generate_content_async sau khi scheduler cấp quota
+
+        `call` (analyze_chart/generate_writing) là label metrics. Trả về
+        (response, thời điểm gửi request) để tách thời gian chờ quota khỏi thời gian mạng.
         """
+        queue_time = await self.scheduler.acquire(estimated_tokens)
+        MODEL_QUEUE_LATENCY.observe(queue_time, call=call)
+        self.provider.prepare()
+        sent_at = time.perf_counter()
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
-            
-            prompt = f"""
-            Phân tích biểu đồ trong ảnh này theo đề bài IELTS Writing Task 1: "{task_description}"
-
-            QUAN TRỌNG: Ảnh có thể chứa NHIỀU biểu đồ khác nhau (pie chart, bar chart, line chart, table). 
-            Hãy phân tích TẤT CẢ các biểu đồ có trong ảnh và tích hợp thông tin.
-
-            Hãy trả về kết quả trong format JSON với các thông tin sau:
-            {{
-                "chart_type": "loại biểu đồ chính (bar_chart/line_chart/pie_chart/table/mixed_chart)",
-                "chart_components": ["pie_chart", "bar_chart"],
-                "title": "tiêu đề chung của hình",
-                "description": "mô tả chi tiết về TẤT CẢ biểu đồ trong ảnh",
-                "key_data_points": [
-                    "U.S.A accounted for 48% of global bottled water consumption in 1999",
-                    "Asia showed 14% growth in bottled water consumption in 2001"
-                ],
-                "trends": ["các xu hướng chính từ TẤT CẢ dữ liệu"],
-                "comparisons": ["so sánh giữa các nhóm dữ liệu và giữa các biểu đồ"],
-                "insights": ["những insight sâu sắc từ việc kết hợp nhiều biểu đồ"],
-                "raw_data": {{"dữ liệu thô từ TẤT CẢ biểu đồ"}}
-            }}
-
-            QUAN TRỌNG - Format yêu cầu:
-            - key_data_points: PHẢI là array of strings, KHÔNG được là objects
-            - Mỗi data point là 1 câu hoàn chỉnh có số liệu cụ thể
-            - VD: "The U.S.A dominated with 48% of consumption in 1999"
-            - KHÔNG viết: {{"region": "U.S.A", "value": "48%"}}
-            - chart_components: Chỉ tên loại chart như "pie_chart", "bar_chart"
-
-            Hướng dẫn phân tích chi tiết:
-            1. XÁC ĐỊNH TẤT CẢ BIỂU ĐỒ: Đếm và mô tả từng biểu đồ trong ảnh
-            2. ĐỌC SỐ LIỆU CHÍNH XÁC: Trích xuất tất cả con số, phần trăm, năm tháng
-            3. TÌM MỐI LIÊN HỆ: Phân tích mối quan hệ giữa các biểu đồ
-            4. SO SÁNH ĐA CHIỀU: So sánh theo thời gian, theo nhóm, theo biểu đồ
-            5. XU HƯỚNG TỔNG THỂ: Tìm patterns từ việc kết hợp multiple charts
-            6. INSIGHTS SÂU: Đưa ra nhận xét thông minh từ multiple data sources
-
-            Ví dụ cho mixed chart: Nếu có pie chart + bar chart, hãy phân tích:
-            - Pie chart: phân bố tại 1 thời điểm
-            - Bar chart: thay đổi theo thời gian hoặc so sánh groups
-            - Mối liên hệ: regions nào dominant trong pie chart có growth như thế nào trong bar chart
-            """
-
-            response = self.vision_model.generate_content([prompt, image])
-            
-            # Extract JSON from response
-            response_text = response.text
-            # Tìm JSON block trong response
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx]
-                return json.loads(json_str)
-            else:
-                # Fallback if no JSON found
-                return {
-                    "chart_type": "unknown",
-                    "chart_components": [],
-                    "title": "Unable to extract title",
-                    "description": response_text,
-                    "key_data_points": [],
-                    "trends": [],
-                    "comparisons": [],
-                    "insights": [],
-                    "raw_data": {}
-                }
-                
+            response = await model.generate_content_async(
+                contents, request_options={"timeout": timeout}, **kwargs
+            )
         except Exception as e:
-            print(f"Error analyzing chart: {e}")
-            return {
-                "chart_type": "unknown",
-                "chart_components": [],
-                "title": "Error",
-                "description": f"Failed to analyze chart: {str(e)}",
-                "key_data_points": [],
-                "trends": [],
-                "comparisons": [],
-                "insights": [],
-                "raw_data": {}
-            }
+            MODEL_CALL_ERRORS.inc(call=call, error=type(e).__name__)
+            raise
+        return response, sent_at
 
-    def generate_ielts_writing(self, chart_analysis: Dict[str, Any], task_description: str) -> Dict[str, Any]:
+    def _observe_call(self, call: str, sent_at: float, request_bytes: int, response_text: str) -> None:
+        MODEL_NETWORK_LATENCY.observe(time.perf_counter() - sent_at, call=call)
+        MODEL_PAYLOAD_BYTES.observe(request_bytes, call=call, direction="request")
+        MODEL_PAYLOAD_BYTES.observe(len(response_text.encode("utf-8")), call=call, direction="response")
+
+    def _record_usage(self, call: str, response, estimated_tokens: int,
+                      input_tokens: int, response_text: str) -> None:
         """
-        Tạo bài viết IELTS Writing Task 1 dựa trên phân tích biểu đồ
+        Ghi số token của lời gọi: bù quota cho scheduler, histogram MODEL_TOKENS
+        và token_usage của request. Dùng usage_metadata nếu model trả về, không
+        thì ước lượng local (input_tokens đã ước lượng trước khi gọi).
         """
-        try:
-            prompt = f"""
-            Viết một bài IELTS Writing Task 1 hoàn chỉnh dựa trên thông tin sau:
+        usage = getattr(response, "usage_metadata", None)
+        actual_tokens = getattr(usage, "total_token_count", None) if usage else None
+        self.scheduler.record_usage(estimated_tokens, actual_tokens)
+        input_tokens = (getattr(usage, "prompt_token_count", None) if usage else None) or input_tokens
+        output_tokens = (getattr(usage, "candidates_token_count", None) if usage else None) \
+            or estimate_tokens(response_text)
+        MODEL_TOKENS.observe(input_tokens, call=call, direction="input")
+        MODEL_TOKENS.observe(output_tokens, call=call, direction="output")
+        add_token_usage(call, input_tokens, output_tokens)
 
-            Đề bài: {task_description}
-            
-            Phân tích biểu đồ:
-            - Loại biểu đồ: {chart_analysis.get('chart_type', 'unknown')}
-            - Components: {chart_analysis.get('chart_components', [])}
-            - Tiêu đề: {chart_analysis.get('title', 'N/A')}
-            - Mô tả: {chart_analysis.get('description', 'N/A')}
-            - Điểm dữ liệu chính: {chart_analysis.get('key_data_points', [])}
-            - Xu hướng: {chart_analysis.get('trends', [])}
-            - So sánh: {chart_analysis.get('comparisons', [])}
-            - Insights: {chart_analysis.get('insights', [])}
-
-            QUAN TRỌNG - Hướng dẫn viết cho MULTI-CHART:
-            1. INTRODUCTION: Paraphrase đề bài và mô tả TẤT CẢ các biểu đồ có trong hình
-            2. OVERVIEW: Tóm tắt 2-3 xu hướng chính từ TẤT CẢ biểu đồ
-            3. BODY PARAGRAPH 1: Mô tả chi tiết biểu đồ đầu tiên với số liệu cụ thể
-            4. BODY PARAGRAPH 2: Mô tả chi tiết biểu đồ thứ hai và kết nối với biểu đồ đầu
-
-            Hãy viết bài theo cấu trúc IELTS Writing Task 1 chuẩn và trả về JSON format:
-            {{
-                "introduction": "Câu mở đầu paraphrase đề bài và mô tả TẤT CẢ biểu đồ",
-                "overview": "Đoạn tổng quan nêu 2-3 đặc điểm nổi bật nhất từ TẤT CẢ biểu đồ",
-                "body_paragraphs": ["Đoạn chi tiết về biểu đồ 1", "Đoạn chi tiết về biểu đồ 2 và so sánh"],
-                "full_essay": "Toàn bộ bài viết",
-                "word_count": số_từ_ước_tính
-            }}
-
-            Yêu cầu viết bài:
-            - Độ dài: 160-200 từ (nhiều hơn vì có nhiều chart)
-            - Từ vựng academic: utilize, demonstrate, illustrate, significant, substantial
-            - Linking words: while, whereas, in contrast, similarly, furthermore
-            - Số liệu cụ thể: dẫn chứng chính xác từ biểu đồ
-            - Cấu trúc complex sentences
-            - Kết nối logic giữa các biểu đồ
-            - Không opinion, chỉ report data
-
-            Mẫu câu hay cho multi-chart:
-            - "The first chart illustrates... while the second chart demonstrates..."
-            - "Turning to the bar chart, it can be seen that..."
-            - "Comparing the data from both charts reveals that..."
-            """
-
-            response = self.model.generate_content(prompt)
-            response_text = response.text
+    async def _complete_structured(
+        self, call: str, caller, model, contents: List[Any], parser: StructuredOutput, input_tokens: int
+    ) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """
+        Parse response; nếu thiếu field bắt buộc thì chỉ hỏi lại model các field đó
+
+        Lời gọi hỏi lại gửi kèm prompt gốc (và ảnh) cùng JSON đã có, nên rẻ hơn
+        nhiều so với chạy lại cả bước. Hỏi lại thất bại thì giữ phần đã parse được.
+        """
+        data, missing = parser.result()
+        outcome = "repaired" if parser.repaired else "valid"
+        reasks = 0
+        while missing and reasks < MAX_REASKS:
+            reasks += 1
+            outcome = "reasked"
+            logger.info("Re-asking for missing fields", extra={"call": call, "missing": list(missing)})
+            prompt = build_reask_prompt(parser.schema, missing, data)
+            reask_contents = [*contents, prompt]
+            estimated_tokens = input_tokens + estimate_tokens(prompt) + REASK_OUTPUT_TOKENS
+            request_bytes = len(prompt.encode("utf-8"))
             
-            # Extract JSON from response
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
+            async def attempt(timeout: float) -> str:
+                response, sent_at = await self._generate_async(
+                    call, model, reask_contents, estimated_tokens, timeout
+                )
+                self._record_usage(
+                    call, response, estimated_tokens, estimated_tokens - REASK_OUTPUT_TOKENS, response.text
+                )
+                self._observe_call(call, sent_at, request_bytes, response.text)
+                return response.text
             
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx]
-                result = json.loads(json_str)
-                
-                # Ensure word_count is integer
-                if 'word_count' in result:
-                    try:
-                        result['word_count'] = int(result['word_count'])
-                    except:
-                        result['word_count'] = len(result.get('full_essay', '').split())
-                
-                return result
-            else:
-                # Fallback
-                word_count = len(response_text.split())
-                return {
-                    "introduction": "Unable to extract structured response",
-                    "overview": "",
-                    "body_paragraphs": [response_text],
-                    "full_essay": response_text,
-                    "word_count": word_count
-                }
-                
-        except Exception as e:
-            print(f"Error generating IELTS writing: {e}")
+            try:
+                response_text = await caller.call(attempt)
+            except Exception as e:
+                logger.warning("Re-ask failed", extra={"call": call, "error": str(e)})
+                break
+            reask_parser = StructuredOutput(parser.schema)
+            reask_parser.feed(response_text)
+            data, missing = validate_structured({**(data or {}), **(reask_parser.parse() or {})}, parser.schema)
+        
+        if missing:
+            outcome = "fallback"
+        STRUCTURED_OUTPUTS.inc(call=call, outcome=outcome)
+        return data, missing
+
+    def _build_chart_prompt(self, task_description: str, chart_type: Optional[str] = None) -> str:
+        """
+        Tạo prompt phân tích biểu đồ cho Gemini Vision (template compile sẵn trong prompts.py)
+
+        chart_type (từ bộ phân loại cục bộ) chọn prompt ngắn riêng cho loại biểu đồ đó.
+        """
+        return render_chart_prompt(task_description, chart_type)
+
+    def _chart_with_defaults(self, data: Optional[Dict[str, Any]], response_text: str) -> Dict[str, Any]:
+        """Điền giá trị mặc định cho field còn thiếu; không có JSON thì giữ text gốc làm description"""
+        return {
+            "chart_type": "unknown",
+            "chart_components": [],
+            "title": "Unable to extract title",
+            "description": response_text,
+            "key_data_points": [],
+            "trends": [],
+            "comparisons": [],
+            "insights": [],
+            "raw_data": {},
+            **(data or {})
+        }
+
+    async def analyze_chart_image_async(
+        self, image: PreparedImage, task_description: str, chart_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Phân tích biểu đồ từ ảnh và trích xuất thông tin, không block event loop
+        
+        Lỗi tạm thời được retry; nếu vẫn thất bại thì raise ModelCallError thay vì
+        trả về dict placeholder, để workflow dừng sớm.
+        """
+        prompt = self._build_chart_prompt(task_description, chart_type)
+        estimated_tokens = estimate_tokens(prompt) + IMAGE_TOKENS + CHART_OUTPUT_TOKENS
+        
+        request_bytes = len(prompt.encode("utf-8")) + image.size
+        
+        contents = [prompt, image.to_part()]
+        
+        async def attempt(timeout: float) -> StructuredOutput:
+            response, sent_at = await self._generate_async(
+                "analyze_chart", self.vision_model, contents, estimated_tokens, timeout
+            )
+            self._record_usage(
+                "analyze_chart", response, estimated_tokens, estimated_tokens - CHART_OUTPUT_TOKENS, response.text
+            )
+            self._observe_call("analyze_chart", sent_at, request_bytes, response.text)
+            parser = StructuredOutput(ChartAnalysis)
+            parser.feed(response.text)
+            return parser
+        
+        parser = await self.chart_caller.call(attempt)
+        data, _ = await self._complete_structured(
+            "analyze_chart", self.chart_caller, self.vision_model, contents, parser,
+            estimated_tokens - CHART_OUTPUT_TOKENS
+        )
+        return self._chart_with_defaults(data, parser.raw_text)
+
+    def _build_writing_prompt(
+        self, chart_analysis: Dict[str, Any], task_description: str, target_band: Optional[float] = None
+    ) -> str:
+        """
+        Tạo prompt viết bài IELTS Writing Task 1 từ kết quả phân tích
+
+        Phần phân tích biểu đồ được cắt cho vừa WRITING_PROMPT_MAX_TOKENS.
+        """
+        return render_writing_prompt(chart_analysis, task_description, target_band)
+
+    def _writing_with_defaults(self, data: Optional[Dict[str, Any]], response_text: str) -> Dict[str, Any]:
+        """Điền giá trị mặc định cho field còn thiếu; không có JSON thì coi cả response là bài viết"""
+        if not data:
             return {
-                "introduction": "Error generating response",
+                "introduction": "Unable to extract structured response",
                 "overview": "",
-                "body_paragraphs": [f"Failed to generate IELTS writing: {str(e)}"],
-                "full_essay": f"Error: {str(e)}",
-                "word_count": 0
-            } 
\ No newline at end of file
+                "body_paragraphs": [response_text],
+                "full_essay": response_text,
+                "word_count": len(response_text.split())
+            }
+        return {
+            "introduction": "",
+            "overview": "",
+            "body_paragraphs": [],
+            "full_essay": "",
+            "word_count": 0,
+            **data
+        }
+
+    async def generate_ielts_writing_async(
+        self,
+        chart_analysis: Dict[str, Any],
+        task_description: str,
+        on_text: Optional[Callable[[str], None]] = None,
+        target_band: Optional[float] = None,
+        temperature: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Tạo bài viết IELTS Writing Task 1 dựa trên phân tích biểu đồ, không block event loop
+
+        Nếu có on_text, response được stream và mỗi đoạn text được gửi cho
+        on_text ngay khi model trả về. Lỗi tạm thời được retry (stream chỉ retry
+        khi chưa gửi text nào); nếu vẫn thất bại thì raise ModelCallError.
+        temperature (tuỳ chọn) ghi đè temperature mặc định của model, dùng khi
+        sinh nhiều biến thể từ cùng một prompt.
+        """
+        prompt = self._build_writing_prompt(chart_analysis, task_description, target_band)
+        estimated_tokens = estimate_tokens(prompt) + WRITING_OUTPUT_TOKENS
+        
+        request_bytes = len(prompt.encode("utf-8"))
+        generation_kwargs = {}
+        if temperature is not None:
+            generation_kwargs["generation_config"] = {"temperature": temperature}
+        
+        async def attempt(timeout: float) -> StructuredOutput:
+            response, sent_at = await self._generate_async(
+                "generate_writing", self.model, prompt, estimated_tokens, timeout, **generation_kwargs
+            )
+            self._record_usage(
+                "generate_writing", response, estimated_tokens, estimated_tokens - WRITING_OUTPUT_TOKENS,
+                response.text
+            )
+            self._observe_call("generate_writing", sent_at, request_bytes, response.text)
+            parser = StructuredOutput(IELTSWritingResponse)
+            parser.feed(response.text)
+            return parser
+        
+        async def stream_attempt(timeout: float) -> StructuredOutput:
+            response, sent_at = await self._generate_async(
+                "generate_writing", self.model, prompt, estimated_tokens, timeout,
+                stream=True, **generation_kwargs
+            )
+            chunks = []
+            # JSON được tách dần theo từng chunk trong lúc stream
+            parser = StructuredOutput(IELTSWritingResponse)
+            try:
+                async for chunk in response:
+                    text = chunk.text
+                    if text:
+                        chunks.append(text)
+                        parser.feed(text)
+                        on_text(text)
+            except Exception as e:
+                MODEL_CALL_ERRORS.inc(call="generate_writing", error=type(e).__name__)
+                if chunks:
+                    raise PartialStreamError(f"Essay stream interrupted: {str(e)}") from e
+                raise
+            response_text = "".join(chunks)
+            self._record_usage(
+                "generate_writing", response, estimated_tokens, estimated_tokens - WRITING_OUTPUT_TOKENS,
+                response_text
+            )
+            self._observe_call("generate_writing", sent_at, request_bytes, response_text)
+            return parser
+        
+        if on_text is None:
+            parser = await self.writing_caller.call(attempt)
+        else:
+            # Không hedge stream: hai stream song song sẽ gửi text trùng lặp
+            parser = await self.writing_caller.call(stream_attempt, hedgeable=False)
+        # Hỏi lại không stream: phần bổ sung chỉ là vài field JSON, không phải văn bản cho người đọc
+        data, _ = await self._complete_structured(
+            "generate_writing", self.writing_caller, self.model, [prompt], parser,
+            estimated_tokens - WRITING_OUTPUT_TOKENS
+        )
+        return self._writing_with_defaults(data, parser.raw_text)
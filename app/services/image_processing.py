@@ -0,0 +1,344 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Any, Optional, Tuple, Union
+
+from PIL import Image, ImageChops, ImageOps
+
+from app.services.metrics import IMAGE_BYTES, IMAGE_PREPROCESS_LATENCY
+
+PASSTHROUGH_FORMATS = {"JPEG", "PNG"}
+# Kích thước ảnh nhỏ dùng để tìm vùng biểu đồ (crop)
+_CROP_PROBE_SIZE = 256
+# Số byte đầu file cần để nhận dạng định dạng ảnh
+SNIFF_BYTES = 16
+# Magic bytes của các định dạng Pillow decode được và Gemini nhận
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class ImageNormalizationConfig:
+    """
+    Cấu hình bước chuẩn hoá ảnh trước khi gửi cho Gemini Vision
+    """
+    # Cạnh dài nhất sau khi downscale
+    max_side: int = 1600
+    # Ảnh JPEG/PNG nhỏ hơn ngưỡng này (và không cần resize/crop) được gửi nguyên bytes
+    passthrough_max_bytes: int = 2 * 1024 * 1024
+    # Cắt bỏ viền nền xung quanh biểu đồ
+    auto_crop: bool = True
+    # Chỉ crop khi bỏ được ít nhất tỉ lệ diện tích này
+    min_crop_gain: float = 0.05
+    # Ngưỡng khác biệt so với màu nền để coi là nội dung (0-255)
+    crop_threshold: int = 24
+    # Ảnh có tối đa số màu này được coi là line art và lưu PNG palette
+    line_art_max_colors: int = 256
+    # Chất lượng JPEG cho ảnh chụp (giữ chroma đầy đủ để chữ/đường màu không bị nhoè)
+    jpeg_quality: int = 85
+    # Số pixel tối đa trước khi decode; giới hạn bộ nhớ decode (~4 byte/pixel)
+    max_pixels: int = 40_000_000
+    # Số byte tối đa của ảnh gửi dạng base64 (sau khi decode)
+    max_base64_bytes: int = 15 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "ImageNormalizationConfig":
+        defaults = cls()
+        return cls(
+            max_side=int(os.getenv("IMAGE_MAX_SIDE", str(defaults.max_side))),
+            passthrough_max_bytes=int(os.getenv(
+                "IMAGE_PASSTHROUGH_MAX_BYTES", str(defaults.passthrough_max_bytes)
+            )),
+            auto_crop=_env_bool("IMAGE_AUTO_CROP", defaults.auto_crop),
+            line_art_max_colors=int(os.getenv(
+                "IMAGE_LINE_ART_MAX_COLORS", str(defaults.line_art_max_colors)
+            )),
+            jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", str(defaults.jpeg_quality))),
+            max_pixels=int(os.getenv("IMAGE_MAX_PIXELS", str(defaults.max_pixels))),
+            max_base64_bytes=int(os.getenv("IMAGE_MAX_BASE64_BYTES", str(defaults.max_base64_bytes))),
+        )
+
+
+DEFAULT_CONFIG = ImageNormalizationConfig.from_env()
+
+
+class ImageTooLargeError(ValueError):
+    """Ảnh vượt giới hạn kích thước (HTTP 413)"""
+
+
+class UnsupportedImageError(ValueError):
+    """Dữ liệu không phải định dạng ảnh được hỗ trợ (HTTP 415)"""
+
+
+@dataclass
+class PreparedImage:
+    """
+    Ảnh đã được decode/validate đúng một lần, sẵn sàng gửi cho Gemini
+
+    Workflow giữ nó trong IMAGE_BLOBS, state chỉ mang handle và sha256.
+    """
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    sha256: str
+    original_size: int
+    reencoded: bool
+    original_width: int = 0
+    original_height: int = 0
+    cropped: bool = False
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def to_part(self) -> Dict[str, Any]:
+        """Inline blob part cho generate_content"""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    def info(self) -> Dict[str, Any]:
+        """Kích thước trước/sau chuẩn hoá để trả về trong response metadata"""
+        return {
+            "original_size_bytes": self.original_size,
+            "processed_size_bytes": self.size,
+            "original_dimensions": [self.original_width, self.original_height],
+            "processed_dimensions": [self.width, self.height],
+            "processed_mime_type": self.mime_type,
+            "reencoded": self.reencoded,
+            "cropped": self.cropped,
+        }
+
+
+def _flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """Convert sang RGB, nền trong suốt được thay bằng nền trắng"""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def _find_chart_bbox(image: Image.Image, config: ImageNormalizationConfig) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Tìm vùng chứa biểu đồ bằng cách so sánh với màu nền ở các góc ảnh
+
+    Chạy trên bản thu nhỏ nên rẻ kể cả với ảnh lớn. Trả về None nếu không
+    đáng crop.
+    """
+    probe = image.copy()
+    probe.thumbnail((_CROP_PROBE_SIZE, _CROP_PROBE_SIZE))
+    probe = _flatten_to_rgb(probe)
+    w, h = probe.size
+    corners = [probe.getpixel((0, 0)), probe.getpixel((w - 1, 0)),
+               probe.getpixel((0, h - 1)), probe.getpixel((w - 1, h - 1))]
+    background_color = max(set(corners), key=corners.count)
+
+    diff = ImageChops.difference(probe, Image.new("RGB", probe.size, background_color))
+    mask = diff.convert("L").point(lambda p: 255 if p > config.crop_threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    # Thêm lề 2% để không cắt sát vào trục/nhãn
+    pad_x, pad_y = max(1, w // 50), max(1, h // 50)
+    left, top = max(0, bbox[0] - pad_x), max(0, bbox[1] - pad_y)
+    right, bottom = min(w, bbox[2] + pad_x), min(h, bbox[3] + pad_y)
+    if (right - left) * (bottom - top) > (1 - config.min_crop_gain) * w * h:
+        return None
+
+    scale_x, scale_y = image.width / w, image.height / h
+    return (int(left * scale_x), int(top * scale_y),
+            min(image.width, int(round(right * scale_x))),
+            min(image.height, int(round(bottom * scale_y))))
+
+
+def _encode(image: Image.Image, config: ImageNormalizationConfig) -> Tuple[bytes, str]:
+    """
+    Chọn định dạng theo nội dung: ảnh ít màu (biểu đồ vẽ máy) dùng PNG palette,
+    ảnh chụp dùng JPEG
+    """
+    buffer = io.BytesIO()
+    colors = image.getcolors(maxcolors=config.line_art_max_colors)
+    if colors is not None:
+        palette_image = image.quantize(colors=max(2, len(colors)))
+        palette_image.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+
+    image.save(buffer, format="JPEG", quality=config.jpeg_quality, subsampling=0, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Định dạng ảnh theo magic bytes ở đầu file (None nếu không nhận ra)"""
+    for signature, image_format in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def prepare_image(image_data: Union[bytes, BinaryIO],
+                  config: Optional[ImageNormalizationConfig] = None) -> PreparedImage:
+    """
+    Decode ảnh upload một lần, validate, chuẩn hoá và chỉ re-encode khi cần
+
+    Chuẩn hoá gồm: giới hạn cạnh dài nhất, crop về vùng biểu đồ, chọn PNG/JPEG
+    theo nội dung. CPU-bound: gọi qua asyncio.to_thread từ các endpoint async.
+    image_data có thể là bytes hoặc file đã mở (vd. file upload spooled ra đĩa):
+    Pillow đọc thẳng từ file, bytes gốc chỉ được đọc vào bộ nhớ khi gửi nguyên ảnh.
+    Raises ValueError nếu không phải ảnh hợp lệ hoặc quá nhiều pixel.
+    """
+    config = config or DEFAULT_CONFIG
+    started_at = time.perf_counter()
+    if isinstance(image_data, (bytes, bytearray)):
+        source: BinaryIO = io.BytesIO(image_data)
+        original_size = len(image_data)
+    else:
+        source = image_data
+        original_size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+    try:
+        image = Image.open(source)
+        image_format = image.format
+        original_width, original_height = image.size
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {str(e)}") from e
+    # Kiểm tra trước load(): open() chỉ đọc header, chưa cấp phát bộ nhớ cho pixel
+    if original_width * original_height > config.max_pixels:
+        raise ValueError(
+            f"Image too large: {original_width}x{original_height} pixels "
+            f"(max {config.max_pixels} pixels)"
+        )
+    try:
+        if image_format == "JPEG" and max(image.size) > config.max_side:
+            # JPEG có thể decode thẳng ở độ phân giải 1/2, 1/4, 1/8
+            image.draft("RGB", (config.max_side, config.max_side))
+        # load() decode toàn bộ pixel, đồng thời phát hiện file hỏng/bị cắt
+        image.load()
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {str(e)}") from e
+
+    # Xoay theo EXIF (ảnh chụp điện thoại) trước khi tìm vùng crop
+    image = ImageOps.exif_transpose(image)
+    crop_box = _find_chart_bbox(image, config) if config.auto_crop else None
+    needs_resize = max(original_width, original_height) > config.max_side
+
+    if (image_format in PASSTHROUGH_FORMATS
+            and original_size <= config.passthrough_max_bytes
+            and not needs_resize and crop_box is None):
+        if isinstance(image_data, (bytes, bytearray)):
+            data = bytes(image_data)
+        else:
+            source.seek(0)
+            data = source.read()
+        mime_type = Image.MIME[image_format]
+        width, height = original_width, original_height
+        reencoded = False
+    else:
+        image = _flatten_to_rgb(image)
+        if crop_box is not None:
+            image = image.crop(crop_box)
+        if max(image.size) > config.max_side:
+            image.thumbnail((config.max_side, config.max_side), Image.LANCZOS)
+        data, mime_type = _encode(image, config)
+        width, height = image.size
+        reencoded = True
+
+    IMAGE_PREPROCESS_LATENCY.observe(time.perf_counter() - started_at)
+    IMAGE_BYTES.observe(original_size, stage="original")
+    IMAGE_BYTES.observe(len(data), stage="prepared")
+    return PreparedImage(
+        data=data,
+        mime_type=mime_type,
+        width=width,
+        height=height,
+        sha256=hashlib.sha256(data).hexdigest(),
+        original_size=original_size,
+        reencoded=reencoded,
+        original_width=original_width,
+        original_height=original_height,
+        cropped=crop_box is not None,
+    )
+
+
+def _base64_start(image_base64: str) -> int:
+    """Vị trí bắt đầu phần base64: sau prefix data URL (data:image/png;base64,) nếu có"""
+    if not image_base64.startswith("data:"):
+        return 0
+    comma = image_base64.find(",", 0, 256)
+    if comma < 0 or not image_base64[:comma].endswith(";base64"):
+        raise ValueError("Invalid base64 image: data URL must be base64 encoded")
+    return comma + 1
+
+
+def check_base64_image(image_base64: str, config: Optional[ImageNormalizationConfig] = None) -> None:
+    """
+    Kiểm tra nhanh chuỗi base64 trước khi decode
+
+    Chỉ đọc prefix data URL, độ dài chuỗi và vài byte đầu để nhận dạng định dạng,
+    không duyệt/copy cả chuỗi nên đủ rẻ để gọi trên event loop. Giới hạn kích
+    thước tính từ độ dài (kể cả ký tự xuống dòng nếu có, tức là ước lượng trên).
+    Raises ImageTooLargeError, UnsupportedImageError hoặc ValueError.
+    """
+    config = config or DEFAULT_CONFIG
+    start = _base64_start(image_base64)
+    decoded_size = (len(image_base64) - start) * 3 // 4
+    if decoded_size == 0:
+        raise ValueError("Invalid base64 image: empty payload")
+    if decoded_size > config.max_base64_bytes:
+        raise ImageTooLargeError(
+            f"Image too large: ~{decoded_size} bytes (max {config.max_base64_bytes} bytes)"
+        )
+    # 24 ký tự base64 = 18 byte, đủ cho SNIFF_BYTES
+    head = "".join(image_base64[start:start + 64].split())[:24]
+    try:
+        head_bytes = base64.b64decode(head, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image: {str(e)}") from e
+    if sniff_image_format(head_bytes) is None:
+        raise UnsupportedImageError(
+            "Unsupported image format (PNG, JPEG, GIF, WEBP, BMP or TIFF expected)"
+        )
+
+
+def prepare_base64_image(image_base64: str, config: Optional[ImageNormalizationConfig] = None) -> PreparedImage:
+    """
+    Decode chuỗi base64 (có thể là data URL) rồi đưa qua cùng pipeline với ảnh upload
+
+    Decode với validate=True: ký tự ngoài bảng base64 là lỗi thay vì bị bỏ qua.
+    Duyệt/copy cả chuỗi nên gọi qua asyncio.to_thread.
+    """
+    check_base64_image(image_base64, config)
+    payload = image_base64[_base64_start(image_base64):]
+    if any(char in payload for char in "\n\r \t"):
+        # base64 xuống dòng mỗi 76 ký tự (MIME)
+        payload = "".join(payload.split())
+    if len(payload) % 4:
+        raise ValueError("Invalid base64 image: length is not a multiple of 4")
+    try:
+        image_data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image: {str(e)}") from e
+    return prepare_image(image_data, config)
@@ -0,0 +1,475 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List
+
+from app.models.schemas import JobStatus
+from app.services.image_processing import PreparedImage
+from app.services.request_context import (
+    Priority, request_deadline, request_id, request_priority, request_session, request_tenant
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds the maximum number of pending jobs"""
+
+
+def _new_job(job_id: str, task_description: str, tenant: str = "default",
+             session_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "job_id": job_id,
+        "status": JobStatus.QUEUED.value,
+        "task_description": task_description,
+        # Tenant/session của người submit: worker chạy job dưới context này
+        "tenant": tenant,
+        "session_id": session_id,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "progress": {"completed_nodes": [], "processing_step": ""},
+        "result": None,
+        "error": None,
+    }
+
+
+class JobStore(ABC):
+    """
+    Interface cho nơi lưu job (trạng thái, tiến độ, kết quả, ảnh đầu vào)
+    """
+
+    # True nếu các method làm I/O blocking và nên chạy trong worker thread
+    blocking = False
+
+    @abstractmethod
+    def create(self, job: Dict[str, Any], image: PreparedImage) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, job_id: str, **fields: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_image(self, job_id: str) -> Optional[PreparedImage]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def unfinished_job_ids(self) -> List[str]:
+        """Job chưa chạy xong (dùng để chạy lại sau khi restart)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, job_id: str, started_at: float) -> bool:
+        """Chuyển job queued -> running; False nếu process khác đã nhận job này"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def requeue_interrupted(self) -> int:
+        """Đưa job running (process chết giữa chừng) về queued; chỉ gọi khi không worker nào đang chạy"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge(self, finished_before: float) -> int:
+        """Xoá job đã kết thúc trước thời điểm finished_before"""
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """In-process job store; jobs are lost when the process exits"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._images: Dict[str, PreparedImage] = {}
+
+    def create(self, job: Dict[str, Any], image: PreparedImage) -> None:
+        self._jobs[job["job_id"]] = job
+        self._images[job["job_id"]] = image
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return json.loads(json.dumps(job)) if job is not None else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        if fields.get("status") in (JobStatus.SUCCEEDED.value, JobStatus.FAILED.value):
+            # Ảnh không còn cần sau khi job kết thúc
+            self._images.pop(job_id, None)
+
+    def get_image(self, job_id: str) -> Optional[PreparedImage]:
+        return self._images.get(job_id)
+
+    def unfinished_job_ids(self) -> List[str]:
+        return []
+
+    def claim(self, job_id: str, started_at: float) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != JobStatus.QUEUED.value:
+            return False
+        job.update(status=JobStatus.RUNNING.value, started_at=started_at)
+        return True
+
+    def requeue_interrupted(self) -> int:
+        return 0
+
+    def purge(self, finished_before: float) -> int:
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < finished_before
+        ]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+            self._images.pop(job_id, None)
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Durable job store backed by SQLite
+
+    Input images are kept until the job finishes, so queued/running jobs are
+    resumed after a restart.
+    """
+
+    blocking = True
+    _JSON_FIELDS = ("progress", "result")
+
+    def __init__(self, path: str = "jobs.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                task_description TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                image BLOB,
+                image_meta TEXT,
+                tenant TEXT NOT NULL DEFAULT 'default',
+                session_id TEXT
+            )
+            """
+        )
+        # File jobs.sqlite3 tạo trước khi có tenant/session_id
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "tenant" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'")
+        if "session_id" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN session_id TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)")
+
+    def create(self, job: Dict[str, Any], image: PreparedImage) -> None:
+        image_meta = {k: v for k, v in dataclasses.asdict(image).items() if k != "data"}
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, task_description, created_at, progress, image, image_meta, "
+                "tenant, session_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["job_id"], job["status"], job["task_description"], job["created_at"],
+                 json.dumps(job["progress"]), image.data, json.dumps(image_meta),
+                 job["tenant"], job["session_id"]),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, status, task_description, created_at, started_at, finished_at, "
+                "progress, result, error, tenant, session_id FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("job_id", "status", "task_description", "created_at", "started_at",
+                "finished_at", "progress", "result", "error", "tenant", "session_id")
+        job = dict(zip(keys, row))
+        for field in self._JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        columns = []
+        values = []
+        for key, value in fields.items():
+            if key in self._JSON_FIELDS:
+                value = json.dumps(value, ensure_ascii=False)
+            columns.append(f"{key} = ?")
+            values.append(value)
+        if fields.get("status") in (JobStatus.SUCCEEDED.value, JobStatus.FAILED.value):
+            # Ảnh không còn cần sau khi job kết thúc
+            columns.append("image = NULL")
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(columns)} WHERE job_id = ?", (*values, job_id)
+            )
+
+    def get_image(self, job_id: str) -> Optional[PreparedImage]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT image, image_meta FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return PreparedImage(data=row[0], **json.loads(row[1]))
+
+    def unfinished_job_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim(self, job_id: str, started_at: float) -> bool:
+        # UPDATE có điều kiện là atomic, nên khi nhiều worker process dùng chung file chỉ một process nhận được job
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ? AND status = ?",
+                (JobStatus.RUNNING.value, started_at, job_id, JobStatus.QUEUED.value),
+            )
+        return cursor.rowcount == 1
+
+    def requeue_interrupted(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            )
+        return cursor.rowcount
+
+    def purge(self, finished_before: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (finished_before,),
+            )
+        return cursor.rowcount
+
+
+class JobQueue:
+    """
+    Hàng đợi job chạy IELTSAnalysisWorkflow.process_request ở background
+
+    Số job chạy đồng thời trong mỗi process được giới hạn bởi `concurrency`
+    (số worker task). Khi nhiều worker process dùng chung SQLiteJobStore, mỗi
+    job được claim() trước khi chạy nên không bị chạy trùng; recover_interrupted
+    phải tắt ở các worker (launcher requeue một lần trước khi khởi động chúng).
+    """
+
+    def __init__(self, workflow, store: JobStore, concurrency: int = 4,
+                 max_pending: int = 1000, result_ttl_seconds: float = 86400,
+                 job_timeout: float = 300.0, recover_interrupted: bool = True,
+                 purge_interval: float = 600.0):
+        self.workflow = workflow
+        self.purge_interval = purge_interval
+        self.job_timeout = job_timeout
+        self.recover_interrupted = recover_interrupted
+        self.store = store
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.result_ttl_seconds = result_ttl_seconds
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._purger: Optional[asyncio.Task] = None
+        self._running = 0
+        self._stopping = False
+
+    async def _call_store(self, method, *args, **kwargs):
+        if self.store.blocking:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._stopping = False
+        # Chạy lại các job bị gián đoạn (chỉ có với backend durable)
+        if self.recover_interrupted:
+            await self._call_store(self.store.requeue_interrupted)
+        for job_id in await self._call_store(self.store.unfinished_job_ids):
+            self._queue.put_nowait(job_id)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        self._purger = asyncio.create_task(self._purge_loop(), name="job-purger")
+        logger.info("Job queue started", extra={"workers": self.concurrency})
+
+    async def stop(self, drain_timeout: float = 0.0) -> None:
+        """
+        Dừng worker; với drain_timeout > 0 thì chờ các job đang chạy xong trước
+
+        Job chưa bắt đầu vẫn ở trạng thái queued (backend durable sẽ chạy chúng
+        ở lần khởi động sau); job bị huỷ khi hết drain_timeout được requeue lúc đó.
+        """
+        self._stopping = True
+        deadline = time.monotonic() + drain_timeout
+        if self._running:
+            logger.info("Draining running jobs", extra={"running": self._running, "drain_timeout": drain_timeout})
+        while self._running and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        tasks = [*self._workers, *([self._purger] if self._purger else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._purger = None
+
+    async def submit(self, task_description: str, image: PreparedImage) -> str:
+        if self._stopping:
+            raise QueueFullError("Job queue is shutting down")
+        if self._queue.qsize() >= self.max_pending:
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+        job_id = uuid.uuid4().hex
+        job = _new_job(job_id, task_description, tenant=request_tenant.get(), session_id=request_session.get())
+        await self._call_store(self.store.create, job, image)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str, tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Job theo id; với tenant thì job của tenant khác coi như không tồn tại"""
+        job = await self._call_store(self.store.get, job_id)
+        if job is not None and tenant is not None and job.get("tenant", "default") != tenant:
+            return None
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "running": self._running,
+            "concurrency": self.concurrency,
+            "max_pending": self.max_pending,
+        }
+
+    async def purge_expired(self) -> int:
+        """Xoá job đã kết thúc quá result_ttl_seconds; trả về số job đã xoá"""
+        return await self._call_store(self.store.purge, time.time() - self.result_ttl_seconds)
+
+    async def _purge_loop(self) -> None:
+        # Purge định kỳ, không phụ thuộc có job mới được submit hay không
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("Purged expired jobs", extra={"purged": purged})
+            except Exception:
+                logger.exception("Job purge failed")
+            await asyncio.sleep(self.purge_interval)
+
+    async def _worker(self) -> None:
+        # Job là workload batch: nhường quota Gemini cho request interactive
+        request_priority.set(Priority.BATCH)
+        while True:
+            job_id = await self._queue.get()
+            if self._stopping:
+                # Đang shutdown: không nhận job mới, job giữ trạng thái queued
+                self._queue.task_done()
+                return
+            self._running += 1
+            # Log của job (kể cả các node workflow) mang request_id = job_id
+            request_id.set(job_id)
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.exception("Job crashed")
+                await self._call_store(
+                    self.store.update, job_id,
+                    status=JobStatus.FAILED.value, error=str(e), finished_at=time.time()
+                )
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str) -> None:
+        job = await self._call_store(self.store.get, job_id)
+        if job is None:
+            # Record đã bị purge/xoá: không còn gì để cập nhật
+            logger.warning("Job record not found, skipping")
+            return
+        if not await self._call_store(self.store.claim, job_id, time.time()):
+            # Job đã được worker process khác nhận
+            return
+        image = await self._call_store(self.store.get_image, job_id)
+        if image is None:
+            await self._call_store(
+                self.store.update, job_id,
+                status=JobStatus.FAILED.value, error="Job input image is missing", finished_at=time.time()
+            )
+            return
+
+        request_deadline.set(time.monotonic() + self.job_timeout)
+        # Quota Gemini theo tenant và history kết quả theo session của người submit
+        request_tenant.set(job.get("tenant") or "default")
+        request_session.set(job.get("session_id"))
+        progress = {"completed_nodes": [], "processing_step": ""}
+
+        async def on_node(node: str, processing_step: str) -> None:
+            progress["completed_nodes"].append(node)
+            progress["processing_step"] = processing_step
+            await self._call_store(self.store.update, job_id, progress=progress)
+
+        result = await self.workflow.process_request(
+            task_description=job["task_description"],
+            image=image,
+            on_node=on_node
+        )
+
+        if result.get("success"):
+            await self._call_store(
+                self.store.update, job_id,
+                status=JobStatus.SUCCEEDED.value, result=result, finished_at=time.time()
+            )
+        else:
+            await self._call_store(
+                self.store.update, job_id,
+                status=JobStatus.FAILED.value, error=result.get("error", "Unknown error"),
+                finished_at=time.time()
+            )
+
+
+def create_job_store() -> JobStore:
+    """
+    Tạo job store từ biến môi trường
+
+    JOB_STORE_BACKEND: memory (mặc định) | sqlite
+    """
+    backend_name = os.getenv("JOB_STORE_BACKEND", "memory").lower()
+    if backend_name == "sqlite":
+        return SQLiteJobStore(path=os.getenv("JOB_STORE_PATH", "jobs.sqlite3"))
+    if backend_name == "memory":
+        return InMemoryJobStore()
+    raise ValueError(f"Unknown JOB_STORE_BACKEND: {backend_name}")
+
+
+def create_job_queue(workflow) -> JobQueue:
+    return JobQueue(
+        workflow,
+        create_job_store(),
+        concurrency=int(os.getenv("JOB_WORKER_CONCURRENCY", "4")),
+        max_pending=int(os.getenv("JOB_MAX_PENDING", "1000")),
+        result_ttl_seconds=float(os.getenv("JOB_RESULT_TTL_SECONDS", "86400")),
+        job_timeout=float(os.getenv("JOB_TIMEOUT_SECONDS", "300")),
+        recover_interrupted=os.getenv("JOB_RECOVER_INTERRUPTED", "true").lower() == "true",
+        purge_interval=float(os.getenv("JOB_PURGE_INTERVAL_SECONDS", "600")),
+    )
@@ -1,26 +1,101 @@
 from langgraph.graph import StateGraph, END
+from langgraph.constants import Send
 from langgraph.graph.graph import CompiledGraph
 from langchain.schema import BaseMessage
-from typing import TypedDict, Annotated, Dict, Any
+from langchain_core.runnables import RunnableConfig
+from typing import TypedDict, Annotated, Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional
+import asyncio
+import copy
+import functools
+import hashlib
+import logging
+import os
 import time
 import json
 
 from app.models.schemas import WorkflowState, ChartAnalysis, IELTSWritingResponse, ChartType
 from app.services.gemini_service import GeminiService
+from app.services.analysis_cache import create_chart_cache
+from app.services.analysis_store import create_analysis_store
+from app.services.result_store import create_result_history
+from app.services.image_processing import PreparedImage
+from app.services.resilience import ModelCallError
+from app.services.metrics import NODE_LATENCY, WORKFLOW_LATENCY, WORKFLOWS_IN_FLIGHT
+from app.services.essay_scorer import count_words, score_essay
+from app.services.single_flight import SingleFlight
+from app.services.request_context import (
+    request_deadline, request_priority, request_session, request_tenant, request_token_usage
+)
+from app.services.blob_store import IMAGE_BLOBS
+from app.services.chart_classifier import UNKNOWN, classify_chart
+from app.services.prompts import chart_prompt_name
+from app.services.numeric_engine import build_fact_sheet
+
+logger = logging.getLogger(__name__)
+
+# Số bài viết tối đa sinh song song cho một request (best-of-N)
+MAX_ESSAY_VARIANTS = int(os.getenv("ESSAY_MAX_VARIANTS", "5"))
+# Temperature khi sinh nhiều biến thể, để các bài khác nhau đủ để chọn
+ESSAY_VARIANT_TEMPERATURE = float(os.getenv("ESSAY_VARIANT_TEMPERATURE", "0.9"))
+# Loại biểu đồ có node/prompt phân tích riêng; mixed_chart/unknown đi qua analyze_chart (prompt chung)
+SPECIALIZED_CHART_TYPES = ("bar_chart", "line_chart", "pie_chart", "table")
+
+
+def merge_essay_candidates(
+    left: List[Dict[str, Any]], right: Optional[List[Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """
+    Reducer cho essay_candidates: gộp theo số thứ tự biến thể
+    
+    select_essay trả về lại cả danh sách (có thêm cờ selected), nên reducer
+    phải idempotent thay vì nối list như operator.add.
+    """
+    merged = {candidate["variant"]: candidate for candidate in left or []}
+    for candidate in right or []:
+        merged[candidate["variant"]] = candidate
+    return [merged[variant] for variant in sorted(merged)]
+
+
+def merge_node_timings(left: Dict[str, float], right: Optional[Dict[str, float]]) -> Dict[str, float]:
+    """Reducer cho node_timings: mỗi node chỉ trả về thời gian của chính nó"""
+    return {**(left or {}), **(right or {})}
+
 
 # Định nghĩa state cho workflow
 class IELTSWorkflowState(TypedDict):
     task_description: str
-    image_base64: str
+    # Handle của ảnh trong IMAGE_BLOBS (None khi regenerate); bytes không nằm trong state
+    image_handle: Optional[str]
+    image_sha256: Optional[str]
+    # Kết quả bộ phân loại cục bộ: {chart_type, confidence, components}
+    chart_prediction: Dict[str, Any]
     chart_analysis: Dict[str, Any]
     ielts_writing: Dict[str, Any] 
     error: str
+    # HTTP status tương ứng với lỗi (vd. 503 khi circuit breaker mở, 504 khi hết deadline)
+    error_code: int
     processing_step: str
+    # Thời gian chạy (giây) của từng node đã đi qua
+    node_timings: Annotated[Dict[str, float], merge_node_timings]
+    # Band IELTS mà bài viết nhắm tới (None = theo prompt mặc định)
+    target_band: Optional[float]
+    # Số bài viết sinh song song; > 1 thì chọn bài điểm cao nhất
+    num_variants: int
+    essay_candidates: Annotated[List[Dict[str, Any]], merge_essay_candidates]
 
 class IELTSAnalysisWorkflow:
     def __init__(self):
         self.gemini_service = GeminiService()
+        self.chart_cache = create_chart_cache()
+        self.analysis_store = create_analysis_store()
+        self.result_history = create_result_history()
+        self.classifier_enabled = os.getenv("CHART_CLASSIFIER_ENABLED", "true").lower() == "true"
+        self.single_flight = (
+            SingleFlight("process_request")
+            if os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true" else None
+        )
         self.workflow = self._create_workflow()
+        self.regenerate_workflow = self._create_regenerate_workflow()
     
     def _create_workflow(self) -> CompiledGraph:
         """
@@ -28,22 +103,36 @@ class IELTSAnalysisWorkflow:
         
         Workflow gồm các bước:
         1. validate_input: Kiểm tra input
-        2. analyze_chart: Phân tích biểu đồ từ ảnh
-        3. process_data: Xử lý và cấu trúc lại dữ liệu  
-        4. generate_writing: Tạo bài viết IELTS
-        5. finalize_result: Tổng hợp kết quả cuối
+        2. classify_chart: Đoán loại biểu đồ trên CPU, chọn node phân tích
+        3. analyze_chart / analyze_<loại>: Phân tích biểu đồ từ ảnh (prompt chung hoặc prompt riêng)
+        4. process_data: Xử lý và cấu trúc lại dữ liệu  
+        5. generate_writing: Tạo bài viết IELTS
+        6. finalize_result: Tổng hợp kết quả cuối
         """
         
         # Tạo workflow graph
         workflow = StateGraph(IELTSWorkflowState)
         
         # Thêm các nodes
-        workflow.add_node("validate_input", self.validate_input_node)
-        workflow.add_node("analyze_chart", self.analyze_chart_node)  
-        workflow.add_node("process_data", self.process_data_node)
-        workflow.add_node("generate_writing", self.generate_writing_node)
-        workflow.add_node("finalize_result", self.finalize_result_node)
-        workflow.add_node("handle_error", self.handle_error_node)
+        # Các node gọi Gemini chỉ có bản async: graph luôn chạy bằng ainvoke/astream
+        # Mọi node được bọc bởi _timed_node để đo latency
+        timed = self._timed_node
+        workflow.add_node("validate_input", timed("validate_input", self.validate_input_node))
+        workflow.add_node("classify_chart", timed("classify_chart", self.classify_chart_node))
+        # Một node phân tích cho mỗi prompt: analyze_chart (chung) và analyze_<loại>
+        analyze_nodes = {"generic": "analyze_chart"}
+        analyze_nodes.update({chart_type: f"analyze_{chart_type}" for chart_type in SPECIALIZED_CHART_TYPES})
+        for chart_type, node_name in analyze_nodes.items():
+            workflow.add_node(node_name, self._analyze_chart_for(
+                node_name, None if chart_type == "generic" else chart_type
+            ))
+        workflow.add_node("process_data", timed("process_data", self.process_data_node))
+        self._add_writing_stage(workflow)
+        # Best-of-N: generate_variant chạy song song (một task cho mỗi Send), select_essay gộp lại
+        workflow.add_node(
+            "generate_variant", timed("generate_variant", self.generate_variant_node, record_state=False)
+        )
+        workflow.add_node("select_essay", timed("select_essay", self.select_essay_node))
         
         # Định nghĩa edges (luồng chạy)
         workflow.set_entry_point("validate_input")
@@ -53,86 +142,235 @@ class IELTSAnalysisWorkflow:
             "validate_input",
             self.should_continue_after_validation,
             {
-                "continue": "analyze_chart",
+                "continue": "classify_chart",
                 "error": "handle_error"
             }
         )
         
-        # Conditional routing từ analyze_chart  
+        # Chọn node phân tích (prompt) theo loại biểu đồ đã đoán
+        workflow.add_conditional_edges("classify_chart", self.route_by_chart_type, analyze_nodes)
+        
+        # Conditional routing từ các node analyze
+        for node_name in analyze_nodes.values():
+            workflow.add_conditional_edges(
+                node_name,
+                self.should_continue_after_analysis,
+                {
+                    "continue": "process_data", 
+                    "error": "handle_error"
+                }
+            )
+        
+        # Một bài: generate_writing; nhiều bài: fan-out sang generate_variant
+        workflow.add_conditional_edges(
+            "process_data",
+            self.route_after_processing,
+            {
+                "single": "generate_writing",
+                # Chỉ để validate graph thấy generate_variant; thực tế route bằng Send
+                "variants": "generate_variant",
+                "error": "handle_error"
+            }
+        )
+        workflow.add_edge("generate_variant", "select_essay")
         workflow.add_conditional_edges(
-            "analyze_chart",
-            self.should_continue_after_analysis,
+            "select_essay",
+            self.should_continue_after_writing,
             {
-                "continue": "process_data", 
+                "continue": "finalize_result",
                 "error": "handle_error"
             }
         )
         
-        # Linear flow từ process_data
-        workflow.add_edge("process_data", "generate_writing")
-        workflow.add_edge("generate_writing", "finalize_result")
+        return workflow.compile()
+    
+    def _create_regenerate_workflow(self) -> CompiledGraph:
+        """
+        Graph con bắt đầu thẳng từ generate_writing
+        
+        Dùng cho regenerate: chart_analysis lấy từ AnalysisStore nên bỏ qua
+        validate_input, analyze_chart và process_data.
+        """
+        workflow = StateGraph(IELTSWorkflowState)
+        self._add_writing_stage(workflow)
+        workflow.set_entry_point("generate_writing")
+        return workflow.compile()
+    
+    def _add_writing_stage(self, workflow: StateGraph) -> None:
+        """
+        Thêm generate_writing -> finalize_result/handle_error -> END vào graph
+        """
+        timed = self._timed_node
+        workflow.add_node("generate_writing", timed("generate_writing", self.generate_writing_node))
+        workflow.add_node("finalize_result", timed("finalize_result", self.finalize_result_node))
+        workflow.add_node("handle_error", timed("handle_error", self.handle_error_node))
+        
+        # Không finalize một bài viết lỗi
+        workflow.add_conditional_edges(
+            "generate_writing",
+            self.should_continue_after_writing,
+            {
+                "continue": "finalize_result",
+                "error": "handle_error"
+            }
+        )
         workflow.add_edge("finalize_result", END)
         workflow.add_edge("handle_error", END)
+    
+    def _timed_node(self, name: str, func: Callable, record_state: bool = True) -> Callable:
+        """
+        Bọc một node: ghi latency vào histogram NODE_LATENCY và node_timings
         
-        return workflow.compile()
+        functools.wraps giữ nguyên signature, nên LangGraph vẫn truyền config cho
+        các node có tham số config. Node chỉ trả về các field nó thay đổi; thời
+        gian chạy được thêm vào update và gộp bằng reducer merge_node_timings.
+        Node chạy song song (fan-out) dùng record_state=False: không ghi node_timings.
+        """
+        def record(update: Dict[str, Any], started_at: float) -> Dict[str, Any]:
+            elapsed = time.perf_counter() - started_at
+            NODE_LATENCY.observe(elapsed, node=name)
+            if record_state and isinstance(update, dict):
+                update["node_timings"] = {name: elapsed}
+            return update
+        
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_node(state: IELTSWorkflowState, **kwargs) -> Dict[str, Any]:
+                started_at = time.perf_counter()
+                return record(await func(state, **kwargs), started_at)
+            return async_node
+        
+        @functools.wraps(func)
+        def node(state: IELTSWorkflowState, **kwargs) -> Dict[str, Any]:
+            started_at = time.perf_counter()
+            return record(func(state, **kwargs), started_at)
+        return node
     
-    def validate_input_node(self, state: IELTSWorkflowState) -> IELTSWorkflowState:
+    def validate_input_node(self, state: IELTSWorkflowState) -> Dict[str, Any]:
         """
         Node 1: Validate input data
         """
-        print("🔍 Validating input...")
-        state["processing_step"] = "Validating input"
+        logger.debug("Validating input")
+        update: Dict[str, Any] = {"processing_step": "Validating input"}
         
         try:
             if not state.get("task_description"):
-                state["error"] = "Task description is required"
-                return state
+                update["error"] = "Task description is required"
+                return update
                 
-            if not state.get("image_base64"):
-                state["error"] = "Chart image is required" 
-                return state
+            if not state.get("image_handle"):
+                update["error"] = "Chart image is required" 
+                return update
             
-            print("✅ Input validation successful")
-            return state
+            num_variants = state.get("num_variants", 1)
+            if not 1 <= num_variants <= MAX_ESSAY_VARIANTS:
+                update["error"] = f"variants must be between 1 and {MAX_ESSAY_VARIANTS}"
+                update["error_code"] = 400
+                return update
+            
+            logger.debug("Input validation successful")
+            return update
             
         except Exception as e:
-            state["error"] = f"Input validation failed: {str(e)}"
-            return state
+            update["error"] = f"Input validation failed: {str(e)}"
+            return update
+    
+    def _classify(self, state: IELTSWorkflowState) -> Dict[str, Any]:
+        logger.debug("Classifying chart type")
+        update: Dict[str, Any] = {"processing_step": "Classifying chart"}
+        prediction = UNKNOWN
+        if self.classifier_enabled:
+            prediction = classify_chart(IMAGE_BLOBS.get(state["image_handle"]))
+        update["chart_prediction"] = prediction.to_dict()
+        logger.debug("Predicted chart type", extra={"chart_type": prediction.chart_type, "confidence": round(prediction.confidence, 3)})
+        return update
     
-    def analyze_chart_node(self, state: IELTSWorkflowState) -> IELTSWorkflowState:
+    async def classify_chart_node(self, state: IELTSWorkflowState) -> Dict[str, Any]:
         """
-        Node 2: Analyze chart image using Gemini Vision API
+        Node 2: Đoán loại biểu đồ bằng heuristic trên ảnh (CPU, không gọi model)
+        
+        Chạy trong worker thread để không block event loop.
+        """
+        return await asyncio.to_thread(self._classify, state)
+    
+    def _analyze_chart_for(self, node_name: str, chart_type: Optional[str]) -> Callable:
+        """Node phân tích dùng prompt riêng của chart_type (None = prompt chung)"""
+        async def analyze(state: IELTSWorkflowState) -> Dict[str, Any]:
+            return await self.analyze_chart_node(state, chart_type)
+        
+        return self._timed_node(node_name, analyze)
+    
+    async def analyze_chart_node(
+        self, state: IELTSWorkflowState, chart_type: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
-        print("📊 Analyzing chart image...")
-        state["processing_step"] = "Analyzing chart"
+        Node 3: Analyze chart image using Gemini Vision API
+        
+        chart_type chọn prompt ngắn riêng cho loại biểu đồ (None = prompt chung).
+        """
+        logger.debug("Analyzing chart image")
+        update: Dict[str, Any] = {"processing_step": "Analyzing chart"}
         
         try:
-            chart_analysis = self.gemini_service.analyze_chart_image(
-                state["image_base64"], 
-                state["task_description"]
+            cache_key = None
+            if self.chart_cache is not None:
+                cache_key = self._chart_cache_key(state, chart_type)
+                cached = await self.chart_cache.aget(cache_key)
+                if cached is not None:
+                    update["chart_analysis"] = cached
+                    logger.debug("Chart analysis cache hit", extra={"chart_type": cached.get("chart_type", "unknown")})
+                    return update
+            
+            chart_analysis = await self.gemini_service.analyze_chart_image_async(
+                IMAGE_BLOBS.get(state["image_handle"]), 
+                state["task_description"],
+                chart_type=chart_type
             )
             
-            state["chart_analysis"] = chart_analysis
-            print(f"✅ Chart analysis complete: {chart_analysis.get('chart_type', 'unknown')}")
-            return state
+            if cache_key is not None and self._is_cacheable_analysis(chart_analysis):
+                await self.chart_cache.aset(cache_key, chart_analysis)
             
+            update["chart_analysis"] = chart_analysis
+            logger.debug("Chart analysis complete", extra={"chart_type": chart_analysis.get("chart_type", "unknown")})
+            return update
+            
+        except ModelCallError as e:
+            update["error"] = f"Chart analysis failed: {str(e)}"
+            update["error_code"] = e.status_code
+            return update
         except Exception as e:
-            state["error"] = f"Chart analysis failed: {str(e)}"
-            return state
+            update["error"] = f"Chart analysis failed: {str(e)}"
+            return update
     
-    def process_data_node(self, state: IELTSWorkflowState) -> IELTSWorkflowState:
+    def _chart_cache_key(self, state: IELTSWorkflowState, chart_type: Optional[str] = None) -> str:
+        """Cache key từ hash ảnh, đề bài và prompt (theo loại biểu đồ đã đoán)"""
+        return self.chart_cache.make_key(
+            state["image_sha256"], state["task_description"], chart_prompt_name(chart_type)
+        )
+    
+    def _is_cacheable_analysis(self, chart_analysis: Dict[str, Any]) -> bool:
+        """Chỉ cache kết quả có dữ liệu thật, không cache fallback/error dict"""
+        return bool(chart_analysis.get("key_data_points"))
+    
+    def process_data_node(self, state: IELTSWorkflowState) -> Dict[str, Any]:
         """
-        Node 3: Process and structure the analyzed data
+        Node 4: Process and structure the analyzed data
         """
-        print("⚙️ Processing extracted data...")
-        state["processing_step"] = "Processing data"
+        logger.debug("Processing extracted data")
+        update: Dict[str, Any] = {"processing_step": "Processing data"}
         
         try:
-            chart_analysis = state["chart_analysis"]
+            # Copy nông: chart_analysis có thể là object đang nằm trong cache (memory)
+            chart_analysis = dict(state["chart_analysis"])
+            
+            # Số liệu tính sẵn từ raw_data (cực trị, % thay đổi, xếp hạng, xu hướng):
+            # tính cục bộ, xác định, prompt viết bài dùng thay cho xu hướng/so sánh của model
+            computed_facts = build_fact_sheet(chart_analysis)
+            chart_analysis["computed_facts"] = computed_facts
             
             # Validate and enhance chart analysis
             if not chart_analysis.get("key_data_points"):
-                chart_analysis["key_data_points"] = ["No specific data points extracted"]
+                chart_analysis["key_data_points"] = computed_facts or ["No specific data points extracted"]
             
             if not chart_analysis.get("trends"):
                 chart_analysis["trends"] = ["No clear trends identified"]
@@ -140,73 +378,147 @@ class IELTSAnalysisWorkflow:
             if not chart_analysis.get("comparisons"):
                 chart_analysis["comparisons"] = ["No significant comparisons found"]
             
-            # Ensure chart_type is valid
-            valid_types = ["bar_chart", "line_chart", "pie_chart", "table", "mixed_chart", "unknown"]
-            if chart_analysis.get("chart_type") not in valid_types:
-                chart_analysis["chart_type"] = "unknown"
+            # Ensure chart_type is valid; không hợp lệ thì dùng loại bộ phân loại đã đoán
+            prediction = state.get("chart_prediction") or {}
+            if chart_analysis.get("chart_type") not in {chart_type.value for chart_type in ChartType}:
+                chart_analysis["chart_type"] = prediction.get("chart_type", ChartType.UNKNOWN.value)
+            if not chart_analysis.get("chart_components") and prediction.get("components"):
+                chart_analysis["chart_components"] = prediction["components"]
             
-            state["chart_analysis"] = chart_analysis
-            print("✅ Data processing complete")
-            return state
+            update["chart_analysis"] = chart_analysis
+            logger.debug("Data processing complete", extra={"computed_facts": len(computed_facts)})
+            return update
             
         except Exception as e:
-            state["error"] = f"Data processing failed: {str(e)}"
-            return state
+            update["error"] = f"Data processing failed: {str(e)}"
+            return update
     
-    def generate_writing_node(self, state: IELTSWorkflowState) -> IELTSWorkflowState:
+    async def generate_writing_node(
+        self, state: IELTSWorkflowState, config: Optional[RunnableConfig] = None
+    ) -> Dict[str, Any]:
         """
-        Node 4: Generate IELTS Writing Task 1 essay
+        Node 5: Generate IELTS Writing Task 1 essay
+        
+        Nếu config["configurable"]["on_text"] được truyền vào (từ astream_request),
+        essay được stream về theo từng đoạn text.
         """
-        print("✍️ Generating IELTS writing...")
-        state["processing_step"] = "Generating IELTS writing"
+        logger.debug("Generating IELTS writing")
+        update: Dict[str, Any] = {"processing_step": "Generating IELTS writing"}
+        on_text = ((config or {}).get("configurable") or {}).get("on_text")
         
         try:
-            ielts_writing = self.gemini_service.generate_ielts_writing(
+            ielts_writing = await self.gemini_service.generate_ielts_writing_async(
                 state["chart_analysis"],
-                state["task_description"]
+                state["task_description"],
+                on_text=on_text,
+                target_band=state.get("target_band")
             )
             
-            state["ielts_writing"] = ielts_writing
-            print(f"✅ IELTS writing complete ({ielts_writing.get('word_count', 0)} words)")
-            return state
+            update["ielts_writing"] = ielts_writing
+            logger.debug("IELTS writing complete", extra={"word_count": ielts_writing.get("word_count", 0)})
+            return update
             
+        except ModelCallError as e:
+            update["error"] = f"IELTS writing generation failed: {str(e)}"
+            update["error_code"] = e.status_code
+            return update
         except Exception as e:
-            state["error"] = f"IELTS writing generation failed: {str(e)}"
-            return state
+            update["error"] = f"IELTS writing generation failed: {str(e)}"
+            return update
     
-    def finalize_result_node(self, state: IELTSWorkflowState) -> IELTSWorkflowState:
+    def _variant_candidate(self, state: Dict[str, Any], started_at: float, **fields: Any) -> Dict[str, Any]:
+        candidate = {"variant": state["variant"], **fields}
+        if "ielts_writing" in fields:
+            candidate["score"] = score_essay(fields["ielts_writing"], state["chart_analysis"])
+        candidate["generation_time"] = time.perf_counter() - started_at
+        return {"essay_candidates": [candidate]}
+    
+    async def generate_variant_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Node 5b: Generate one essay candidate (một trong N task song song)
+        
+        Nhận state riêng từ Send (có thêm "variant") và chỉ trả về
+        essay_candidates, để các task song song không ghi đè state của nhau.
+        Lỗi được ghi vào candidate thay vì raise, để các bài khác vẫn được chọn.
+        """
+        started_at = time.perf_counter()
+        try:
+            ielts_writing = await self.gemini_service.generate_ielts_writing_async(
+                state["chart_analysis"],
+                state["task_description"],
+                target_band=state.get("target_band"),
+                temperature=ESSAY_VARIANT_TEMPERATURE
+            )
+            return self._variant_candidate(state, started_at, ielts_writing=ielts_writing)
+        except ModelCallError as e:
+            return self._variant_candidate(state, started_at, error=str(e), error_code=e.status_code)
+        except Exception as e:
+            return self._variant_candidate(state, started_at, error=str(e))
+    
+    def select_essay_node(self, state: IELTSWorkflowState) -> Dict[str, Any]:
         """
-        Node 5: Finalize and format the final result
+        Node 5c: Pick the highest scoring essay candidate
         """
-        print("🎯 Finalizing results...")
-        state["processing_step"] = "Finalizing results"
+        logger.debug("Selecting best essay variant")
+        update: Dict[str, Any] = {"processing_step": "Selecting best essay"}
+        
+        candidates = state.get("essay_candidates") or []
+        scored = [candidate for candidate in candidates if "ielts_writing" in candidate]
+        if not scored:
+            errors = [candidate for candidate in candidates if candidate.get("error")]
+            update["error"] = "All essay variants failed: " + "; ".join(c["error"] for c in errors)
+            update["error_code"] = max((c.get("error_code", 500) for c in errors), default=500)
+            return update
+        
+        best = max(scored, key=lambda candidate: candidate["score"]["total"])
+        update["ielts_writing"] = best["ielts_writing"]
+        update["essay_candidates"] = [
+            {**candidate, "selected": candidate["variant"] == best["variant"]}
+            for candidate in candidates
+        ]
+        logger.debug(
+            "Selected essay variant",
+            extra={"variant": best["variant"], "score": best["score"]["total"], "candidates": len(scored)}
+        )
+        return update
+    
+    def finalize_result_node(self, state: IELTSWorkflowState) -> Dict[str, Any]:
+        """
+        Node 6: Finalize and format the final result
+        """
+        logger.debug("Finalizing results")
+        update: Dict[str, Any] = {"processing_step": "Finalizing results"}
         
         try:
             # Final validation and formatting
-            chart_analysis = state["chart_analysis"]
             ielts_writing = state["ielts_writing"]
             
             # Ensure all required fields are present
+            fixes: Dict[str, Any] = {}
             if not ielts_writing.get("full_essay"):
-                ielts_writing["full_essay"] = "Essay generation incomplete"
+                fixes["full_essay"] = "Essay generation incomplete"
             
-            if not isinstance(ielts_writing.get("word_count"), int):
-                ielts_writing["word_count"] = len(ielts_writing.get("full_essay", "").split())
+            # Đếm lại số từ bằng tokenizer của essay_scorer (số model tự ước tính thường lệch)
+            full_essay = fixes.get("full_essay", ielts_writing.get("full_essay", ""))
+            word_count = count_words(full_essay)
+            if ielts_writing.get("word_count") != word_count:
+                fixes["word_count"] = word_count
             
-            print("✅ Results finalized successfully")
-            return state
+            if fixes:
+                update["ielts_writing"] = {**ielts_writing, **fixes}
+            logger.debug("Results finalized")
+            return update
             
         except Exception as e:
-            state["error"] = f"Result finalization failed: {str(e)}"
-            return state
+            update["error"] = f"Result finalization failed: {str(e)}"
+            return update
     
-    def handle_error_node(self, state: IELTSWorkflowState) -> IELTSWorkflowState:
+    def handle_error_node(self, state: IELTSWorkflowState) -> Dict[str, Any]:
         """
         Error handling node
         """
-        print(f"❌ Error occurred: {state.get('error', 'Unknown error')}")
-        state["processing_step"] = "Error occurred"
-        return state
+        logger.warning("Workflow error", extra={"error": state.get("error", "Unknown error")})
+        return {"processing_step": "Error occurred"}
     
     # Conditional routing functions
     def should_continue_after_validation(self, state: IELTSWorkflowState) -> str:
@@ -215,73 +527,394 @@ class IELTSAnalysisWorkflow:
             return "error"
         return "continue"
     
+    def route_by_chart_type(self, state: IELTSWorkflowState) -> str:
+        """Routing after classify_chart: loại có prompt riêng, còn lại dùng prompt chung"""
+        chart_type = (state.get("chart_prediction") or {}).get("chart_type")
+        return chart_type if chart_type in SPECIALIZED_CHART_TYPES else "generic"
+    
     def should_continue_after_analysis(self, state: IELTSWorkflowState) -> str:
         """Routing logic after chart analysis"""
         if state.get("error"):
             return "error"
         return "continue"
     
-    async def process_request(self, task_description: str, image_base64: str) -> Dict[str, Any]:
-        """
-        Main method to process IELTS analysis request
-        """
-        start_time = time.time()
-        
-        # Initial state
-        initial_state = IELTSWorkflowState(
+    def route_after_processing(self, state: IELTSWorkflowState):
+        """Routing after process_data: one essay, or fan out one Send per variant"""
+        if state.get("error"):
+            return "error"
+        num_variants = state.get("num_variants", 1)
+        if num_variants <= 1:
+            return "single"
+        # Mỗi task chỉ nhận các field nó cần, không copy cả state
+        variant_input = {
+            "task_description": state["task_description"],
+            "chart_analysis": state["chart_analysis"],
+            "target_band": state.get("target_band"),
+        }
+        return [Send("generate_variant", {**variant_input, "variant": index}) for index in range(num_variants)]
+    
+    def should_continue_after_writing(self, state: IELTSWorkflowState) -> str:
+        """Routing logic after essay generation"""
+        if state.get("error"):
+            return "error"
+        return "continue"
+    
+    def _initial_state(
+        self,
+        task_description: str,
+        image: Optional[PreparedImage],
+        chart_analysis: Optional[Dict[str, Any]] = None,
+        target_band: Optional[float] = None,
+        num_variants: int = 1,
+        image_handle: Optional[str] = None
+    ) -> IELTSWorkflowState:
+        """image_handle: handle của image trong IMAGE_BLOBS, do người gọi hold() trong suốt workflow"""
+        return IELTSWorkflowState(
             task_description=task_description,
-            image_base64=image_base64,
-            chart_analysis={},
+            image_handle=image_handle,
+            image_sha256=image.sha256 if image is not None else None,
+            chart_prediction={},
+            chart_analysis=chart_analysis or {},
             ielts_writing={},
             error="",
-            processing_step=""
+            error_code=0,
+            processing_step="",
+            node_timings={},
+            target_band=target_band,
+            num_variants=num_variants,
+            essay_candidates=[]
         )
+    
+    def _build_result(self, final_state: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """
+        Convert final workflow state to the response format
+        """
+        processing_time = time.time() - start_time
         
-        try:
-            # Run the workflow
-            print("🚀 Starting IELTS Analysis Workflow...")
-            final_state = self.workflow.invoke(initial_state)
-            
-            processing_time = time.time() - start_time
-            
-            if final_state.get("error"):
-                return {
+        if final_state.get("error"):
+            return {
+                "success": False,
+                "error": final_state["error"],
+                "status_code": final_state.get("error_code") or 500,
+                "processing_time": processing_time,
+                "node_timings": final_state.get("node_timings", {})
+            }
+        
+        # Convert to response format
+        chart_analysis = ChartAnalysis(
+            chart_type=ChartType(final_state["chart_analysis"].get("chart_type", "unknown")),
+            title=final_state["chart_analysis"].get("title"),
+            description=final_state["chart_analysis"].get("description", ""),
+            key_data_points=final_state["chart_analysis"].get("key_data_points", []),
+            trends=final_state["chart_analysis"].get("trends", []),
+            comparisons=final_state["chart_analysis"].get("comparisons", []),
+            computed_facts=final_state["chart_analysis"].get("computed_facts"),
+            raw_data=final_state["chart_analysis"].get("raw_data")
+        )
+        
+        ielts_writing = IELTSWritingResponse(
+            introduction=final_state["ielts_writing"].get("introduction", ""),
+            overview=final_state["ielts_writing"].get("overview", ""),
+            body_paragraphs=final_state["ielts_writing"].get("body_paragraphs", []),
+            full_essay=final_state["ielts_writing"].get("full_essay", ""),
+            word_count=final_state["ielts_writing"].get("word_count", 0)
+        )
+        
+        result = {
+            "success": True,
+            "chart_analysis": chart_analysis.dict(),
+            "ielts_writing": ielts_writing.dict(),
+            "processing_time": processing_time,
+            "node_timings": final_state.get("node_timings", {})
+        }
+        if final_state.get("essay_candidates"):
+            result["essay_candidates"] = final_state["essay_candidates"]
+        if final_state.get("chart_prediction"):
+            result["chart_prediction"] = final_state["chart_prediction"]
+        return result
+    
+    async def process_request(
+        self,
+        task_description: str,
+        image: PreparedImage,
+        on_node: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        num_variants: int = 1
+    ) -> Dict[str, Any]:
+        """
+        Main method to process IELTS analysis request
+        
+        on_node (tuỳ chọn) được await sau mỗi node với (tên node, processing_step),
+        dùng để báo tiến độ cho job queue. num_variants > 1 sinh nhiều bài song
+        song và trả về bài có điểm cao nhất (các bài còn lại trong essay_candidates).
+        Request trùng (cùng ảnh, đề và num_variants) đến khi request đầu còn đang
+        chạy sẽ dùng chung kết quả của nó (single-flight, tắt bằng SINGLE_FLIGHT_ENABLED=false).
+        """
+        if on_node is not None:
+            start_time = time.time()
+            async for event in self.astream_request(
+                task_description, image, stream_tokens=False, num_variants=num_variants
+            ):
+                if event["event"] == "node":
+                    await on_node(event["node"], event["processing_step"])
+                elif event["event"] == "result":
+                    event.pop("event")
+                    return event
+            # Stream kết thúc mà không có result: báo lỗi, không chạy lại workflow lần nữa
+            return {
+                "success": False,
+                "error": "Workflow execution failed: stream ended without a result",
+                "processing_time": time.time() - start_time
+            }
+        
+        if self.single_flight is not None and image is not None:
+            # Nhiều học sinh upload cùng ảnh/đề cùng lúc: chỉ chạy workflow một lần.
+            # Workflow chạy dưới tenant (quota) và priority của leader, nên chỉ gộp
+            # request cùng tenant/priority; deadline do SingleFlight kiểm tra.
+            key = "|".join((
+                request_tenant.get(), str(int(request_priority.get())),
+                image.sha256, str(num_variants),
+                hashlib.sha256(task_description.strip().encode("utf-8")).hexdigest()
+            ))
+            result, shared = await self.single_flight.do(
+                key, lambda: self._run_request(task_description, image, num_variants),
+                deadline=request_deadline.get()
+            )
+            if shared:
+                result = copy.deepcopy(result)
+        else:
+            result = await self._run_request(task_description, image, num_variants)
+        # Ghi theo từng request (không theo leader của single-flight) để vào đúng history của session
+        await self._record_result(result, task_description, image.sha256 if image is not None else None)
+        return result
+    
+    async def _run_request(
+        self,
+        task_description: str,
+        image: PreparedImage,
+        num_variants: int = 1
+    ) -> Dict[str, Any]:
+        start_time = time.time()
+        token_usage: Dict[str, Dict[str, int]] = {}
+        usage_token = request_token_usage.set(token_usage)
+        
+        with WORKFLOWS_IN_FLIGHT.track_inprogress(), self._hold_image(image) as image_handle:
+            # Initial state
+            initial_state = self._initial_state(
+                task_description, image, num_variants=num_variants, image_handle=image_handle
+            )
+            try:
+                # Run the workflow (ainvoke dùng các node async, không block event loop)
+                logger.info("Starting IELTS analysis workflow", extra={"num_variants": num_variants})
+                final_state = await self.workflow.ainvoke(initial_state)
+                result = self._build_result(final_state, start_time)
+                await self._save_analysis(final_state, result)
+                
+            except Exception as e:
+                processing_time = time.time() - start_time
+                logger.exception("Workflow failed")
+                result = {
                     "success": False,
-                    "error": final_state["error"],
+                    "error": f"Workflow execution failed: {str(e)}",
                     "processing_time": processing_time
                 }
-            
-            # Convert to response format
-            chart_analysis = ChartAnalysis(
-                chart_type=ChartType(final_state["chart_analysis"].get("chart_type", "unknown")),
-                title=final_state["chart_analysis"].get("title"),
-                description=final_state["chart_analysis"].get("description", ""),
-                key_data_points=final_state["chart_analysis"].get("key_data_points", []),
-                trends=final_state["chart_analysis"].get("trends", []),
-                comparisons=final_state["chart_analysis"].get("comparisons", []),
-                raw_data=final_state["chart_analysis"].get("raw_data")
-            )
-            
-            ielts_writing = IELTSWritingResponse(
-                introduction=final_state["ielts_writing"].get("introduction", ""),
-                overview=final_state["ielts_writing"].get("overview", ""),
-                body_paragraphs=final_state["ielts_writing"].get("body_paragraphs", []),
-                full_essay=final_state["ielts_writing"].get("full_essay", ""),
-                word_count=final_state["ielts_writing"].get("word_count", 0)
+            finally:
+                request_token_usage.reset(usage_token)
+        result["token_usage"] = token_usage
+        self._observe_result(result)
+        return result
+    
+    async def _save_analysis(self, final_state: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Lưu chart_analysis của request thành công và gắn analysis_id vào result"""
+        if self.analysis_store is None or not result.get("success"):
+            return
+        result["analysis_id"] = await self.analysis_store.save(
+            final_state["task_description"],
+            final_state["chart_analysis"],
+            final_state.get("image_sha256"),
+            essay_candidates=final_state.get("essay_candidates") or None,
+            tenant=request_tenant.get()
+        )
+    
+    async def _record_result(self, result: Dict[str, Any], task_description: str,
+                             image_sha256: Optional[str]) -> None:
+        """Lưu kết quả thành công vào result history và gắn result_id vào result"""
+        if self.result_history is None or not result.get("success"):
+            return
+        try:
+            result["result_id"] = await self.result_history.record(
+                result, task_description, image_sha256,
+                tenant=request_tenant.get(), session_id=request_session.get()
             )
-            
-            return {
-                "success": True,
-                "chart_analysis": chart_analysis.dict(),
-                "ielts_writing": ielts_writing.dict(),
-                "processing_time": processing_time
-            }
-            
-        except Exception as e:
-            processing_time = time.time() - start_time
-            print(f"❌ Workflow failed: {str(e)}")
+        except Exception:
+            # Không lưu được history thì request vẫn thành công
+            logger.exception("Failed to record result")
+    
+    async def regenerate(
+        self,
+        analysis_id: str,
+        target_band: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Viết lại bài từ chart_analysis đã lưu, chỉ tốn một lời gọi text model
+        
+        Chạy regenerate_workflow (bắt đầu tại generate_writing). Trả về cùng format
+        với process_request; status_code 404 nếu analysis_id không tồn tại/hết hạn
+        hoặc thuộc tenant khác.
+        """
+        start_time = time.time()
+        record = (
+            await self.analysis_store.load(analysis_id, tenant=request_tenant.get())
+            if self.analysis_store else None
+        )
+        if record is None:
             return {
                 "success": False,
-                "error": f"Workflow execution failed: {str(e)}",
-                "processing_time": processing_time
-            } 
\ No newline at end of file
+                "error": f"Analysis not found or expired: {analysis_id}",
+                "status_code": 404,
+                "processing_time": time.time() - start_time
+            }
+        
+        initial_state = self._initial_state(
+            record["task_description"],
+            image=None,
+            chart_analysis=record["chart_analysis"],
+            target_band=target_band
+        )
+        token_usage: Dict[str, Dict[str, int]] = {}
+        usage_token = request_token_usage.set(token_usage)
+        with WORKFLOWS_IN_FLIGHT.track_inprogress():
+            try:
+                logger.info("Regenerating essay", extra={"analysis_id": analysis_id})
+                final_state = await self.regenerate_workflow.ainvoke(initial_state)
+                result = self._build_result(final_state, start_time)
+            except Exception as e:
+                logger.exception("Regeneration failed")
+                result = {
+                    "success": False,
+                    "error": f"Workflow execution failed: {str(e)}",
+                    "processing_time": time.time() - start_time
+                }
+            finally:
+                request_token_usage.reset(usage_token)
+        result["token_usage"] = token_usage
+        self._observe_result(result)
+        if result.get("success"):
+            result["analysis_id"] = analysis_id
+            result["task_description"] = record["task_description"]
+            await self._record_result(result, record["task_description"], record.get("image_sha256"))
+        return result
+    
+    def _hold_image(self, image: Optional[PreparedImage]):
+        """Đưa ảnh vào IMAGE_BLOBS trong suốt một workflow, trả về handle"""
+        return IMAGE_BLOBS.hold(image, len(image.data) if image is not None else 0)
+    
+    def _apply_update(self, state: Dict[str, Any], update: Dict[str, Any]) -> None:
+        """Gộp update một phần của node vào state, dùng cùng reducer với graph"""
+        for key, value in update.items():
+            if key == "node_timings":
+                state[key] = merge_node_timings(state.get(key), value)
+            elif key == "essay_candidates":
+                state[key] = merge_essay_candidates(state.get(key), value)
+            else:
+                state[key] = value
+    
+    def _observe_result(self, result: Dict[str, Any]) -> None:
+        outcome = "success" if result.get("success") else "error"
+        WORKFLOW_LATENCY.observe(result.get("processing_time", 0.0), outcome=outcome)
+        # Một dòng tổng kết cho mỗi workflow (chi tiết từng node ở mức DEBUG)
+        logger.info("Workflow finished", extra={
+            "outcome": outcome,
+            "processing_time": round(result.get("processing_time", 0.0), 4),
+            "node_timings": {node: round(elapsed, 4) for node, elapsed in result.get("node_timings", {}).items()},
+            "token_usage": result.get("token_usage"),
+            "error": result.get("error"),
+        })
+    
+    async def astream_request(
+        self,
+        task_description: str,
+        image: PreparedImage,
+        stream_tokens: bool = True,
+        num_variants: int = 1
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming version of process_request
+        
+        Yields events as the workflow runs:
+        - {"event": "node", "node": ..., "processing_step": ...} khi mỗi node chạy xong
+        - {"event": "token", "text": ...} cho từng đoạn essay do model stream về
+          (chỉ khi stream_tokens=True)
+        - {"event": "result", ...} kết quả cuối, cùng format với process_request
+        
+        Nếu workflow chết trước khi có kết quả, stream kết thúc không có event result.
+        """
+        start_time = time.time()
+        events: asyncio.Queue = asyncio.Queue()
+        
+        def on_text(text: str) -> None:
+            events.put_nowait({"event": "token", "text": text})
+        
+        configurable = {"on_text": on_text} if stream_tokens else {}
+        
+        async def run() -> None:
+            # run() là task riêng (context riêng) nên không cần reset
+            token_usage: Dict[str, Dict[str, int]] = {}
+            request_token_usage.set(token_usage)
+            WORKFLOWS_IN_FLIGHT.inc()
+            with self._hold_image(image) as image_handle:
+                initial_state = self._initial_state(
+                    task_description, image, num_variants=num_variants, image_handle=image_handle
+                )
+                final_state: Dict[str, Any] = dict(initial_state)
+                try:
+                    async for update in self.workflow.astream(
+                        initial_state,
+                        config={"configurable": configurable},
+                        stream_mode="updates"
+                    ):
+                        for node, node_update in update.items():
+                            if node_update:
+                                self._apply_update(final_state, node_update)
+                            events.put_nowait({
+                                "event": "node",
+                                "node": node,
+                                "processing_step": final_state.get("processing_step", "")
+                            })
+                    result = self._build_result(final_state, start_time)
+                    await self._save_analysis(final_state, result)
+                except Exception as e:
+                    logger.exception("Workflow failed")
+                    result = {
+                        "success": False,
+                        "error": f"Workflow execution failed: {str(e)}",
+                        "processing_time": time.time() - start_time
+                    }
+                finally:
+                    WORKFLOWS_IN_FLIGHT.dec()
+            result["token_usage"] = token_usage
+            self._observe_result(result)
+            await self._record_result(result, task_description, image.sha256 if image is not None else None)
+            events.put_nowait({"event": "result", **result})
+        
+        def on_done(finished: asyncio.Task) -> None:
+            if not finished.cancelled() and finished.exception() is not None:
+                logger.error("Streaming workflow crashed", exc_info=finished.exception())
+            # run() chết trước khi gửi result: báo hết stream thay vì để generator chờ mãi
+            events.put_nowait(None)
+        
+        logger.info("Starting IELTS analysis workflow (streaming)", extra={"num_variants": num_variants})
+        task = asyncio.create_task(run())
+        task.add_done_callback(on_done)
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                is_result = event["event"] == "result"
+                yield event
+                if is_result:
+                    break
+        finally:
+            # Client ngắt kết nối giữa chừng thì dừng luôn workflow
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from app.services.model_provider import ModelProvider
+
+CHART_ANALYSIS = {
+    "chart_type": "bar_chart",
+    "chart_components": ["bar_chart"],
+    "title": "Bottled water consumption by region, 1999-2001",
+    "description": "The bar chart compares bottled water consumption in four regions over three years.",
+    "key_data_points": [
+        "The U.S.A accounted for 48% of consumption in 1999",
+        "Asia grew by 14% between 1999 and 2001",
+        "Europe remained stable at around 30%",
+    ],
+    "trends": ["Consumption rose in every region", "Asia showed the fastest growth"],
+    "comparisons": ["The U.S.A consumed more than Europe and Asia combined in 1999"],
+    "insights": ["Emerging markets drove most of the growth"],
+    "raw_data": {
+        "U.S.A": {"1999": 48, "2000": 50, "2001": 52},
+        "Europe": {"1999": 30, "2000": 30, "2001": 31},
+        "Asia": {"1999": 12, "2000": 19, "2001": 26},
+    },
+}
+
+_BODY = (
+    "In 1999 the U.S.A was by far the largest consumer, accounting for 48% of the total, "
+    "while Europe and Asia represented 30% and 12% respectively. Over the following two years "
+    "consumption in the U.S.A edged up to 52%, whereas Europe remained virtually unchanged. "
+)
+
+IELTS_ESSAY = {
+    "introduction": "The bar chart illustrates bottled water consumption in three regions between 1999 and 2001.",
+    "overview": "Overall, consumption increased in all regions, with Asia recording the most rapid growth.",
+    "body_paragraphs": [_BODY, _BODY],
+    "full_essay": " ".join([
+        "The bar chart illustrates bottled water consumption in three regions between 1999 and 2001.",
+        "Overall, consumption increased in all regions, with Asia recording the most rapid growth.",
+        _BODY, _BODY,
+    ]),
+    "word_count": 170,
+}
+
+
+@dataclass
+class LatencyProfile:
+    """
+    Phân bố latency giả lập của một lời gọi model (giây)
+
+    kind: fixed | uniform | lognormal. Với lognormal, `median` là trung vị và
+    `sigma` điều khiển độ dài đuôi (0.5 ~ p99 gấp ~3 lần trung vị).
+    """
+
+    kind: str = "lognormal"
+    median: float = 1.0
+    sigma: float = 0.5
+    low: float = 0.0
+    high: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.median
+        if self.kind == "uniform":
+            return rng.uniform(self.low, self.high)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(max(self.median, 1e-6)), self.sigma)
+        raise ValueError(f"Unknown latency kind: {self.kind}")
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyProfile":
+        """
+        Parse từ chuỗi CLI: "fixed:0.5", "uniform:0.2:1.5", "lognormal:1.0:0.5"
+        """
+        kind, *values = spec.split(":")
+        numbers = [float(value) for value in values]
+        if kind == "fixed":
+            return cls(kind=kind, median=numbers[0])
+        if kind == "uniform":
+            return cls(kind=kind, low=numbers[0], high=numbers[1])
+        if kind == "lognormal":
+            return cls(kind=kind, median=numbers[0], sigma=numbers[1] if len(numbers) > 1 else 0.5)
+        raise ValueError(f"Unknown latency kind: {kind}")
+
+
+class _UsageMetadata:
+    def __init__(self, total_token_count: int):
+        self.total_token_count = total_token_count
+
+
+class LocalResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = _UsageMetadata(max(1, len(text) // 4))
+
+
+class _LocalChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class LocalStreamResponse:
+    """Response stream=True: async iterable các chunk, chia đều latency cho từng chunk"""
+
+    def __init__(self, text: str, delay: float, chunk_size: int):
+        self._chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        self._delay = delay / len(self._chunks)
+        self.usage_metadata = _UsageMetadata(max(1, len(text) // 4))
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield _LocalChunk(chunk)
+
+
+class LocalGenerativeModel:
+    """
+    Stand-in cho genai.GenerativeModel trả về JSON cố định
+
+    Cùng interface generate_content/generate_content_async mà GeminiService dùng.
+    `failure_rate` là xác suất một lời gọi raise ServiceUnavailable (lỗi retry được),
+    để benchmark cả đường retry/circuit breaker.
+    """
+
+    def __init__(self, payload: Dict[str, Any], latency: Optional[LatencyProfile] = None,
+                 failure_rate: float = 0.0, stream_chunk_size: int = 64, seed: Optional[int] = None):
+        self.text = "```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```"
+        self.latency = latency or LatencyProfile()
+        self.failure_rate = failure_rate
+        self.stream_chunk_size = stream_chunk_size
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    def _maybe_fail(self) -> None:
+        if self.failure_rate and self._rng.random() < self.failure_rate:
+            self.failures += 1
+            raise google_exceptions.ServiceUnavailable("local model: injected failure")
+
+    def generate_content(self, contents: Any, **kwargs: Any) -> LocalResponse:
+        self.calls += 1
+        delay = self.latency.sample(self._rng)
+        time.sleep(delay)
+        self._maybe_fail()
+        return LocalResponse(self.text)
+
+    async def generate_content_async(self, contents: Any, stream: bool = False,
+                                     request_options: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any):
+        self.calls += 1
+        delay = self.latency.sample(self._rng)
+        timeout = (request_options or {}).get("timeout")
+        if stream:
+            self._maybe_fail()
+            return LocalStreamResponse(self.text, delay, self.stream_chunk_size)
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("local model: request timed out")
+        await asyncio.sleep(delay)
+        self._maybe_fail()
+        return LocalResponse(self.text)
+
+
+class LocalProvider(ModelProvider):
+    """
+    Provider chạy hoàn toàn local, không cần mạng hay API key
+
+    Dùng cho test, benchmark và phát triển frontend. Latency và tỉ lệ lỗi giả lập
+    cấu hình được để tái hiện hành vi của Gemini dưới tải.
+    """
+
+    name = "local"
+
+    def __init__(self, chart_latency: Optional[LatencyProfile] = None,
+                 essay_latency: Optional[LatencyProfile] = None,
+                 failure_rate: float = 0.0, seed: Optional[int] = None):
+        self._models = {
+            "vision": LocalGenerativeModel(CHART_ANALYSIS, chart_latency, failure_rate, seed=seed),
+            "writing": LocalGenerativeModel(
+                IELTS_ESSAY, essay_latency, failure_rate, seed=None if seed is None else seed + 1
+            ),
+        }
+
+    @classmethod
+    def from_env(cls) -> "LocalProvider":
+        return cls(
+            chart_latency=LatencyProfile.parse(os.getenv("LOCAL_MODEL_CHART_LATENCY", "fixed:0")),
+            essay_latency=LatencyProfile.parse(os.getenv("LOCAL_MODEL_ESSAY_LATENCY", "fixed:0")),
+            failure_rate=float(os.getenv("LOCAL_MODEL_FAILURE_RATE", "0")),
+        )
+
+    def model(self, purpose: str) -> LocalGenerativeModel:
+        return self._models[purpose]
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "status": "ready",
+            "calls": {purpose: model.calls for purpose, model in self._models.items()},
+            "injected_failures": {purpose: model.failures for purpose, model in self._models.items()},
+        }
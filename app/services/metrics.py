@@ -0,0 +1,312 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Bucket mặc định (giây): từ vài ms (cache hit, node xử lý local) đến vài chục giây (Gemini)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# Bucket kích thước payload (bytes): 1KB -> 16MB
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Bucket số token mỗi lời gọi model
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(),
+        ]
+
+
+class Counter(_Metric):
+    """Giá trị chỉ tăng (số request, số cache hit...)"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Giá trị tăng/giảm (số request đang xử lý...)"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class CallbackGauge(_Metric):
+    """Gauge đọc giá trị lúc scrape (độ sâu hàng đợi...), không cần cập nhật liên tục"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        try:
+            value = float(self.callback())
+        except Exception:
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Phân bố giá trị theo bucket cố định (latency, kích thước payload)"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> (số đếm từng bucket, tổng, số mẫu)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def snapshot(self, **labels: str) -> Tuple[float, int]:
+        """(tổng, số mẫu) cho một bộ label"""
+        _, total, count = self._values.get(self._key(labels)) or ([], 0.0, 0)
+        return total, count
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registry tối giản xuất metrics theo Prometheus text format (0.0.4)
+
+    Metrics sống trong process; mỗi worker uvicorn có registry riêng, Prometheus
+    scrape từng worker và cộng lại.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback_gauge(self, name: str, documentation: str, callback: Callable[[], float]) -> CallbackGauge:
+        """Đăng ký (hoặc thay) gauge đọc giá trị từ callback lúc scrape"""
+        metric = CallbackGauge(name, documentation, callback)
+        self._metrics[name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Workflow
+NODE_LATENCY = REGISTRY.histogram(
+    "ielts_workflow_node_duration_seconds", "Time spent in each LangGraph node", ("node",)
+)
+WORKFLOW_LATENCY = REGISTRY.histogram(
+    "ielts_workflow_duration_seconds", "End-to-end workflow time per request", ("outcome",)
+)
+WORKFLOWS_IN_FLIGHT = REGISTRY.gauge(
+    "ielts_workflows_in_flight", "Workflows currently executing"
+)
+
+# HTTP
+HTTP_REQUEST_LATENCY = REGISTRY.histogram(
+    "ielts_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "ielts_http_requests_in_flight", "HTTP requests currently being served"
+)
+
+# Ảnh
+IMAGE_PREPROCESS_LATENCY = REGISTRY.histogram(
+    "ielts_image_preprocess_duration_seconds", "Time to decode and normalize an uploaded chart image"
+)
+IMAGE_BYTES = REGISTRY.histogram(
+    "ielts_image_bytes", "Chart image size before and after normalization", ("stage",), buckets=SIZE_BUCKETS
+)
+CHART_CLASSIFY_LATENCY = REGISTRY.histogram(
+    "ielts_chart_classify_duration_seconds", "Time to pre-classify the chart type on CPU"
+)
+CHART_PREDICTIONS = REGISTRY.counter(
+    "ielts_chart_predictions_total", "Chart types predicted by the local pre-classifier", ("chart_type",)
+)
+
+# Model
+MODEL_QUEUE_LATENCY = REGISTRY.histogram(
+    "ielts_model_queue_duration_seconds", "Time a model call waited for RPM/TPM quota", ("call",)
+)
+MODEL_NETWORK_LATENCY = REGISTRY.histogram(
+    "ielts_model_network_duration_seconds", "Time from sending a model request to the full response", ("call",)
+)
+MODEL_PAYLOAD_BYTES = REGISTRY.histogram(
+    "ielts_model_payload_bytes", "Model request and response payload sizes", ("call", "direction"),
+    buckets=SIZE_BUCKETS
+)
+MODEL_CALL_ERRORS = REGISTRY.counter(
+    "ielts_model_call_errors_total", "Model call attempts that raised", ("call", "error")
+)
+MODEL_TOKENS = REGISTRY.histogram(
+    "ielts_model_tokens", "Input/output tokens per model call (usage metadata, else local estimate)",
+    ("call", "direction"), buckets=TOKEN_BUCKETS
+)
+PROMPT_TRUNCATIONS = REGISTRY.counter(
+    "ielts_prompt_truncations_total", "Prompts whose analysis fields were cut to fit the token budget",
+    ("prompt",)
+)
+STRUCTURED_OUTPUTS = REGISTRY.counter(
+    "ielts_structured_output_total",
+    "Parsed model responses by outcome (valid, repaired, reasked, fallback)", ("call", "outcome")
+)
+
+# Single-flight
+SINGLE_FLIGHT_REQUESTS = REGISTRY.counter(
+    "ielts_single_flight_requests_total",
+    "Calls through a single-flight group; role=follower calls were coalesced into a running one",
+    ("flight", "role")
+)
+
+# Cache
+CACHE_REQUESTS = REGISTRY.counter(
+    "ielts_cache_requests_total", "Cache lookups by result", ("cache", "result")
+)
+
+# Logging
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "ielts_log_records_dropped_total", "Log records dropped because the log queue was full"
+)
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# Model dùng cho từng loại lời gọi; hiện tại cùng một model
+MODEL_PURPOSES = ("vision", "writing")
+
+
+class ModelProvider(ABC):
+    """
+    Interface cho backend model mà GeminiService gọi
+
+    model(purpose) trả về object có generate_content/generate_content_async
+    (cùng interface với genai.GenerativeModel). Provider được tạo một lần mỗi
+    process và dùng chung cho mọi request.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def model(self, purpose: str) -> Any:
+        raise NotImplementedError
+
+    def prepare(self) -> None:
+        """Gọi trước mỗi lời gọi async; phải rẻ (chỉ khởi tạo client khi cần)"""
+
+    async def warmup(self) -> None:
+        """Khởi tạo client/kết nối trước request đầu tiên"""
+
+    async def aclose(self) -> None:
+        """Đóng kết nối khi shutdown"""
+
+    def health(self) -> Dict[str, Any]:
+        """Trạng thái provider cho /health; không được gọi mạng hay khởi tạo lại SDK"""
+        return {"provider": self.name, "status": "ready"}
+
+
+class GeminiProvider(ModelProvider):
+    """
+    Provider Gemini: cấu hình SDK đúng một lần và giữ các GenerativeModel sống suốt process
+
+    Lời gọi async dùng một GenerativeServiceAsyncClient riêng với gRPC keep-alive,
+    để kết nối HTTP/2 tới Gemini không bị đóng khi idle và các request dùng chung
+    một channel thay vì mỗi lần bắt tay TLS mới.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = GEMINI_MODEL_NAME,
+                 keepalive_seconds: float = 30.0, warmup_timeout: float = 5.0):
+        import google.generativeai as genai
+
+        self.model_name = model_name
+        self.keepalive_seconds = keepalive_seconds
+        self.warmup_timeout = warmup_timeout
+        self._api_key = api_key
+        genai.configure(api_key=api_key)
+        self._models = {purpose: genai.GenerativeModel(model_name) for purpose in MODEL_PURPOSES}
+        self._async_client = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.created_at = time.time()
+        self.warmed_up = False
+        self.last_warmup_error: Optional[str] = None
+
+    def model(self, purpose: str) -> Any:
+        return self._models[purpose]
+
+    def _create_async_client(self):
+        from google.ai.generativelanguage_v1beta.services.generative_service import (
+            GenerativeServiceAsyncClient,
+        )
+        from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc_asyncio import (
+            GenerativeServiceGrpcAsyncIOTransport,
+        )
+
+        keepalive_ms = int(self.keepalive_seconds * 1000)
+
+        class KeepAliveTransport(GenerativeServiceGrpcAsyncIOTransport):
+            @classmethod
+            def create_channel(cls, *args, **kwargs):
+                kwargs["options"] = list(kwargs.get("options") or []) + [
+                    ("grpc.keepalive_time_ms", keepalive_ms),
+                    ("grpc.keepalive_timeout_ms", 10000),
+                    ("grpc.keepalive_permit_without_calls", 1),
+                    ("grpc.http2.max_pings_without_data", 0),
+                ]
+                return super().create_channel(*args, **kwargs)
+
+        return GenerativeServiceAsyncClient(
+            transport=KeepAliveTransport if keepalive_ms > 0 else "grpc_asyncio",
+            client_options={"api_key": self._api_key},
+        )
+
+    def prepare(self) -> None:
+        # Channel gRPC asyncio gắn với event loop tạo ra nó
+        loop = asyncio.get_running_loop()
+        if self._async_client is not None and self._client_loop is loop:
+            return
+        try:
+            client = self._create_async_client()
+        except Exception as e:
+            # Không tạo được client riêng thì để SDK tự tạo client mặc định
+            logger.warning("Falling back to default Gemini async client", extra={"error": str(e)})
+            self._client_loop = loop
+            return
+        for model in self._models.values():
+            # GenerativeModel tạo client async lười ở lần gọi đầu (google-generativeai 0.7.x)
+            model._async_client = client
+        self._async_client = client
+        self._client_loop = loop
+
+    async def warmup(self) -> None:
+        try:
+            self.prepare()
+            if self._async_client is not None:
+                # Mở kết nối TCP/TLS trước, không tốn quota
+                channel = self._async_client.transport.grpc_channel
+                await asyncio.wait_for(channel.channel_ready(), self.warmup_timeout)
+            self.warmed_up = True
+            self.last_warmup_error = None
+            logger.info("Gemini client warmed up")
+        except Exception as e:
+            self.last_warmup_error = f"{type(e).__name__}: {str(e)}"
+            logger.warning("Gemini warmup failed", extra={"error": self.last_warmup_error})
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.transport.close()
+            self._async_client = None
+            self._client_loop = None
+            for model in self._models.values():
+                model._async_client = None
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "status": "ready",
+            "model": self.model_name,
+            "warmed_up": self.warmed_up,
+            "last_warmup_error": self.last_warmup_error,
+            "uptime_seconds": time.time() - self.created_at,
+        }
+
+
+_provider: Optional[ModelProvider] = None
+
+
+def create_model_provider() -> ModelProvider:
+    """
+    Tạo provider từ biến môi trường
+
+    MODEL_PROVIDER: gemini (mặc định) | local (stand-in trả JSON cố định, không cần API key)
+    """
+    provider_name = os.getenv("MODEL_PROVIDER", "gemini").lower()
+    if provider_name == "local":
+        from app.services.local_provider import LocalProvider
+        return LocalProvider.from_env()
+    if provider_name == "gemini":
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is required")
+        return GeminiProvider(
+            api_key,
+            keepalive_seconds=float(os.getenv("GEMINI_KEEPALIVE_SECONDS", "30")),
+            warmup_timeout=float(os.getenv("GEMINI_WARMUP_TIMEOUT_SECONDS", "5")),
+        )
+    raise ValueError(f"Unknown MODEL_PROVIDER: {provider_name}")
+
+
+def get_model_provider() -> ModelProvider:
+    """Provider dùng chung trong process"""
+    global _provider
+    if _provider is None:
+        _provider = create_model_provider()
+    return _provider
+
+
+def set_model_provider(provider: Optional[ModelProvider]) -> None:
+    """Thay provider của process (test/benchmark); phải gọi trước khi tạo GeminiService"""
+    global _provider
+    _provider = provider
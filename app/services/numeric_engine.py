@@ -0,0 +1,406 @@
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Số dữ kiện tối đa sinh ra cho một bảng (fact sheet ngắn gọn cho prompt)
+MAX_FACTS_PER_TABLE = 12
+# |% thay đổi| dưới ngưỡng này coi là ổn định
+STABLE_CHANGE_PCT = 5.0
+# Số bảng tối đa đọc từ raw_data (ảnh nhiều biểu đồ)
+MAX_TABLES = 4
+
+_NUMBER_RE = re.compile(r"-?\d+(?:,\d{3})*(?:\.\d+)?")
+_YEAR_LIKE_RE = re.compile(r"^\s*\d{1,4}(?:\.\d+)?\s*$")
+
+
+@dataclass
+class DataTable:
+    """
+    Số liệu của một biểu đồ dạng ma trận: hàng = series, cột = mốc thời gian/hạng mục
+
+    Ô thiếu là NaN. time_axis=True khi các cột là mốc số (năm) đã sắp xếp tăng dần.
+    """
+    name: str
+    series: List[str]
+    columns: List[str]
+    values: np.ndarray
+    unit: str = ""
+    time_axis: bool = False
+
+
+def parse_number(value: Any) -> Tuple[Optional[float], str]:
+    """Số và đơn vị ('%' hoặc '') từ 48, "48%", "1,200", "$3.5 million"; (None, '') nếu không có số"""
+    if isinstance(value, bool):
+        return None, ""
+    if isinstance(value, (int, float)):
+        return (float(value), "") if np.isfinite(value) else (None, "")
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match is None:
+            return None, ""
+        return float(match.group().replace(",", "")), "%" if "%" in value else ""
+    return None, ""
+
+
+def _is_numeric_label(label: str) -> bool:
+    return bool(_YEAR_LIKE_RE.match(label))
+
+
+def _build_table(name: str, rows: Dict[str, Dict[str, Any]]) -> Optional[DataTable]:
+    """rows: {series: {cột: giá_trị}} -> DataTable; None nếu không có đủ số"""
+    columns: List[str] = []
+    for cells in rows.values():
+        for column in cells:
+            if column not in columns:
+                columns.append(column)
+    # Mốc thời gian ở ngoài, series ở trong ({"2000": {"A": 1}}): đảo lại
+    if all(_is_numeric_label(key) for key in rows) and not all(_is_numeric_label(c) for c in columns):
+        flipped: Dict[str, Dict[str, Any]] = {}
+        for outer, cells in rows.items():
+            for inner, value in cells.items():
+                flipped.setdefault(inner, {})[outer] = value
+        rows, columns = flipped, list(rows)
+
+    time_axis = len(columns) > 1 and all(_is_numeric_label(column) for column in columns)
+    if time_axis:
+        columns = sorted(columns, key=lambda column: float(column))
+
+    values = np.full((len(rows), len(columns)), np.nan)
+    units = set()
+    for i, cells in enumerate(rows.values()):
+        for j, column in enumerate(columns):
+            number, unit = parse_number(cells.get(column))
+            if number is not None:
+                values[i, j] = number
+                units.add(unit)
+    # Bỏ hàng/cột không có số nào (nanargmax/nanmax trên lát toàn NaN sẽ lỗi)
+    keep_rows = ~np.isnan(values).all(axis=1)
+    keep_columns = ~np.isnan(values).all(axis=0)
+    if not keep_rows.any():
+        return None
+    series = [str(label) for label, keep in zip(rows, keep_rows) if keep]
+    columns = [str(column) for column, keep in zip(columns, keep_columns) if keep]
+    values = values[keep_rows][:, keep_columns]
+    time_axis = time_axis and len(columns) > 1
+    unit = "%" if units == {"%"} else ""
+    return DataTable(name, series, columns, values, unit, time_axis)
+
+
+# Tên field thường dùng làm nhãn hàng/trục (record hoặc list song song)
+_LABEL_KEYS = {
+    "year", "years", "date", "dates", "period", "periods", "time", "month", "months", "quarter",
+    "label", "labels", "name", "names", "category", "categories", "country", "countries",
+    "region", "regions", "item", "items",
+}
+
+
+def _is_text(value: Any) -> bool:
+    return isinstance(value, str) and parse_number(value)[0] is None
+
+
+def _is_year_like(value: Any) -> bool:
+    number, unit = parse_number(value)
+    return number is not None and not unit and number == int(number) and 1000 <= number <= 2100
+
+
+def _label_key(fields: Dict[str, List[Any]]) -> Optional[str]:
+    """
+    Field dùng làm nhãn: tên quen thuộc (year, country...), field toàn chữ, hoặc
+    field đầu tiên toàn giá trị dạng năm; None nếu mọi field đều là số liệu
+    """
+    for key in fields:
+        if str(key).strip().lower() in _LABEL_KEYS:
+            return key
+    for key, values in fields.items():
+        if values and all(_is_text(value) for value in values if value is not None):
+            return key
+    first = next(iter(fields), None)
+    if first is not None and fields[first] and all(_is_year_like(value) for value in fields[first]):
+        return first
+    return None
+
+
+def _label(value: Any) -> str:
+    number, unit = parse_number(value) if not isinstance(value, str) else (None, "")
+    if number is not None and number == int(number):
+        return str(int(number))
+    return str(value)
+
+
+def _records_to_rows(records: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    [{"region": "USA", "1999": 48}, ...] -> {"USA": {"1999": 48}}
+
+    Nhãn hàng là field do _label_key chọn trên toàn bộ list (vd. "year": 1999),
+    không có thì đánh số #1, #2...
+    """
+    records = [record for record in records if isinstance(record, dict)]
+    fields: Dict[str, List[Any]] = {}
+    for record in records:
+        for key, value in record.items():
+            fields.setdefault(key, []).append(value)
+    label_key = _label_key(fields)
+    rows: Dict[str, Dict[str, Any]] = {}
+    for index, record in enumerate(records):
+        label = _label(record[label_key]) if label_key in record else f"#{index + 1}"
+        rows[label] = {str(key): value for key, value in record.items() if key != label_key}
+    return rows
+
+
+def _is_scalar_list(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and not any(isinstance(item, (dict, list)) for item in value)
+
+
+def _columns_to_rows(columns: Dict[str, List[Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Dạng cột song song {"years": [1999, 2000], "USA": [48, 50]} -> {"USA": {"1999": 48, "2000": 50}}
+
+    List nhãn do _label_key chọn; các list khác độ dài với list nhãn bị bỏ qua.
+    """
+    label_key = _label_key(columns)
+    if label_key is None:
+        length = max(len(values) for values in columns.values())
+        labels = [f"#{index + 1}" for index in range(length)]
+    else:
+        labels = [_label(value) for value in columns[label_key]]
+    return {
+        str(series): dict(zip(labels, values))
+        for series, values in columns.items()
+        if series != label_key and len(values) == len(labels)
+    }
+
+
+def extract_tables(raw_data: Any, name: str = "") -> List[DataTable]:
+    """
+    Đọc raw_data (format tự do do model trả về) thành các DataTable
+
+    Hỗ trợ {label: value} (một hàng, vd. pie), {series: {cột: value}}, list các
+    record, dạng cột song song ({"years": [...], "USA": [...]}) và một tầng lồng
+    nữa cho ảnh nhiều biểu đồ ({biểu_đồ: {series: {...}}}). raw_data không phải
+    dict/list thì trả về [].
+    """
+    if isinstance(raw_data, list):
+        raw_data = _records_to_rows(raw_data)
+    if not isinstance(raw_data, dict) or not raw_data:
+        return []
+
+    tables: List[DataTable] = []
+    scalar_lists = {str(key): value for key, value in raw_data.items() if _is_scalar_list(value)}
+    if len(scalar_lists) >= 2:
+        table = _build_table(name, _columns_to_rows(scalar_lists))
+        if table is not None:
+            tables.append(table)
+        raw_data = {key: value for key, value in raw_data.items() if str(key) not in scalar_lists}
+
+    scalars = {key: value for key, value in raw_data.items() if not isinstance(value, (dict, list))}
+    nested = {key: value for key, value in raw_data.items() if isinstance(value, (dict, list))}
+    if scalars:
+        table = _build_table(name, {name or "value": scalars})
+        if table is not None:
+            tables.append(table)
+
+    flat_rows: Dict[str, Dict[str, Any]] = {}
+    for key, value in nested.items():
+        if isinstance(value, list):
+            if _is_scalar_list(value):
+                # Một list số đứng riêng, không có list nhãn đi kèm
+                value = {f"#{index + 1}": item for index, item in enumerate(value)}
+            else:
+                value = _records_to_rows(value)
+        if any(isinstance(cell, (dict, list)) for cell in value.values()):
+            # Một biểu đồ con: đọc riêng thành bảng khác
+            tables.extend(extract_tables(value, name=str(key)))
+        elif value:
+            flat_rows[str(key)] = value
+    if flat_rows:
+        table = _build_table(name, flat_rows)
+        if table is not None:
+            tables.append(table)
+    return tables[:MAX_TABLES]
+
+
+def format_value(value: float, unit: str = "") -> str:
+    if abs(value - round(value)) < 1e-9:
+        text = f"{int(round(value)):,}"
+    elif abs(value) >= 100:
+        text = f"{value:,.0f}"
+    else:
+        text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return text + unit
+
+
+def _direction(change_pct: float, diffs: np.ndarray, spread_pct: float) -> str:
+    """increase / decrease / stable / fluctuate theo % thay đổi và số lần đổi chiều"""
+    signs = np.sign(diffs[np.abs(diffs) > 0])
+    reversals = int(np.count_nonzero(signs[1:] != signs[:-1])) if len(signs) > 1 else 0
+    if reversals >= 2 and spread_pct >= 2 * STABLE_CHANGE_PCT:
+        return "fluctuate"
+    if abs(change_pct) < STABLE_CHANGE_PCT:
+        return "stable"
+    return "increase" if change_pct > 0 else "decrease"
+
+
+def compute_facts(table: DataTable) -> Dict[str, Any]:
+    """
+    Các dữ kiện số của một bảng, tính vector hoá trên toàn ma trận
+
+    - ranking: series xếp theo giá trị mới nhất (hoặc các phần của bảng một hàng), kèm tỉ trọng
+    - extremes: ô lớn nhất/nhỏ nhất của cả bảng
+    - changes (khi cột là mốc thời gian): đầu/cuối, chênh lệch, % thay đổi, đỉnh/đáy, xu hướng
+    - leaders: series cao nhất/thấp nhất ở mỗi cột
+    """
+    values = table.values
+    valid = ~np.isnan(values)
+    facts: Dict[str, Any] = {"name": table.name, "unit": table.unit, "time_axis": table.time_axis}
+
+    flat_index = np.nanargmax(values)
+    low_index = np.nanargmin(values)
+    max_row, max_col = np.unravel_index(flat_index, values.shape)
+    min_row, min_col = np.unravel_index(low_index, values.shape)
+    facts["extremes"] = {
+        "max": {"series": table.series[max_row], "column": table.columns[max_col], "value": float(values[max_row, max_col])},
+        "min": {"series": table.series[min_row], "column": table.columns[min_col], "value": float(values[min_row, min_col])},
+    }
+
+    # Cột cuối có dữ liệu của từng series (series thiếu cột cuối dùng giá trị gần nhất)
+    last_index = values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    last = values[np.arange(values.shape[0]), last_index]
+    if values.shape[0] == 1 and table.time_axis:
+        # Một series theo thời gian: không xếp hạng các năm với nhau (changes mô tả rồi)
+        parts = np.empty(0)
+        labels = []
+    elif values.shape[0] == 1:
+        # Một hàng (pie/bảng một chiều): các cột chính là các phần
+        parts = values[0]
+        labels = table.columns
+    else:
+        parts = last
+        labels = table.series
+        # Chỉ ghi "in <cột cuối>" khi mọi series đều có số ở cột đó
+        if values.shape[1] > 1 and valid[:, -1].all():
+            facts["ranking_column"] = table.columns[-1]
+        elif values.shape[1] > 1:
+            facts["ranking_by_latest"] = True
+    order = np.argsort(-np.nan_to_num(parts, nan=-np.inf), kind="stable")
+    total = np.nansum(parts)
+    shares = parts / total * 100 if total > 0 and np.all(np.nan_to_num(parts) >= 0) else np.full_like(parts, np.nan)
+    facts["ranking"] = [
+        {"label": labels[i], "value": float(parts[i]), "share_pct": None if np.isnan(shares[i]) else float(shares[i])}
+        for i in order if not np.isnan(parts[i])
+    ]
+    facts["total"] = float(total)
+
+    if table.time_axis and values.shape[1] > 1:
+        first_index = np.argmax(valid, axis=1)
+        first = values[np.arange(values.shape[0]), first_index]
+        change = last - first
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change_pct = np.where(first != 0, change / np.abs(first) * 100, np.nan)
+            spread_pct = np.where(first != 0, (np.nanmax(values, axis=1) - np.nanmin(values, axis=1)) / np.abs(first) * 100, 0.0)
+        peaks = np.nanargmax(values, axis=1)
+        troughs = np.nanargmin(values, axis=1)
+        diffs = np.diff(values, axis=1)
+        facts["changes"] = []
+        for i, series in enumerate(table.series):
+            if first_index[i] == last_index[i]:
+                continue
+            pct = float(change_pct[i]) if not np.isnan(change_pct[i]) else None
+            facts["changes"].append({
+                "series": series,
+                "from": {"column": table.columns[first_index[i]], "value": float(first[i])},
+                "to": {"column": table.columns[last_index[i]], "value": float(last[i])},
+                "change": float(change[i]),
+                "change_pct": pct,
+                "peak": {"column": table.columns[peaks[i]], "value": float(values[i, peaks[i]])},
+                "trough": {"column": table.columns[troughs[i]], "value": float(values[i, troughs[i]])},
+                "direction": _direction(pct if pct is not None else 0.0, diffs[i][~np.isnan(diffs[i])], float(spread_pct[i])),
+            })
+
+    if values.shape[0] > 1 and values.shape[1] > 1:
+        filled = np.where(valid, values, -np.inf)
+        leaders = np.argmax(filled, axis=0)
+        laggards = np.argmin(np.where(valid, values, np.inf), axis=0)
+        facts["leaders"] = [
+            {"column": column, "highest": table.series[leaders[j]], "lowest": table.series[laggards[j]]}
+            for j, column in enumerate(table.columns) if valid[:, j].any()
+        ]
+    return facts
+
+
+def fact_sentences(facts: Dict[str, Any]) -> List[str]:
+    """Dữ kiện dạng câu ngắn tiếng Anh, dùng trong prompt viết bài và response"""
+    unit = facts["unit"]
+    prefix = f"[{facts['name']}] " if facts["name"] else ""
+    fmt = lambda value: format_value(value, unit)
+    sentences: List[str] = []
+
+    ranking = facts["ranking"]
+    if len(ranking) > 1:
+        ranked = ", ".join(
+            f"{item['label']} {fmt(item['value'])}"
+            + (f" ({item['share_pct']:.1f}% of total)" if item["share_pct"] is not None and unit != "%" else "")
+            for item in ranking
+        )
+        where = ""
+        if facts.get("ranking_column"):
+            where = f" in {facts['ranking_column']}"
+        elif facts.get("ranking_by_latest"):
+            where = " by latest value"
+        sentences.append(f"{prefix}Ranking{where}: {ranked}")
+        top, bottom = ranking[0], ranking[-1]
+        if bottom["value"] > 0:
+            sentences.append(
+                f"{prefix}{top['label']} ({fmt(top['value'])}) is {top['value'] / bottom['value']:.1f} times "
+                f"{bottom['label']} ({fmt(bottom['value'])})"
+            )
+
+    extremes = facts["extremes"]
+    for kind, label in (("max", "Highest"), ("min", "Lowest")):
+        cell = extremes[kind]
+        where = cell["column"] if cell["series"] in ("", "value", facts["name"]) else f"{cell['series']}, {cell['column']}"
+        sentences.append(f"{prefix}{label} value: {fmt(cell['value'])} ({where})")
+
+    for item in facts.get("changes", []):
+        change = item["change"]
+        if unit == "%":
+            amount = f"{format_value(abs(change))} percentage points"
+        else:
+            amount = fmt(abs(change))
+        pct = f", {item['change_pct']:+.1f}%" if item["change_pct"] is not None and unit != "%" else ""
+        sentences.append(
+            f"{prefix}{item['series']}: {item['direction']}, {fmt(item['from']['value'])} ({item['from']['column']}) "
+            f"to {fmt(item['to']['value'])} ({item['to']['column']}), "
+            f"{'up' if change > 0 else 'down' if change < 0 else 'unchanged'} {amount}{pct}; "
+            f"peak {fmt(item['peak']['value'])} in {item['peak']['column']}"
+        )
+
+    leaders = facts.get("leaders", [])
+    if leaders:
+        changes = [leaders[0]] + [
+            current for previous, current in zip(leaders, leaders[1:]) if current["highest"] != previous["highest"]
+        ]
+        if len(changes) == 1:
+            every = "period" if facts["time_axis"] else "category"
+            sentences.append(f"{prefix}{changes[0]['highest']} is highest in every {every}")
+        else:
+            sentences.append(
+                f"{prefix}Highest: " + ", then ".join(f"{item['highest']} from {item['column']}" for item in changes)
+            )
+    return sentences[:MAX_FACTS_PER_TABLE]
+
+
+def build_fact_sheet(chart_analysis: Dict[str, Any]) -> List[str]:
+    """
+    Fact sheet tính sẵn từ chart_analysis["raw_data"]; [] nếu raw_data không có số liệu dùng được
+
+    Chỉ là tính toán cục bộ (không gọi model), kết quả xác định với cùng raw_data.
+    """
+    sentences: List[str] = []
+    for table in extract_tables(chart_analysis.get("raw_data")):
+        try:
+            sentences.extend(fact_sentences(compute_facts(table)))
+        except (ValueError, IndexError):
+            continue
+    return sentences
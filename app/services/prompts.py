@@ -0,0 +1,319 @@
+import os
+import string
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.gemini_scheduler import estimate_tokens
+from app.services.metrics import PROMPT_TRUNCATIONS
+
+# Ngân sách token cho toàn bộ prompt viết bài (template + đề + phân tích biểu đồ)
+WRITING_PROMPT_MAX_TOKENS = int(os.getenv("WRITING_PROMPT_MAX_TOKENS", "1500"))
+# Độ dài tối đa của đề bài và của từng ý trong phân tích khi đưa vào prompt
+PROMPT_MAX_TASK_CHARS = int(os.getenv("PROMPT_MAX_TASK_CHARS", "2000"))
+PROMPT_MAX_ITEM_CHARS = int(os.getenv("PROMPT_MAX_ITEM_CHARS", "300"))
+
+# Các field dạng list của chart_analysis trong prompt viết bài, theo thứ tự
+# quan trọng giảm dần: khi vượt ngân sách thì cắt field cuối trước
+WRITING_LIST_FIELDS = (
+    ("computed_facts", "Số liệu đã tính sẵn (chính xác, dùng đúng các số này)"),
+    ("key_data_points", "Điểm dữ liệu chính"),
+    ("trends", "Xu hướng"),
+    ("comparisons", "So sánh"),
+    ("insights", "Insights"),
+)
+# Field của model được thay bằng fact sheet (computed_facts) khi có
+FACT_SHEET_REPLACES = ("trends", "comparisons")
+# Field chỉ đưa vào prompt khi có nội dung
+OPTIONAL_LIST_FIELDS = ("computed_facts", "insights")
+# Số ý tối thiểu giữ lại cho mỗi field khi cắt
+MIN_ITEMS_PER_FIELD = 2
+
+
+class PromptTemplate:
+    """
+    Template prompt được parse một lần lúc import
+
+    Cú pháp giống str.format ({field}, {{ }} cho dấu ngoặc). render() chỉ nối các
+    đoạn đã tách sẵn, và số token của phần cố định được tính trước để kiểm tra
+    ngân sách mà không cần render.
+    """
+
+    def __init__(self, name: str, template: str):
+        self.name = name
+        self._segments: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(template)
+        ]
+        self.fields = tuple(field for _, field in self._segments if field)
+        self.static_tokens = estimate_tokens("".join(literal for literal, _ in self._segments))
+
+    def render(self, **values: Any) -> str:
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field:
+                parts.append(str(values[field]))
+        return "".join(parts)
+
+
+class PromptRegistry:
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, name: str, template: str) -> PromptTemplate:
+        if name in self._templates:
+            raise ValueError(f"Prompt already registered: {name}")
+        self._templates[name] = PromptTemplate(name, template)
+        return self._templates[name]
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def has(self, name: str) -> bool:
+        return name in self._templates
+
+
+PROMPTS = PromptRegistry()
+
+PROMPTS.register("chart_analysis", """
+        Phân tích biểu đồ trong ảnh này theo đề bài IELTS Writing Task 1: "{task_description}"
+
+        QUAN TRỌNG: Ảnh có thể chứa NHIỀU biểu đồ khác nhau (pie chart, bar chart, line chart, table).
+        Hãy phân tích TẤT CẢ các biểu đồ có trong ảnh và tích hợp thông tin.
+
+        Hãy trả về kết quả trong format JSON với các thông tin sau:
+        {{
+            "chart_type": "loại biểu đồ chính (bar_chart/line_chart/pie_chart/table/mixed_chart)",
+            "chart_components": ["pie_chart", "bar_chart"],
+            "title": "tiêu đề chung của hình",
+            "description": "mô tả chi tiết về TẤT CẢ biểu đồ trong ảnh",
+            "key_data_points": [
+                "U.S.A accounted for 48% of global bottled water consumption in 1999",
+                "Asia showed 14% growth in bottled water consumption in 2001"
+            ],
+            "trends": ["các xu hướng chính từ TẤT CẢ dữ liệu"],
+            "comparisons": ["so sánh giữa các nhóm dữ liệu và giữa các biểu đồ"],
+            "insights": ["những insight sâu sắc từ việc kết hợp nhiều biểu đồ"],
+            "raw_data": {{"dữ liệu thô từ TẤT CẢ biểu đồ"}}
+        }}
+
+        QUAN TRỌNG - Format yêu cầu:
+        - key_data_points: PHẢI là array of strings, KHÔNG được là objects
+        - Mỗi data point là 1 câu hoàn chỉnh có số liệu cụ thể
+        - VD: "The U.S.A dominated with 48% of consumption in 1999"
+        - KHÔNG viết: {{"region": "U.S.A", "value": "48%"}}
+        - chart_components: Chỉ tên loại chart như "pie_chart", "bar_chart"
+
+        Hướng dẫn phân tích chi tiết:
+        1. XÁC ĐỊNH TẤT CẢ BIỂU ĐỒ: Đếm và mô tả từng biểu đồ trong ảnh
+        2. ĐỌC SỐ LIỆU CHÍNH XÁC: Trích xuất tất cả con số, phần trăm, năm tháng
+        3. TÌM MỐI LIÊN HỆ: Phân tích mối quan hệ giữa các biểu đồ
+        4. SO SÁNH ĐA CHIỀU: So sánh theo thời gian, theo nhóm, theo biểu đồ
+        5. XU HƯỚNG TỔNG THỂ: Tìm patterns từ việc kết hợp multiple charts
+        6. INSIGHTS SÂU: Đưa ra nhận xét thông minh từ multiple data sources
+
+        Ví dụ cho mixed chart: Nếu có pie chart + bar chart, hãy phân tích:
+        - Pie chart: phân bố tại 1 thời điểm
+        - Bar chart: thay đổi theo thời gian hoặc so sánh groups
+        - Mối liên hệ: regions nào dominant trong pie chart có growth như thế nào trong bar chart
+        """)
+
+# Prompt ngắn cho từng loại biểu đồ mà bộ phân loại cục bộ đã nhận ra
+# (mixed_chart/unknown dùng prompt chung "chart_analysis" ở trên)
+_CHART_JSON_FORMAT = """
+        Trả về JSON:
+        {{
+            "chart_type": "%s",
+            "title": "tiêu đề",
+            "description": "mô tả ngắn biểu đồ",
+            "key_data_points": ["câu hoàn chỉnh có số liệu cụ thể"],
+            "trends": ["xu hướng chính"],
+            "comparisons": ["so sánh nổi bật"],
+            "insights": ["nhận xét tổng quan"],
+            "raw_data": {{%s}}
+        }}
+        key_data_points là array of strings (không phải object).
+        Nếu ảnh thực ra không phải %s, ghi đúng loại vào chart_type.
+        """
+
+_CHART_GUIDANCE = {
+    "bar_chart": (
+        "biểu đồ cột (bar chart)", '"nhóm": {{"hạng mục": giá_trị}}',
+        "Đọc giá trị từng cột theo trục, nêu cột cao nhất/thấp nhất và chênh lệch giữa các nhóm.",
+    ),
+    "line_chart": (
+        "biểu đồ đường (line chart)", '"đường": {{"mốc thời gian": giá_trị}}',
+        "Đọc giá trị đầu/cuối và các đỉnh/đáy của từng đường, nêu xu hướng tăng/giảm và điểm giao nhau.",
+    ),
+    "pie_chart": (
+        "biểu đồ tròn (pie chart)", '"phần": "tỉ lệ %"',
+        "Đọc tỉ lệ từng phần (tổng 100%), nêu phần lớn nhất/nhỏ nhất và các phần gần bằng nhau.",
+    ),
+    "table": (
+        "bảng số liệu (table)", '"hàng": {{"cột": giá_trị}}',
+        "Đọc đủ các hàng/cột, nêu giá trị lớn nhất/nhỏ nhất theo hàng và theo cột.",
+    ),
+}
+
+for _chart_type, (_label, _raw_data, _guidance) in _CHART_GUIDANCE.items():
+    PROMPTS.register(
+        f"chart_analysis_{_chart_type}",
+        f"""
+        Phân tích {_label} trong ảnh theo đề bài IELTS Writing Task 1: "{{task_description}}"
+
+        {_guidance}
+        """ + _CHART_JSON_FORMAT % (_chart_type, _raw_data, _chart_type),
+    )
+
+PROMPTS.register("ielts_writing", """
+        Viết một bài IELTS Writing Task 1 hoàn chỉnh dựa trên thông tin sau:
+
+        Đề bài: {task_description}
+
+        Phân tích biểu đồ:
+        - Loại biểu đồ: {chart_type}
+        - Components: {chart_components}
+        - Tiêu đề: {title}
+        - Mô tả: {description}
+{analysis_lists}
+
+        QUAN TRỌNG - Hướng dẫn viết cho MULTI-CHART:
+        1. INTRODUCTION: Paraphrase đề bài và mô tả TẤT CẢ các biểu đồ có trong hình
+        2. OVERVIEW: Tóm tắt 2-3 xu hướng chính từ TẤT CẢ biểu đồ
+        3. BODY PARAGRAPH 1: Mô tả chi tiết biểu đồ đầu tiên với số liệu cụ thể
+        4. BODY PARAGRAPH 2: Mô tả chi tiết biểu đồ thứ hai và kết nối với biểu đồ đầu
+
+        Hãy viết bài theo cấu trúc IELTS Writing Task 1 chuẩn và trả về JSON format:
+        {{
+            "introduction": "Câu mở đầu paraphrase đề bài và mô tả TẤT CẢ biểu đồ",
+            "overview": "Đoạn tổng quan nêu 2-3 đặc điểm nổi bật nhất từ TẤT CẢ biểu đồ",
+            "body_paragraphs": ["Đoạn chi tiết về biểu đồ 1", "Đoạn chi tiết về biểu đồ 2 và so sánh"],
+            "full_essay": "Toàn bộ bài viết",
+            "word_count": số_từ_ước_tính
+        }}
+
+        Yêu cầu viết bài:
+        - Độ dài: 160-200 từ (nhiều hơn vì có nhiều chart)
+        - Từ vựng academic: utilize, demonstrate, illustrate, significant, substantial
+        - Linking words: while, whereas, in contrast, similarly, furthermore
+        - Số liệu cụ thể: dẫn chứng chính xác từ biểu đồ (ưu tiên "Số liệu đã tính sẵn" nếu có)
+        - Cấu trúc complex sentences
+        - Kết nối logic giữa các biểu đồ
+        - Không opinion, chỉ report data
+
+        Mẫu câu hay cho multi-chart:
+        - "The first chart illustrates... while the second chart demonstrates..."
+        - "Turning to the bar chart, it can be seen that..."
+        - "Comparing the data from both charts reveals that..."
+        """)
+
+PROMPTS.register("target_band", """
+        Band mục tiêu: {target_band}. Điều chỉnh từ vựng, độ đa dạng ngữ pháp và độ phức tạp
+        của câu cho đúng band này (không viết tốt hơn hay kém hơn band yêu cầu).
+        """)
+
+PROMPTS.register("reask", """
+        Câu trả lời JSON trước thiếu hoặc sai các field sau:
+{fields}
+
+        JSON đã có (giữ nguyên, không lặp lại): {current}
+
+        CHỈ trả về MỘT object JSON hợp lệ chứa đúng các field trên, không giải thích thêm.
+        """)
+
+
+def clip_text(text: str, max_chars: int) -> str:
+    """Cắt text dài ở ranh giới từ, thêm dấu … để model biết đã bị cắt"""
+    text = " ".join(str(text).split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+def _as_items(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value if item not in (None, "")]
+    return [str(value)]
+
+
+def fit_analysis_lists(chart_analysis: Dict[str, Any], budget_tokens: int) -> Tuple[str, bool]:
+    """
+    Format các field list của chart_analysis thành gạch đầu dòng trong ngân sách token
+
+    Mỗi ý bị cắt còn PROMPT_MAX_ITEM_CHARS ký tự; nếu vẫn vượt ngân sách thì bỏ
+    dần ý cuối của field ít quan trọng nhất (giữ tối thiểu MIN_ITEMS_PER_FIELD ý)
+    và ghi số ý bị lược bớt. Trả về (text, đã cắt hay chưa).
+    """
+    truncated = False
+    # Có fact sheet thì bỏ xu hướng/so sánh do model tự viết: prompt gọn hơn, số liệu không mâu thuẫn
+    replaced = FACT_SHEET_REPLACES if chart_analysis.get("computed_facts") else ()
+    fields: Dict[str, List[str]] = {}
+    for name, _ in WRITING_LIST_FIELDS:
+        if name in replaced:
+            continue
+        items = []
+        for item in _as_items(chart_analysis.get(name)):
+            clipped = clip_text(item, PROMPT_MAX_ITEM_CHARS)
+            truncated = truncated or clipped != " ".join(item.split())
+            items.append(clipped)
+        fields[name] = items
+
+    item_tokens = lambda item: estimate_tokens(item) + 2
+    total = sum(item_tokens(item) for items in fields.values() for item in items)
+    dropped = {name: 0 for name in fields}
+    for name in reversed(list(fields)):
+        items = fields[name]
+        while total > budget_tokens and len(items) > MIN_ITEMS_PER_FIELD:
+            total -= item_tokens(items.pop())
+            dropped[name] += 1
+            truncated = True
+
+    lines = []
+    for name, label in WRITING_LIST_FIELDS:
+        if name not in fields or (not fields[name] and name in OPTIONAL_LIST_FIELDS):
+            continue
+        lines.append(f"        - {label}:")
+        lines.extend(f"          • {item}" for item in fields[name])
+        if not fields[name]:
+            lines.append("          • (không có)")
+        if dropped[name]:
+            lines.append(f"          • (lược bớt {dropped[name]} ý ít quan trọng hơn)")
+    return "\n".join(lines), truncated
+
+
+def render_writing_prompt(chart_analysis: Dict[str, Any], task_description: str,
+                          target_band: Optional[float] = None) -> str:
+    """
+    Prompt viết bài với phần phân tích biểu đồ được giới hạn trong WRITING_PROMPT_MAX_TOKENS
+    """
+    template = PROMPTS.get("ielts_writing")
+    task = clip_text(task_description, PROMPT_MAX_TASK_CHARS)
+    scalars = {
+        "task_description": task,
+        "chart_type": chart_analysis.get("chart_type", "unknown"),
+        "chart_components": ", ".join(_as_items(chart_analysis.get("chart_components"))) or "N/A",
+        "title": clip_text(chart_analysis.get("title") or "N/A", PROMPT_MAX_ITEM_CHARS),
+        "description": clip_text(chart_analysis.get("description") or "N/A", 4 * PROMPT_MAX_ITEM_CHARS),
+    }
+    band_section = ""
+    if target_band is not None:
+        band_section = PROMPTS.get("target_band").render(target_band=f"{target_band:g}")
+
+    used = template.static_tokens + estimate_tokens(band_section)
+    used += sum(estimate_tokens(str(value)) for value in scalars.values())
+    analysis_lists, truncated = fit_analysis_lists(chart_analysis, max(0, WRITING_PROMPT_MAX_TOKENS - used))
+    if truncated:
+        PROMPT_TRUNCATIONS.inc(prompt=template.name)
+    return template.render(analysis_lists=analysis_lists, **scalars) + band_section
+
+
+def chart_prompt_name(chart_type: Optional[str] = None) -> str:
+    """Tên template phân tích biểu đồ: prompt riêng nếu có cho loại này, không thì prompt chung"""
+    name = f"chart_analysis_{chart_type}"
+    return name if PROMPTS.has(name) else "chart_analysis"
+
+
+def render_chart_prompt(task_description: str, chart_type: Optional[str] = None) -> str:
+    return PROMPTS.get(chart_prompt_name(chart_type)).render(
+        task_description=clip_text(task_description, PROMPT_MAX_TASK_CHARS)
+    )
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTokenBucket:
+    """
+    Token bucket rate limiter cho asyncio
+
+    `rate` token được nạp lại mỗi giây, tối đa `capacity` token. acquire() chờ
+    (không block event loop) cho đến khi đủ token.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, limit: float, burst: Optional[float] = None) -> "AsyncTokenBucket":
+        return cls(rate=limit / 60.0, capacity=burst if burst is not None else max(1.0, limit / 60.0))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Chờ đến khi lấy được `tokens` token; trả về thời gian đã chờ (giây)"""
+        tokens = min(tokens, self.capacity)
+        start = time.monotonic()
+        # Lock giữ thứ tự FIFO giữa các coroutine đang chờ
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return time.monotonic() - start
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+
+class TokenBucket:
+    """
+    Token bucket không khoá, dùng bên trong các scheduler tự quản lý việc chờ
+
+    consume() cho phép số token âm (nợ) để bù khi lượng dùng thực tế lớn hơn
+    ước tính.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    @classmethod
+    def per_minute(cls, limit: float) -> "TokenBucket":
+        return cls(rate=limit / 60.0, capacity=limit)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def time_until(self, tokens: float) -> float:
+        """Số giây cần chờ đến khi có đủ `tokens` token (0 nếu có ngay)"""
+        self._refill()
+        tokens = min(tokens, self.capacity)
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def consume(self, tokens: float) -> None:
+        self._refill()
+        self._tokens -= tokens
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+
+class SQLiteTokenBucket:
+    """
+    TokenBucket dùng chung giữa nhiều process qua một file SQLite
+
+    Cùng interface với TokenBucket, nhưng time_until()/consume()/available chỉ
+    đọc/ghi bản sao trong process (không I/O, an toàn trên event loop). Phần
+    token đã dùng được cộng dồn rồi đồng bộ với file trong worker thread
+    (asyncio.to_thread), tối đa mỗi sync_interval giây một lần: một transaction
+    BEGIN IMMEDIATE ghi phần đã dùng và đọc lại số token chung. Gọi ngoài event
+    loop (CLI, script) thì đồng bộ trực tiếp.
+
+    Dùng time.time() vì monotonic clock không so sánh được giữa các process.
+    Giữa hai lần đồng bộ, bản sao không thấy token mà worker khác vừa dùng nên
+    các worker có thể cùng vượt quota một chút; phần vượt thành nợ và được trừ dần.
+    """
+
+    def __init__(self, path: str, name: str, rate: float, capacity: float, sync_interval: float = 0.25):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        # _db_lock: connection SQLite; _state_lock: bản sao trong process (giữ rất ngắn)
+        self._db_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._tokens = capacity
+        self._updated_at = time.time()
+        # Token đã dùng trong process nhưng chưa ghi vào file
+        self._pending = 0.0
+        self._synced_at = 0.0
+        self._sync_task: Optional[asyncio.Future] = None
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS token_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+            (name, capacity, time.time()),
+        )
+        self.sync()
+
+    @classmethod
+    def per_minute(cls, path: str, name: str, limit: float) -> "SQLiteTokenBucket":
+        return cls(path, name, rate=limit / 60.0, capacity=limit)
+
+    def _update(self, consumed: float) -> float:
+        """Nạp lại theo thời gian đã trôi, trừ `consumed`; trả về số token còn lại (blocking)"""
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, updated_at = self._conn.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate) - consumed
+                self._conn.execute(
+                    "UPDATE token_buckets SET tokens = ?, updated_at = ? WHERE name = ?",
+                    (tokens, now, self.name),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return tokens
+
+    def sync(self) -> None:
+        """Ghi phần token đã dùng vào file và đọc lại số token chung (blocking)"""
+        with self._state_lock:
+            consumed, self._pending = self._pending, 0.0
+        try:
+            tokens = self._update(consumed)
+        except Exception:
+            with self._state_lock:
+                self._pending += consumed
+            raise
+        with self._state_lock:
+            # Trừ cả phần dùng thêm trong lúc transaction đang chạy
+            self._tokens = tokens - self._pending
+            self._updated_at = time.time()
+            self._synced_at = time.monotonic()
+
+    def _sync_in_background(self) -> None:
+        try:
+            self.sync()
+        except Exception:
+            logger.warning("token bucket sync failed", extra={"bucket": self.name, "path": self.path}, exc_info=True)
+
+    def _maybe_sync(self) -> None:
+        if time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._sync_in_background()
+            return
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = loop.create_task(asyncio.to_thread(self._sync_in_background))
+
+    def _local_tokens(self) -> float:
+        self._maybe_sync()
+        with self._state_lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated_at) * self.rate)
+            self._updated_at = now
+            return self._tokens
+
+    def time_until(self, tokens: float) -> float:
+        """Số giây cần chờ đến khi có đủ `tokens` token (0 nếu có ngay)"""
+        available = self._local_tokens()
+        tokens = min(tokens, self.capacity)
+        if available >= tokens:
+            return 0.0
+        return (tokens - available) / self.rate
+
+    def consume(self, tokens: float) -> None:
+        self._local_tokens()
+        with self._state_lock:
+            self._tokens -= tokens
+            self._pending += tokens
+
+    @property
+    def available(self) -> float:
+        return self._local_tokens()
@@ -0,0 +1,46 @@
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict, Optional
+
+
+class Priority(IntEnum):
+    """Độ ưu tiên khi gọi model; số nhỏ hơn được phục vụ trước"""
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+# Context của request hiện tại. asyncio task (kể cả node của LangGraph) copy
+# context khi được tạo, nên giá trị set ở endpoint/worker đi theo đến GeminiService.
+request_priority: ContextVar[Priority] = ContextVar("request_priority", default=Priority.INTERACTIVE)
+request_tenant: ContextVar[str] = ContextVar("request_tenant", default="default")
+# Id để nối các dòng log của cùng một request/job (header X-Request-ID hoặc tự sinh)
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+# Phiên của người dùng (header X-Session-ID), dùng để nhóm history kết quả
+request_session: ContextVar[Optional[str]] = ContextVar("request_session", default=None)
+# Thời điểm (time.monotonic) request phải xong; None = không giới hạn
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# Token model đã dùng trong workflow hiện tại: call -> {calls, input_tokens, output_tokens}.
+# Workflow set một dict mới khi bắt đầu; các node (task con) cùng ghi vào dict đó.
+request_token_usage: ContextVar[Optional[Dict[str, Dict[str, int]]]] = ContextVar(
+    "request_token_usage", default=None
+)
+
+
+def remaining_time() -> Optional[float]:
+    """Số giây còn lại trước deadline của request hiện tại (None nếu không có deadline)"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def add_token_usage(call: str, input_tokens: int, output_tokens: int) -> None:
+    """Cộng token của một lời gọi model vào usage của workflow hiện tại (nếu có)"""
+    usage = request_token_usage.get()
+    if usage is None:
+        return
+    entry = usage.setdefault(call, {"calls": 0, "input_tokens": 0, "output_tokens": 0})
+    entry["calls"] += 1
+    entry["input_tokens"] += input_tokens
+    entry["output_tokens"] += output_tokens
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Any, Optional, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+from app.services.request_context import remaining_time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Lỗi tạm thời phía backend: thử lại có ý nghĩa
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+    google_exceptions.Unknown,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class ModelCallError(Exception):
+    """A model call failed after all attempts; status_code is the HTTP status to surface"""
+
+    status_code = 502
+
+
+class CircuitOpenError(ModelCallError):
+    """The circuit breaker is open, so the backend is considered down"""
+
+    status_code = 503
+
+
+class RequestDeadlineExceeded(ModelCallError):
+    """The request deadline expired before the model call could complete"""
+
+    status_code = 504
+
+
+class PartialStreamError(ModelCallError):
+    """A streamed response broke after some text was already forwarded, so it is not retried"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker ba trạng thái: closed -> open -> half_open
+
+    Sau `failure_threshold` lỗi backend liên tiếp, breaker mở và mọi lời gọi
+    fail ngay trong `reset_timeout` giây. Hết thời gian đó cho một lời gọi thử
+    (half_open); thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def check(self) -> None:
+        """Raise CircuitOpenError nếu không được phép gọi lúc này"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} circuit is open, backend considered unavailable")
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"{self.name} circuit is half-open, probe in progress")
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class LatencyTracker:
+    """Cửa sổ trượt latency các lời gọi thành công, dùng để tính p95 cho hedging"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class ResilientCaller:
+    """
+    Gọi model với retry (exponential backoff + full jitter), hedging và circuit breaker
+
+    `attempt` nhận timeout (giây) của lần thử và trả về kết quả. Mỗi lần thử bị
+    giới hạn bởi min(attempt_timeout, thời gian còn lại của request).
+    """
+
+    def __init__(self, name: str, breaker: CircuitBreaker, max_attempts: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 8.0,
+                 attempt_timeout: float = 60.0, hedge: bool = True,
+                 hedge_min_samples: int = 20, hedge_percentile: float = 95.0):
+        self.name = name
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_percentile = hedge_percentile
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def _timeout(self) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return self.attempt_timeout
+        if remaining <= 0:
+            raise RequestDeadlineExceeded(f"Request deadline exceeded before {self.name} call")
+        return min(self.attempt_timeout, remaining)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: tránh các request cùng retry một lúc
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(self, attempt: Callable[[float], Awaitable[T]], hedgeable: bool = True) -> T:
+        last_error: Optional[BaseException] = None
+        deadline_hit = False
+        for attempt_number in range(self.max_attempts):
+            self.breaker.check()
+            timeout = self._timeout()
+            started_at = time.monotonic()
+            try:
+                if hedgeable and self.hedge:
+                    result = await self._hedged(attempt, timeout)
+                else:
+                    result = await asyncio.wait_for(attempt(timeout), timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    # Lỗi phía client (prompt sai, key sai...) không phải do backend down
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                last_error = e
+                delay = self._backoff(attempt_number)
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    deadline_hit = True
+                    break
+                if attempt_number + 1 >= self.max_attempts:
+                    break
+                self.retries += 1
+                logger.warning("Model call failed, retrying", extra={
+                    "call": self.name, "attempt": attempt_number + 1,
+                    "error_type": type(e).__name__, "retry_in": round(delay, 3)
+                })
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self.latency.record(time.monotonic() - started_at)
+            return result
+
+        self.failures += 1
+        if deadline_hit:
+            raise RequestDeadlineExceeded(
+                f"Request deadline exceeded during {self.name} call: {type(last_error).__name__}"
+            ) from last_error
+        raise ModelCallError(
+            f"{self.name} failed after {self.max_attempts} attempts: {type(last_error).__name__}: {last_error}"
+        ) from last_error
+
+    async def _hedged(self, attempt: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        """
+        Gửi thêm một request trùng lặp nếu request đầu chậm hơn p95
+
+        Request nào xong (thành công) trước thì dùng, request còn lại bị huỷ.
+        """
+        hedge_after = None
+        if len(self.latency) >= self.hedge_min_samples:
+            hedge_after = self.latency.percentile(self.hedge_percentile)
+        if hedge_after is None or hedge_after >= timeout:
+            return await asyncio.wait_for(attempt(timeout), timeout)
+
+        started_at = time.monotonic()
+        primary = asyncio.create_task(asyncio.wait_for(attempt(timeout), timeout))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                self.hedges += 1
+                hedge_timeout = max(0.001, timeout - (time.monotonic() - started_at))
+                tasks.add(asyncio.create_task(asyncio.wait_for(attempt(hedge_timeout), hedge_timeout)))
+
+            last_error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "p95_latency": self.latency.percentile(95),
+            "circuit": self.breaker.stats(),
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Breaker dùng chung trong process cho mỗi backend"""
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(
+            name,
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT_SECONDS", "30")),
+        )
+    return _breakers[name]
+
+
+def create_resilient_caller(name: str, breaker: CircuitBreaker) -> ResilientCaller:
+    return ResilientCaller(
+        name,
+        breaker,
+        max_attempts=int(os.getenv("MODEL_MAX_ATTEMPTS", "3")),
+        base_delay=float(os.getenv("MODEL_RETRY_BASE_DELAY_SECONDS", "0.5")),
+        max_delay=float(os.getenv("MODEL_RETRY_MAX_DELAY_SECONDS", "8")),
+        attempt_timeout=float(os.getenv("MODEL_ATTEMPT_TIMEOUT_SECONDS", "60")),
+        hedge=os.getenv("MODEL_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes", "on"),
+        hedge_min_samples=int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "20")),
+    )
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Field tóm tắt của một lần chạy (trả về trong history, không kèm payload)
+SUMMARY_FIELDS = (
+    "result_id", "tenant", "session_id", "created_at", "task_description", "image_sha256",
+    "analysis_id", "chart_type", "word_count", "processing_time",
+)
+# Phần kết quả đầy đủ, lưu dạng JSON
+PAYLOAD_FIELDS = (
+    "chart_analysis", "ielts_writing", "node_timings", "token_usage", "chart_prediction", "essay_candidates",
+)
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at: float, result_id: str) -> str:
+    return f"{created_at!r}:{result_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Cursor phân trang -> (created_at, result_id); ValueError nếu sai format"""
+    created_at, _, result_id = cursor.partition(":")
+    if not result_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return float(created_at), result_id
+
+
+def build_record(result: Dict[str, Any], task_description: str, image_sha256: Optional[str],
+                 tenant: str, session_id: Optional[str]) -> Dict[str, Any]:
+    """Record lưu trữ từ result (format của process_request) của một lần chạy thành công"""
+    chart_analysis = result.get("chart_analysis") or {}
+    ielts_writing = result.get("ielts_writing") or {}
+    return {
+        "result_id": uuid.uuid4().hex,
+        "tenant": tenant,
+        "session_id": session_id,
+        "created_at": time.time(),
+        "task_description": task_description,
+        "image_sha256": image_sha256,
+        "analysis_id": result.get("analysis_id"),
+        "chart_type": chart_analysis.get("chart_type"),
+        "word_count": ielts_writing.get("word_count"),
+        "processing_time": result.get("processing_time"),
+        **{field: result.get(field) for field in PAYLOAD_FIELDS},
+    }
+
+
+class ResultStore(ABC):
+    """
+    Interface cho nơi lưu kết quả các lần chạy workflow
+
+    list() phân trang bằng keyset (created_at, result_id) giảm dần: mỗi trang là
+    một lần đọc theo index, không dùng OFFSET nên trang sau không chậm hơn trang đầu.
+    """
+
+    # True nếu các method làm I/O blocking và nên chạy trong worker thread
+    blocking = False
+
+    @abstractmethod
+    def save(self, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, result_id: str, tenant: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list(self, tenant: str, session_id: Optional[str] = None, image_sha256: Optional[str] = None,
+             limit: int = 20, before: Optional[Tuple[float, str]] = None) -> List[Dict[str, Any]]:
+        """Tóm tắt (SUMMARY_FIELDS) mới nhất trước, chỉ các record trước cursor `before`"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge(self, created_before: float) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class InMemoryResultStore(ResultStore):
+    """In-process result store, giữ tối đa max_entries record mới nhất; mất khi process thoát"""
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def save(self, record: Dict[str, Any]) -> None:
+        self._records[record["result_id"]] = json.loads(json.dumps(record))
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+
+    def get(self, result_id: str, tenant: str) -> Optional[Dict[str, Any]]:
+        record = self._records.get(result_id)
+        if record is None or record["tenant"] != tenant:
+            return None
+        return json.loads(json.dumps(record))
+
+    def list(self, tenant: str, session_id: Optional[str] = None, image_sha256: Optional[str] = None,
+             limit: int = 20, before: Optional[Tuple[float, str]] = None) -> List[Dict[str, Any]]:
+        items = []
+        for record in sorted(self._records.values(), key=lambda r: (r["created_at"], r["result_id"]), reverse=True):
+            if record["tenant"] != tenant:
+                continue
+            if session_id is not None and record["session_id"] != session_id:
+                continue
+            if image_sha256 is not None and record["image_sha256"] != image_sha256:
+                continue
+            if before is not None and (record["created_at"], record["result_id"]) >= before:
+                continue
+            items.append({field: record[field] for field in SUMMARY_FIELDS})
+            if len(items) >= limit:
+                break
+        return items
+
+    def purge(self, created_before: float) -> int:
+        expired = [result_id for result_id, record in self._records.items() if record["created_at"] < created_before]
+        for result_id in expired:
+            self._records.pop(result_id, None)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "entries": len(self._records), "max_entries": self.max_entries}
+
+
+class SQLiteResultStore(ResultStore):
+    """
+    Result store bền vững trên SQLite (WAL: đọc history không chặn ghi)
+
+    Index theo (tenant, session_id, created_at), (tenant, created_at) và
+    (image_sha256, created_at) cho các truy vấn history, cùng thứ tự sắp xếp.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = "results.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                result_id TEXT PRIMARY KEY,
+                tenant TEXT NOT NULL,
+                session_id TEXT,
+                created_at REAL NOT NULL,
+                task_description TEXT NOT NULL,
+                image_sha256 TEXT,
+                analysis_id TEXT,
+                chart_type TEXT,
+                word_count INTEGER,
+                processing_time REAL,
+                payload TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_session ON results (tenant, session_id, created_at, result_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_tenant_time ON results (tenant, created_at, result_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_image ON results (image_sha256, created_at, result_id)"
+        )
+
+    def save(self, record: Dict[str, Any]) -> None:
+        payload = json.dumps({field: record.get(field) for field in PAYLOAD_FIELDS}, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO results ({', '.join(SUMMARY_FIELDS)}, payload) "
+                f"VALUES ({', '.join('?' for _ in SUMMARY_FIELDS)}, ?)",
+                (*(record.get(field) for field in SUMMARY_FIELDS), payload),
+            )
+
+    def get(self, result_id: str, tenant: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(SUMMARY_FIELDS)}, payload FROM results WHERE result_id = ? AND tenant = ?",
+                (result_id, tenant),
+            ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(SUMMARY_FIELDS, row))
+        record.update(json.loads(row[-1]))
+        return record
+
+    def list(self, tenant: str, session_id: Optional[str] = None, image_sha256: Optional[str] = None,
+             limit: int = 20, before: Optional[Tuple[float, str]] = None) -> List[Dict[str, Any]]:
+        conditions = ["tenant = ?"]
+        params: List[Any] = [tenant]
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        if image_sha256 is not None:
+            conditions.append("image_sha256 = ?")
+            params.append(image_sha256)
+        if before is not None:
+            conditions.append("(created_at, result_id) < (?, ?)")
+            params.extend(before)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(SUMMARY_FIELDS)} FROM results WHERE {' AND '.join(conditions)} "
+                "ORDER BY created_at DESC, result_id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [dict(zip(SUMMARY_FIELDS, row)) for row in rows]
+
+    def purge(self, created_before: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM results WHERE created_at < ?", (created_before,))
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": count}
+
+
+class ResultHistory:
+    """
+    Ghi và đọc kết quả các lần chạy qua một ResultStore (blocking thì chạy trong worker thread)
+
+    Record quá retention_seconds bị xoá dần: mỗi purge_every lần ghi thì purge một lần.
+    """
+
+    def __init__(self, store: ResultStore, retention_seconds: Optional[float] = None, purge_every: int = 100):
+        self.store = store
+        self.retention_seconds = retention_seconds
+        self.purge_every = purge_every
+        self._saves = 0
+
+    async def _call(self, func, *args, **kwargs):
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    async def record(self, result: Dict[str, Any], task_description: str, image_sha256: Optional[str],
+                     tenant: str, session_id: Optional[str]) -> str:
+        record = build_record(result, task_description, image_sha256, tenant, session_id)
+        await self._call(self.store.save, record)
+        self._saves += 1
+        if self.retention_seconds and self._saves % self.purge_every == 0:
+            await self._call(self.store.purge, time.time() - self.retention_seconds)
+        return record["result_id"]
+
+    async def get(self, result_id: str, tenant: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self.store.get, result_id, tenant)
+
+    async def page(self, tenant: str, session_id: Optional[str] = None, image_sha256: Optional[str] = None,
+                   limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Một trang history: {"items": [...], "next_cursor": ...}; next_cursor None ở trang cuối
+
+        ValueError nếu cursor không hợp lệ.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        before = decode_cursor(cursor) if cursor else None
+        # Lấy dư một record để biết còn trang sau hay không
+        items = await self._call(self.store.list, tenant, session_id, image_sha256, limit + 1, before)
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["result_id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
+
+
+def create_result_history() -> Optional[ResultHistory]:
+    """
+    Tạo result history từ biến môi trường
+
+    RESULT_STORE_BACKEND: sqlite (mặc định) | memory | none
+    """
+    backend_name = os.getenv("RESULT_STORE_BACKEND", "sqlite").lower()
+    retention = float(os.getenv("RESULT_STORE_RETENTION_SECONDS", str(30 * 86400))) or None
+
+    if backend_name == "none":
+        return None
+    if backend_name == "sqlite":
+        store: ResultStore = SQLiteResultStore(path=os.getenv("RESULT_STORE_PATH", "results.sqlite3"))
+    elif backend_name == "memory":
+        store = InMemoryResultStore(max_entries=int(os.getenv("RESULT_STORE_MAX_ENTRIES", "2000")))
+    else:
+        raise ValueError(f"Unknown RESULT_STORE_BACKEND: {backend_name}")
+    return ResultHistory(store, retention_seconds=retention)
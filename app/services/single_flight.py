@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.services.metrics import SINGLE_FLIGHT_REQUESTS
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task, deadline: Optional[float] = None):
+        self.task = task
+        # Deadline (time.monotonic) của leader; task chạy trong context của leader
+        self.deadline = deadline
+        self.waiters = 0
+
+    def covers(self, deadline: Optional[float]) -> bool:
+        """Task có được chạy ít nhất đến deadline của người gọi không (None = không giới hạn)"""
+        if self.deadline is None:
+            return True
+        return deadline is not None and self.deadline >= deadline
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời có cùng key thành một lần chạy
+
+    Lời gọi đầu tiên (leader) tạo task chạy func(); các lời gọi đến trong lúc
+    task chưa xong (follower) chờ chính task đó và nhận cùng kết quả/exception.
+    Task chạy độc lập với request đã tạo ra nó: một client ngắt kết nối không
+    làm hỏng kết quả của các client khác; task chỉ bị huỷ khi không còn ai chờ.
+    Key được xoá ngay khi task xong, nên đây là dedup đồng thời, không phải cache.
+
+    Task chạy với deadline của leader, nên follower chỉ join khi deadline đó
+    không sớm hơn deadline của mình; nếu không nó chạy riêng và thay leader cho key.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]],
+                 deadline: Optional[float] = None) -> Tuple[Any, bool]:
+        """Trả về (kết quả, shared); shared=True nếu kết quả đến từ lần chạy của lời gọi khác"""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.covers(deadline):
+            flight = None
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.create_task(func()), deadline)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        SINGLE_FLIGHT_REQUESTS.inc(flight=self.name, role="follower" if shared else "leader")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def in_flight(self) -> int:
+        return len(self._flights)
@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from app.services.metrics import LOG_RECORDS_DROPPED
+from app.services.request_context import request_id, request_session, request_tenant
+
+# Logger gốc của ứng dụng: mọi module dùng logging.getLogger(__name__) (app.*)
+APP_LOGGER = "app"
+
+# Thuộc tính có sẵn của LogRecord; các thuộc tính khác (truyền qua extra=) là field có cấu trúc
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class ContextFilter(logging.Filter):
+    """
+    Gắn request_id, tenant, session của context hiện tại vào record
+
+    Chạy trong thread/task gọi log (trước khi record vào queue), vì thread ghi
+    log không có context của request.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        record.tenant = request_tenant.get()
+        record.session_id = request_session.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Chỉ giữ một phần record DEBUG (dòng tiến độ từng node), WARNING trở lên luôn giữ
+
+    Lấy mẫu theo request_id: request được chọn giữ đủ mọi dòng debug của nó, nên
+    vẫn lần theo được từng node; record không thuộc request nào thì lấy mẫu ngẫu nhiên.
+    """
+
+    def __init__(self, debug_rate: float = 1.0):
+        super().__init__()
+        self.debug_rate = debug_rate
+        self._threshold = int(debug_rate * 0xFFFFFFFF)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.debug_rate >= 1.0:
+            return True
+        rid = getattr(record, "request_id", None)
+        if rid is None:
+            return random.random() < self.debug_rate
+        return zlib.crc32(rid.encode("utf-8")) <= self._threshold
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi record một dòng JSON: thời gian, level, logger, message, context và các field extra="""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_type"] = record.exc_info[0].__name__
+            entry["traceback"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Dạng đọc bằng mắt khi dev: thời gian, level, request_id, message, các field extra="""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RESERVED_ATTRS and key not in ("request_id", "tenant", "session_id") and value is not None
+        )
+        line = (
+            f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} "
+            f"[{getattr(record, 'request_id', None) or '-'}] {record.name}: {record.getMessage()}"
+        )
+        if fields:
+            line += f" {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Đưa record vào queue có giới hạn, không bao giờ chặn caller
+
+    Queue đầy (stdout chậm) thì bỏ record và đếm vào ielts_log_records_dropped_total.
+    Traceback không được format ở đây: exc_info đi theo record và được format
+    trong thread của QueueListener, ngoài event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        # Merge args ngay (object trong args có thể đổi trước khi listener format)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging() -> None:
+    """
+    Cấu hình logger "app" từ biến môi trường (gọi nhiều lần chỉ có tác dụng lần đầu)
+
+    LOG_LEVEL (INFO), LOG_FORMAT json (mặc định) | text, LOG_DEBUG_SAMPLE_RATE
+    (tỉ lệ request giữ dòng DEBUG), LOG_QUEUE_SIZE (số record chờ ghi tối đa).
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "text" else JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))))
+
+    logger = logging.getLogger(APP_LOGGER)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.handlers = [handler]
+    # Không đi tiếp lên root (tránh in trùng qua handler của uvicorn/thư viện)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Ghi nốt các record còn trong queue rồi dừng thread ghi log"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
@@ -0,0 +1,344 @@
+import json
+import re
+import typing
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from app.models.schemas import ChartAnalysis, ChartType, IELTSWritingResponse
+from app.services.essay_scorer import count_words
+from app.services.prompts import PROMPTS
+
+# Ký tự có ý nghĩa cấu trúc khi quét JSON; các ký tự khác bỏ qua theo khối bằng regex
+_STRUCTURAL_RE = re.compile(r"[\"'\\{}\[\]]")
+_BARE_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+_LITERALS = {"true": "true", "false": "false", "null": "null",
+             "True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class StreamingJSONExtractor:
+    """
+    Tìm object JSON top-level đầu tiên trong text model trả về, theo từng chunk
+
+    Bỏ qua prose/code fence trước dấu `{` đầu tiên và mọi thứ sau dấu `}` đóng
+    object đó. Chỉ quét phần text mới của mỗi chunk, nên khi stream kết thúc
+    object đã được tách sẵn, không phải quét lại toàn bộ response.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._stack: List[str] = []
+        self._quote: Optional[str] = None
+        self._escape = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """Thêm một đoạn text; trả về True khi object top-level đã đóng"""
+        if self.complete or not chunk:
+            return self.complete
+        if not self.started:
+            start = chunk.find("{")
+            if start == -1:
+                return False
+            self.started = True
+            chunk = chunk[start:]
+
+        position = 0
+        if self._escape:
+            self._escape = False
+            position = 1
+        for match in _STRUCTURAL_RE.finditer(chunk, position):
+            index = match.start()
+            if index < position:
+                # Ký tự ngay sau dấu escape đã được bỏ qua
+                continue
+            char = match.group()
+            if self._quote is not None:
+                if char == "\\":
+                    if index + 1 < len(chunk):
+                        position = index + 2
+                    else:
+                        self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                continue
+            if char in "\"'":
+                self._quote = char
+            elif char in "{[":
+                self._stack.append(_CLOSERS[char])
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self._parts.append(chunk[:index + 1])
+                    self.complete = True
+                    return True
+        self._parts.append(chunk)
+        return False
+
+    @property
+    def text(self) -> str:
+        """Text của object (có thể chưa đóng nếu response bị cắt)"""
+        return "".join(self._parts)
+
+
+def _strip_trailing_comma(out: List[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _last_significant(out: List[str]) -> str:
+    for piece in reversed(out):
+        if not piece.isspace():
+            return piece
+    return ""
+
+
+def repair_json(text: str) -> str:
+    """
+    Sửa các lỗi JSON thường gặp từ model
+
+    - prose/code fence trước `{`/`[` đầu tiên và sau giá trị top-level bị bỏ
+    - chuỗi dùng nháy đơn, xuống dòng thật bên trong chuỗi
+    - dấu phẩy thừa trước } hoặc ]
+    - True/False/None kiểu Python, key hoặc giá trị không có nháy, comment //
+    - chuỗi/mảng/object chưa đóng khi response bị cắt (key dang dở bị bỏ)
+
+    Text không có `{`/`[` nào được trả về nguyên vẹn (json.loads sẽ báo lỗi).
+    """
+    starts = [position for position in (text.find("{"), text.find("[")) if position != -1]
+    if not starts:
+        return text
+    out: List[str] = []
+    stack: List[str] = []
+    quote: Optional[str] = None
+    # Vị trí trong out của key đang mở (chưa gặp dấu ':'), để bỏ nếu response bị cắt
+    pending_key: Optional[int] = None
+    index, length = min(starts), len(text)
+
+    while index < length:
+        char = text[index]
+        if quote is not None:
+            if char == "\\" and index + 1 < length:
+                following = text[index + 1]
+                out.append("'" if following == "'" else char + following)
+                index += 2
+                continue
+            if char == quote:
+                out.append('"')
+                quote = None
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\r":
+                out.append("\\r")
+            elif char == "\t":
+                out.append("\\t")
+            else:
+                out.append(char)
+            index += 1
+            continue
+
+        if char in "\"'":
+            if stack and stack[-1] == "}" and _last_significant(out) in ("{", ","):
+                pending_key = len(out)
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            stack.append(_CLOSERS[char])
+            out.append(char)
+        elif char in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                out.append(stack.pop())
+            pending_key = None
+            if not stack:
+                break
+        elif char == ":":
+            pending_key = None
+            out.append(char)
+        elif char == "`":
+            # Code fence đóng ngay sau object bị cắt
+            pass
+        elif char == "/" and text.startswith("//", index):
+            newline = text.find("\n", index)
+            index = length if newline == -1 else newline
+            continue
+        elif char.isalpha() or char == "_":
+            word = _BARE_WORD_RE.match(text, index).group()
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+            else:
+                if stack and stack[-1] == "}" and _last_significant(out) in ("{", ","):
+                    pending_key = len(out)
+                out.append(json.dumps(word))
+            index += len(word)
+            continue
+        else:
+            out.append(char)
+        index += 1
+
+    if quote is not None:
+        # Chuỗi bị cắt: code fence đóng response không thuộc giá trị của chuỗi
+        while out and out[-1] in ("`", " ", "\\n", "\\r", "\\t"):
+            out.pop()
+        out.append('"')
+    if stack:
+        # Response bị cắt: bỏ key chưa có giá trị, giá trị rỗng sau ':' thành null
+        if pending_key is not None:
+            del out[pending_key:]
+        _strip_trailing_comma(out)
+        if _last_significant(out) == ":":
+            out.append("null")
+        while stack:
+            _strip_trailing_comma(out)
+            out.append(stack.pop())
+    return "".join(out)
+
+
+def _describe(annotation: Any) -> str:
+    """Mô tả ngắn kiểu dữ liệu của field cho prompt re-ask"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _describe(args[0]) if args else "null"
+    if origin in (list, List):
+        (item,) = typing.get_args(annotation) or (str,)
+        return f"array of {_describe(item)}s"
+    if origin in (dict, Dict) or annotation is dict:
+        return "object"
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return "one of " + " | ".join(member.value for member in annotation)
+    if annotation is int:
+        return "integer"
+    return "string"
+
+
+def _as_text(item: Any) -> str:
+    if isinstance(item, dict):
+        return ", ".join(f"{key}: {value}" for key, value in item.items())
+    return str(item)
+
+
+def _normalize_chart(data: Dict[str, Any]) -> Dict[str, Any]:
+    for field in ("chart_components", "key_data_points", "trends", "comparisons", "insights"):
+        value = data.get(field)
+        if isinstance(value, str):
+            data[field] = [value]
+        elif isinstance(value, list):
+            # Model hay trả key_data_points dạng object dù prompt yêu cầu string
+            data[field] = [_as_text(item) for item in value if item not in (None, "")]
+    chart_type = data.get("chart_type")
+    if isinstance(chart_type, str):
+        chart_type = chart_type.strip().lower().replace(" ", "_").replace("-", "_")
+        valid_types = {member.value for member in ChartType}
+        if chart_type not in valid_types and f"{chart_type}_chart" in valid_types:
+            chart_type = f"{chart_type}_chart"
+        data["chart_type"] = chart_type if chart_type in valid_types else ChartType.UNKNOWN.value
+    return data
+
+
+def _normalize_writing(data: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(data.get("body_paragraphs"), str):
+        data["body_paragraphs"] = [data["body_paragraphs"]]
+    # full_essay và word_count suy ra được từ các đoạn, không cần hỏi lại model
+    if not data.get("full_essay") and data.get("introduction") and data.get("body_paragraphs"):
+        parts = [data["introduction"], data.get("overview") or "", *data["body_paragraphs"]]
+        data["full_essay"] = "\n\n".join(part for part in parts if part)
+    if "word_count" in data or data.get("full_essay"):
+        try:
+            data["word_count"] = int(data["word_count"])
+        except (KeyError, TypeError, ValueError):
+            data["word_count"] = count_words(data.get("full_essay") or "")
+    return data
+
+
+_NORMALIZERS = {ChartAnalysis: _normalize_chart, IELTSWritingResponse: _normalize_writing}
+
+
+def validate_structured(data: Dict[str, Any], schema: Type[BaseModel]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Chuẩn hoá rồi validate theo schema pydantic
+
+    Trả về (data, danh sách field bắt buộc bị thiếu/sai). Field sai kiểu bị bỏ
+    khỏi data; list bắt buộc mà rỗng cũng tính là thiếu.
+    """
+    data = _NORMALIZERS.get(schema, lambda value: value)(dict(data))
+    problems = set()
+    try:
+        schema.model_validate(data)
+    except ValidationError as e:
+        for error in e.errors():
+            if error["loc"]:
+                problems.add(str(error["loc"][0]))
+    for name, field in schema.model_fields.items():
+        if field.is_required() and isinstance(data.get(name), list) and not data[name]:
+            problems.add(name)
+    for name in problems:
+        data.pop(name, None)
+    missing = [name for name in schema.model_fields if name in problems]
+    return data, missing
+
+
+class StructuredOutput:
+    """
+    Parse response của model thành dict theo schema, có thể nạp dần từng chunk stream
+
+        parser = StructuredOutput(ChartAnalysis)
+        parser.feed(chunk)         # mỗi chunk stream, hoặc cả response một lần
+        data, missing = parser.result()
+    """
+
+    def __init__(self, schema: Type[BaseModel]):
+        self.schema = schema
+        self.extractor = StreamingJSONExtractor()
+        self.raw_text = ""
+        self.repaired = False
+        self._chunks: List[str] = []
+
+    def feed(self, chunk: str) -> None:
+        if chunk:
+            self._chunks.append(chunk)
+            self.extractor.feed(chunk)
+
+    def parse(self) -> Optional[Dict[str, Any]]:
+        """Object JSON trong response (đã sửa nếu cần), None nếu không có"""
+        self.raw_text = "".join(self._chunks)
+        if not self.extractor.started:
+            return None
+        candidate = self.extractor.text
+        if self.extractor.complete:
+            try:
+                parsed = json.loads(candidate)
+                return parsed if isinstance(parsed, dict) else None
+            except json.JSONDecodeError:
+                pass
+        try:
+            parsed = json.loads(repair_json(candidate))
+        except json.JSONDecodeError:
+            return None
+        self.repaired = True
+        return parsed if isinstance(parsed, dict) else None
+
+    def result(self) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """(data, field bắt buộc còn thiếu); data None nếu không parse được gì"""
+        parsed = self.parse()
+        if parsed is None:
+            return None, [name for name, field in self.schema.model_fields.items() if field.is_required()]
+        return validate_structured(parsed, self.schema)
+
+
+def build_reask_prompt(schema: Type[BaseModel], missing: List[str], data: Optional[Dict[str, Any]]) -> str:
+    """
+    Prompt hỏi lại chỉ các field còn thiếu; kèm JSON đã có để model giữ nhất quán
+    """
+    fields = "\n".join(
+        f'        - "{name}": {_describe(schema.model_fields[name].annotation)}' for name in missing
+    )
+    return PROMPTS.get("reask").render(fields=fields, current=json.dumps(data or {}, ensure_ascii=False))
@@ -0,0 +1,101 @@
+import json
+import os
+from typing import Dict, Optional
+
+from starlette.exceptions import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Giới hạn body mặc định: một ảnh 20MB cộng phần form/multipart
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Giới hạn kích thước body của request, áp dụng trước khi FastAPI parse form/JSON
+
+    - Content-Length vượt giới hạn: trả 413 ngay, không đọc byte nào của body
+    - Không có Content-Length (chunked) hoặc khai báo sai: đếm byte khi body được
+      đọc dần và dừng với 413 ngay khi vượt, nên không bao giờ buffer quá giới hạn
+
+    Multipart upload được Starlette ghi vào SpooledTemporaryFile (quá 1MB thì ra
+    đĩa), nên bộ nhớ của một upload không tăng theo kích thước file.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int = MAX_UPLOAD_BYTES,
+                 route_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        # Giới hạn riêng theo path (vd. /analyze-batch nhận nhiều ảnh)
+        self.route_limits = route_limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.route_limits.get(scope["path"], self.max_bytes)
+        declared = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = None
+                break
+        if declared is not None and declared > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI để HTTPException đi qua khi parse body, nên client nhận 413
+                    raise HTTPException(status_code=413, detail=_too_large_detail(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send: Send, limit: int) -> None:
+        body = json.dumps({"detail": _too_large_detail(limit)}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _too_large_detail(limit: int) -> str:
+    # Giới hạn dưới 1 MB (vd. trong test) vẫn phải hiện đúng, không phải "max 0 MB"
+    if limit >= 1024 * 1024:
+        size = f"{round(limit / (1024 * 1024), 2):g} MB"
+    elif limit >= 1024:
+        size = f"{round(limit / 1024, 2):g} KB"
+    else:
+        size = f"{limit} bytes"
+    return f"Request body too large (max {size})"
+
+
+def create_request_size_limits() -> Dict[str, object]:
+    """
+    Tham số cho RequestSizeLimitMiddleware từ biến môi trường
+
+    MAX_UPLOAD_BYTES: giới hạn mặc định cho mọi request có body
+    BATCH_MAX_UPLOAD_BYTES: giới hạn cho /analyze-batch
+    """
+    max_bytes = int(os.getenv("MAX_UPLOAD_BYTES", str(MAX_UPLOAD_BYTES)))
+    return {
+        "max_bytes": max_bytes,
+        "route_limits": {
+            "/analyze-batch": int(os.getenv("BATCH_MAX_UPLOAD_BYTES", str(10 * max_bytes))),
+        },
+    }
@@ -0,0 +1,252 @@
+"""
+Offline benchmark cho request path, dùng LocalProvider thay Gemini (không cần mạng/API key)
+
+Chạy từ thư mục gốc của repo:
+
+    python -m benchmarks.run_benchmark --concurrency 1,4,16,64 --requests 200
+    python -m benchmarks.run_benchmark --target workflow --chart-latency fixed:0.05 --json
+
+Mỗi mức concurrency chạy `--requests` request qua từng target và báo throughput,
+p50/p95/p99 latency, event-loop lag và RSS.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+TARGETS = ("workflow", "analyze", "analyze-json")
+
+
+def _configure_environment(args: argparse.Namespace) -> None:
+    # Phải set trước khi import app.main (module tạo workflow lúc import)
+    if not args.respect_quota:
+        os.environ["GEMINI_RPM"] = "0"
+        os.environ["GEMINI_TPM"] = "0"
+    if not args.cache:
+        os.environ["CHART_CACHE_BACKEND"] = "none"
+
+
+def make_chart_png(width: int = 1200, height: int = 800) -> bytes:
+    """Bar chart tổng hợp: đủ lớn để bước chuẩn hoá ảnh có việc để làm"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.line([(80, height - 80), (width - 40, height - 80)], fill="black", width=3)
+    draw.line([(80, 40), (80, height - 80)], fill="black", width=3)
+    colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728"]
+    for index, value in enumerate([0.48, 0.30, 0.12, 0.26, 0.52, 0.31]):
+        left = 120 + index * 170
+        top = int((height - 80) - value * (height - 160))
+        draw.rectangle([left, top, left + 120, height - 82], fill=colors[index % len(colors)])
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def current_rss_mb() -> float:
+    """RSS hiện tại (Linux /proc), fallback về peak RSS của process"""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux báo KB, macOS báo bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class LoopLagMonitor:
+    """Đo độ trễ event loop: sleep `interval` rồi xem thực tế dậy muộn bao nhiêu"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started_at - self.interval))
+
+    def start(self) -> None:
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+
+async def run_level(name: str, call: Callable[[int], Awaitable[bool]],
+                    concurrency: int, total_requests: int) -> Dict[str, Any]:
+    """Chạy total_requests lời gọi với tối đa `concurrency` lời gọi đồng thời"""
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+    monitor = LoopLagMonitor()
+    rss_before = current_rss_mb()
+
+    async def worker() -> None:
+        nonlocal next_index, errors
+        while next_index < total_requests:
+            index = next_index
+            next_index += 1
+            started_at = time.perf_counter()
+            try:
+                ok = await call(index)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started_at)
+            if not ok:
+                errors += 1
+
+    monitor.start()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    await monitor.stop()
+
+    return {
+        "target": name,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": total_requests / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "loop_lag_p99_ms": percentile(monitor.samples, 99) * 1000,
+        "loop_lag_max_ms": max(monitor.samples, default=0.0) * 1000,
+        "rss_mb": current_rss_mb(),
+        "rss_delta_mb": current_rss_mb() - rss_before,
+    }
+
+
+def build_targets(app, workflow, image_bytes: bytes) -> Dict[str, Callable[[int], Awaitable[bool]]]:
+    import httpx
+    from app.services.image_processing import prepare_image
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+    image_base64 = base64.b64encode(image_bytes).decode("ascii")
+
+    async def call_workflow(index: int) -> bool:
+        prepared = await asyncio.to_thread(prepare_image, image_bytes)
+        result = await workflow.process_request(
+            task_description=f"Benchmark task {index}", image=prepared
+        )
+        return bool(result.get("success"))
+
+    async def call_analyze(index: int) -> bool:
+        response = await client.post(
+            "/analyze",
+            data={"task_description": f"Benchmark task {index}"},
+            files={"chart_image": ("chart.png", image_bytes, "image/png")},
+        )
+        return response.status_code == 200
+
+    async def call_analyze_json(index: int) -> bool:
+        response = await client.post(
+            "/analyze-json",
+            json={"task_description": f"Benchmark task {index}", "image_base64": image_base64},
+        )
+        return response.status_code == 200
+
+    return {"workflow": call_workflow, "analyze": call_analyze, "analyze-json": call_analyze_json}
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    columns = [
+        ("target", "{:<13}"), ("concurrency", "{:>5}"), ("requests", "{:>6}"), ("errors", "{:>6}"),
+        ("throughput_rps", "{:>8.1f}"), ("p50_ms", "{:>8.1f}"), ("p95_ms", "{:>8.1f}"),
+        ("p99_ms", "{:>8.1f}"), ("loop_lag_p99_ms", "{:>8.1f}"), ("loop_lag_max_ms", "{:>8.1f}"),
+        ("rss_mb", "{:>7.1f}"),
+    ]
+    headers = ["target", "conc", "reqs", "errs", "req/s", "p50 ms", "p95 ms", "p99 ms", "lag p99", "lag max", "RSS MB"]
+    widths = [13, 5, 6, 6, 8, 8, 8, 8, 8, 8, 7]
+    print(" ".join(header.rjust(width) if i else header.ljust(width)
+                   for i, (header, width) in enumerate(zip(headers, widths))))
+    for row in results:
+        print(" ".join(fmt.format(row[key]) for key, fmt in columns))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark for the IELTS analysis request path")
+    parser.add_argument("--target", choices=TARGETS + ("all",), default="all")
+    parser.add_argument("--concurrency", default="1,4,16,64",
+                        help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--chart-latency", default="lognormal:0.8:0.4",
+                        help="simulated vision call latency: fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--essay-latency", default="lognormal:1.5:0.4",
+                        help="simulated essay call latency (same format)")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="probability that a model call raises a retryable error")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--cache", action="store_true", help="keep the chart analysis cache enabled")
+    parser.add_argument("--respect-quota", action="store_true",
+                        help="keep GEMINI_RPM/GEMINI_TPM limits (disabled by default)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep workflow log output")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    args = parse_args(argv)
+    _configure_environment(args)
+
+    from app.services.local_provider import LatencyProfile, LocalProvider
+    from app.services.model_provider import set_model_provider
+
+    set_model_provider(LocalProvider(
+        chart_latency=LatencyProfile.parse(args.chart_latency),
+        essay_latency=LatencyProfile.parse(args.essay_latency),
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    ))
+    import app.main as server
+
+    targets = build_targets(server.app, server.workflow, make_chart_png())
+    selected = TARGETS if args.target == "all" else (args.target,)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    results = []
+    log_sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with log_sink:
+        for name in selected:
+            for concurrency in levels:
+                results.append(await run_level(name, targets[name], concurrency, args.requests))
+
+    if args.json:
+        print(json.dumps({"results": results, "peak_rss_mb": peak_rss_mb()}, indent=2))
+    else:
+        print_table(results)
+        print(f"peak RSS: {peak_rss_mb():.1f} MB")
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -95,6 +95,21 @@ export const ieltsAPI = {
     }
   },
 
+  // Write a new essay from a stored analysis (skips the vision step)
+  regenerateEssay: async (analysisId, targetBand = null) => {
+    try {
+      const payload = targetBand === null ? {} : { target_band: targetBand };
+      const response = await api.post(
+        `/analyses/${analysisId}/regenerate`,
+        payload
+      );
+      return response.data;
+    } catch (error) {
+      const errorMessage = error.response?.data?.detail || error.message;
+      throw new Error(`Regeneration failed: ${errorMessage}`);
+    }
+  },
+
   // Get workflow information
   getWorkflowInfo: async () => {
     try {
@@ -159,4 +174,53 @@ export const analyzeChart = async (formData) => {
   }
 };
 
+// Streaming analysis via Server-Sent Events (/analyze-stream)
+// onEvent receives { event, data } for "node", "token" and "result" events
+export const analyzeChartStream = async (formData, onEvent) => {
+  const response = await fetch(`${API_BASE_URL}/analyze-stream`, {
+    method: "POST",
+    body: formData,
+  });
+
+  if (!response.ok) {
+    const errorBody = await response.json().catch(() => ({}));
+    throw new Error(`Analysis failed: ${errorBody.detail || response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // SSE events are separated by a blank line
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      let eventType = "message";
+      let data = "";
+      rawEvent.split("\n").forEach((line) => {
+        if (line.startsWith("event: ")) eventType = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      });
+
+      const parsed = data ? JSON.parse(data) : {};
+      if (eventType === "result") result = parsed;
+      if (onEvent) onEvent({ event: eventType, data: parsed });
+    }
+  }
+
+  if (!result || !result.success) {
+    throw new Error(`Analysis failed: ${result?.error || "stream ended early"}`);
+  }
+  return result;
+};
+
 export default api;
@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Chạy app hoàn toàn local: LocalProvider thay Gemini, mọi store trong memory
+os.environ.setdefault("MODEL_PROVIDER", "local")
+os.environ.setdefault("CHART_CACHE_BACKEND", "memory")
+os.environ.setdefault("ANALYSIS_STORE_BACKEND", "memory")
+os.environ.setdefault("RESULT_STORE_BACKEND", "memory")
+os.environ.setdefault("JOB_STORE_BACKEND", "memory")
+os.environ.setdefault("GEMINI_QUOTA_BACKEND", "memory")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def make_chart_png(width: int = 800, height: int = 600) -> bytes:
+    """Bar chart đơn giản: hai cột màu chung đáy trên nền trắng"""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([100, 100, 200, 500], fill="blue")
+    draw.rectangle([300, 300, 400, 500], fill="red")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def chart_png() -> bytes:
+    return make_chart_png()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import app.main
+
+    # Context manager: chạy startup/shutdown (job queue, warmup provider)
+    with TestClient(app.main.app) as test_client:
+        yield test_client
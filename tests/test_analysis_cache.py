@@ -0,0 +1,19 @@
+import pytest
+
+from app.services.analysis_cache import CacheBackend, MemoryCacheBackend
+
+
+def test_cache_backend_is_abstract():
+    class PartialBackend(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialBackend()
+
+
+def test_memory_backend_returns_fresh_copies():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set("k", {"items": [1]})
+    backend.get("k")["items"].append(2)
+    assert backend.get("k") == {"items": [1]}
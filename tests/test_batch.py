@@ -0,0 +1,81 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from app.services.batch_runner import BatchInputError, items_from_archive
+
+
+def _zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("manifest", [
+    ["chart1.png"],
+    [{"image": "chart1.png"}],
+    "chart1.png",
+    {"chart1.png": ["not", "a", "string"]},
+])
+def test_malformed_manifest_is_rejected(chart_png, manifest):
+    archive = _zip({"chart1.png": chart_png, "tasks.json": json.dumps(manifest)})
+    with pytest.raises(BatchInputError):
+        items_from_archive(archive)
+
+
+def test_manifest_that_is_not_json_is_rejected(chart_png):
+    with pytest.raises(BatchInputError):
+        items_from_archive(_zip({"chart1.png": chart_png, "tasks.json": "{not json"}))
+
+
+def test_malformed_manifest_returns_400(client, chart_png):
+    archive = _zip({"chart1.png": chart_png, "tasks.json": json.dumps([1, 2])})
+    response = client.post("/analyze-batch", files={"archive": ("batch.zip", archive, "application/zip")})
+    assert response.status_code == 400
+
+
+def test_non_image_item_fails_without_failing_batch(client, chart_png):
+    archive = _zip({
+        "chart1.png": chart_png,
+        "notes.png": b"definitely not an image",
+        "tasks.json": json.dumps([
+            {"image": "chart1.png", "task_description": "The chart shows water consumption"},
+            {"image": "notes.png", "task_description": "The chart shows water consumption"},
+        ]),
+    })
+    response = client.post("/analyze-batch", files={"archive": ("batch.zip", archive, "application/zip")})
+    assert response.status_code == 200
+    ok, bad = response.json()["data"]["results"]
+    assert ok["success"]
+    assert not bad["success"]
+    assert "Unsupported image format" in bad["error"]
+
+
+def _multipart(chart_png, count=2):
+    return (
+        [("chart_images", (f"chart{i}.png", chart_png, "image/png")) for i in range(count)],
+        {"task_descriptions": ["The chart shows water consumption"] * count},
+    )
+
+
+def test_multipart_batch_runs_each_upload(client, chart_png):
+    files, data = _multipart(chart_png)
+    response = client.post("/analyze-batch", files=files, data=data)
+    assert response.status_code == 200
+    results = response.json()["data"]["results"]
+    assert [result["success"] for result in results] == [True, True]
+
+
+def test_multipart_item_over_limit_is_rejected(client, chart_png, monkeypatch):
+    import app.services.batch_runner as batch_runner
+
+    monkeypatch.setattr(batch_runner, "MAX_ITEM_BYTES", len(chart_png) - 1)
+    files, data = _multipart(chart_png)
+    response = client.post("/analyze-batch", files=files, data=data)
+    assert response.status_code == 400
+    assert "Image too large" in response.json()["detail"]
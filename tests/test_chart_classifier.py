@@ -0,0 +1,90 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.services.chart_classifier import classify_chart
+from app.services.image_processing import prepare_image
+
+
+def _png(draw_chart, size=(800, 600)):
+    image = Image.new("RGB", size, "white")
+    draw_chart(ImageDraw.Draw(image), *size)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return prepare_image(buffer.getvalue())
+
+
+def _axes(draw, left, top, right, bottom):
+    draw.line([(left, top), (left, bottom), (right, bottom)], fill="black", width=2)
+
+
+def _bars(draw, left, top, right, bottom):
+    _axes(draw, left, top, right, bottom)
+    heights = [0.3, 0.8, 0.55, 0.95, 0.4, 0.7]
+    step = (right - left) / len(heights)
+    for i, height in enumerate(heights):
+        x = left + i * step + step * 0.2
+        draw.rectangle([x, bottom - height * (bottom - top), x + step * 0.6, bottom - 1],
+                       fill=("#1f77b4", "#ff7f0e")[i % 2])
+
+
+def _lines(draw, left, top, right, bottom):
+    _axes(draw, left, top, right, bottom)
+    for color, values in (("#1f77b4", [0.2, 0.4, 0.35, 0.6, 0.8]), ("#d62728", [0.7, 0.6, 0.5, 0.55, 0.3])):
+        step = (right - left - 20) / (len(values) - 1)
+        points = [(left + 10 + i * step, bottom - v * (bottom - top)) for i, v in enumerate(values)]
+        draw.line(points, fill=color, width=3)
+
+
+def _pie(draw, left, top, right, bottom):
+    size = min(right - left, bottom - top) * 0.8
+    cx, cy = (left + right) / 2, (top + bottom) / 2
+    box = [cx - size / 2, cy - size / 2, cx + size / 2, cy + size / 2]
+    start = 0
+    for color, share in (("#1f77b4", 0.4), ("#ff7f0e", 0.25), ("#2ca02c", 0.2), ("#d62728", 0.15)):
+        draw.pieslice(box, start, start + share * 360, fill=color)
+        start += share * 360
+
+
+def _table(draw, left, top, right, bottom):
+    rows, columns = 6, 4
+    for i in range(rows + 1):
+        y = top + i * (bottom - top) / rows
+        draw.line([(left, y), (right, y)], fill="black", width=2)
+    for j in range(columns + 1):
+        x = left + j * (right - left) / columns
+        draw.line([(x, top), (x, bottom)], fill="black", width=2)
+
+
+@pytest.mark.parametrize("draw_chart, expected", [
+    (_bars, "bar_chart"),
+    (_lines, "line_chart"),
+    (_pie, "pie_chart"),
+    (_table, "table"),
+])
+def test_single_chart_types(draw_chart, expected):
+    prediction = classify_chart(_png(lambda draw, w, h: draw_chart(draw, 80, 60, w - 80, h - 60)))
+    assert prediction.chart_type == expected
+    assert prediction.confidence >= 0.6
+
+
+def test_two_panels_are_mixed_chart():
+    def draw_chart(draw, w, h):
+        _pie(draw, 40, 100, w // 2 - 60, h - 100)
+        _bars(draw, w // 2 + 60, 100, w - 40, h - 100)
+
+    prediction = classify_chart(_png(draw_chart, size=(1200, 600)))
+    assert prediction.chart_type == "mixed_chart"
+    assert sorted(prediction.components) == ["bar_chart", "pie_chart"]
+
+
+def test_blank_image_is_unknown():
+    prediction = classify_chart(_png(lambda draw, w, h: None))
+    assert prediction.chart_type == "unknown"
+
+
+def test_workflow_info_lists_classifier_steps(client):
+    steps = {step["name"]: step for step in client.get("/workflow-info").json()["steps"]}
+    assert "classify_chart" in steps
+    assert "analyze_bar_chart" in steps["analyze_chart"]["variants"]
@@ -0,0 +1,109 @@
+import time
+import uuid
+
+
+def _wait_for_job(client, job_id, headers):
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_runs_under_submitter_tenant_and_session(client, chart_png):
+    tenant = f"acme-{uuid.uuid4().hex[:8]}"
+    headers = {"X-Tenant-ID": tenant, "X-Session-ID": "student-1"}
+    response = client.post(
+        "/jobs",
+        data={"task_description": "The chart shows water consumption"},
+        files={"chart_image": ("chart.png", chart_png, "image/png")},
+        headers=headers,
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    job = _wait_for_job(client, job_id, headers)
+    assert job["status"] == "succeeded"
+    assert job["tenant"] == tenant
+    assert job["session_id"] == "student-1"
+
+    history = client.get("/results", headers=headers).json()["items"]
+    assert len(history) == 1
+    assert history[0]["session_id"] == "student-1"
+
+
+def test_jobs_are_hidden_from_other_tenants(client, chart_png):
+    headers = {"X-Tenant-ID": f"acme-{uuid.uuid4().hex[:8]}"}
+    job_id = client.post(
+        "/jobs",
+        data={"task_description": "The chart shows water consumption"},
+        files={"chart_image": ("chart.png", chart_png, "image/png")},
+        headers=headers,
+    ).json()["job_id"]
+    _wait_for_job(client, job_id, headers)
+
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+    assert client.get(f"/jobs/{job_id}/result").status_code == 404
+    assert client.get(f"/jobs/{job_id}/result", headers=headers).status_code == 200
+
+
+def test_sqlite_job_store_keeps_tenant_and_session(tmp_path, chart_png):
+    from app.services.image_processing import prepare_image
+    from app.services.job_queue import SQLiteJobStore, _new_job
+
+    store = SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"))
+    store.create(_new_job("job-1", "task", tenant="acme", session_id="s1"), prepare_image(chart_png))
+    job = store.get("job-1")
+    assert (job["tenant"], job["session_id"]) == ("acme", "s1")
+
+
+def test_job_without_image_is_marked_failed(chart_png):
+    import asyncio
+
+    from app.services.image_processing import prepare_image
+    from app.services.job_queue import InMemoryJobStore, JobQueue, _new_job
+
+    store = InMemoryJobStore()
+    store.create(_new_job("job-1", "task"), prepare_image(chart_png))
+    store._images.clear()
+    queue = JobQueue(workflow=None, store=store)
+
+    asyncio.run(queue._run_job("job-1"))
+    job = store.get("job-1")
+    assert job["status"] == "failed"
+    assert job["error"] == "Job input image is missing"
+    assert job["finished_at"] is not None
+
+
+def test_expired_jobs_are_purged_periodically(chart_png):
+    import asyncio
+
+    from app.services.image_processing import prepare_image
+    from app.services.job_queue import InMemoryJobStore, JobQueue, _new_job
+
+    store = InMemoryJobStore()
+    store.create(_new_job("old", "task"), prepare_image(chart_png))
+    store.update("old", status="succeeded", finished_at=time.time() - 120)
+    queue = JobQueue(workflow=None, store=store, concurrency=1, result_ttl_seconds=60, purge_interval=0.01)
+
+    async def run():
+        await queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert store.get("old") is None
+
+
+def test_job_store_is_abstract():
+    import pytest
+
+    from app.services.job_queue import JobStore
+
+    class PartialStore(JobStore):
+        def create(self, job, image):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialStore()
@@ -0,0 +1,23 @@
+import pytest
+
+from app.services.metrics import Counter, Histogram, _Metric
+
+
+def test_metric_without_samples_cannot_be_created():
+    class Incomplete(_Metric):
+        type_name = "gauge"
+
+    with pytest.raises(TypeError):
+        Incomplete("ielts_test_incomplete", "Incomplete metric")
+
+
+def test_counter_and_histogram_render():
+    counter = Counter("ielts_test_total", "Test counter", ["kind"])
+    counter.inc(kind="a")
+    assert 'ielts_test_total{kind="a"} 1' in counter.render()
+
+    histogram = Histogram("ielts_test_seconds", "Test histogram", buckets=(0.1, 1.0))
+    histogram.observe(0.5)
+    lines = histogram.render()
+    assert "# TYPE ielts_test_seconds histogram" in lines
+    assert "ielts_test_seconds_count 1" in lines
@@ -0,0 +1,18 @@
+import pytest
+
+from app.services.local_provider import LocalProvider
+from app.services.model_provider import ModelProvider
+
+
+def test_provider_must_implement_model():
+    class NoModels(ModelProvider):
+        name = "broken"
+
+    with pytest.raises(TypeError):
+        NoModels()
+
+
+def test_local_provider_defaults():
+    provider = LocalProvider(seed=1)
+    assert provider.model("vision") is not provider.model("writing")
+    assert provider.health()["provider"] == "local"
@@ -0,0 +1,57 @@
+import warnings
+
+import pytest
+
+from app.services.numeric_engine import build_fact_sheet, compute_facts, extract_tables
+
+
+def test_record_list_uses_year_field_as_label():
+    raw = [{"year": 1999, "USA": 1, "UK": 3}, {"year": 2000, "USA": 2, "UK": 1}]
+    (table,) = extract_tables(raw)
+    assert table.series == ["USA", "UK"]
+    assert table.columns == ["1999", "2000"]
+    assert table.time_axis
+
+    sheet = build_fact_sheet({"raw_data": raw})
+    assert not any("#1" in line for line in sheet)
+    assert not any("2,000" in line for line in sheet)
+    assert any(line.startswith("USA: increase") for line in sheet)
+
+
+def test_record_list_uses_first_text_field_as_label():
+    raw = [{"country": "Japan", "2000": 10}, {"country": "Brazil", "2000": 20}]
+    (table,) = extract_tables(raw)
+    assert table.series == ["Japan", "Brazil"]
+    assert table.columns == ["2000"]
+
+
+def test_column_oriented_raw_data():
+    raw = {"years": [1999, 2000, 2001], "USA": [48, 50, 52], "UK": [30, 31, 29]}
+    (table,) = extract_tables(raw)
+    assert table.series == ["USA", "UK"]
+    assert table.columns == ["1999", "2000", "2001"]
+
+    facts = compute_facts(table)
+    assert facts["time_axis"]
+    sheet = build_fact_sheet({"raw_data": raw})
+    assert any("USA: increase, 48 (1999) to 52 (2001)" in line for line in sheet)
+
+
+def test_all_nan_rows_are_dropped_without_warning():
+    raw = {"A": {"2000": None, "2010": None}, "B": {"2000": 5, "2010": 4}}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        sheet = build_fact_sheet({"raw_data": raw})
+    assert sheet
+    assert not any(line.startswith("A:") for line in sheet)
+
+
+def test_all_nan_table_is_skipped():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert build_fact_sheet({"raw_data": {"A": {"2000": None}, "B": {"2000": "n/a"}}}) == []
+
+
+@pytest.mark.parametrize("raw", [None, "no data", 42, [1, "x"], [[1, 2]]])
+def test_non_dict_raw_data(raw):
+    assert build_fact_sheet({"raw_data": raw}) == []
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from app.services.rate_limiter import SQLiteTokenBucket
+
+
+def test_sqlite_bucket_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    first = SQLiteTokenBucket(path, "rpm", rate=0.001, capacity=10)
+    second = SQLiteTokenBucket(path, "rpm", rate=0.001, capacity=10)
+
+    first.consume(4)
+    assert first.available < 6.1
+    # Chưa đồng bộ: bản sao của instance kia chưa thấy
+    assert second.available > 9.9
+
+    first.sync()
+    second.sync()
+    assert 5.9 < second.available < 6.1
+    assert second.time_until(8) > 0
+
+
+def test_sqlite_bucket_does_no_io_on_event_loop(tmp_path, monkeypatch):
+    bucket = SQLiteTokenBucket(str(tmp_path / "quota.sqlite3"), "tpm", rate=1000, capacity=1000, sync_interval=0)
+    update = bucket._update
+    threads = []
+
+    def tracking_update(consumed):
+        threads.append(threading.current_thread())
+        return update(consumed)
+
+    monkeypatch.setattr(bucket, "_update", tracking_update)
+
+    async def use_bucket():
+        loop_thread = threading.current_thread()
+        bucket.consume(100)
+        bucket.time_until(10)
+        _ = bucket.available
+        await bucket._sync_task
+        return loop_thread
+
+    loop_thread = asyncio.run(use_bucket())
+    assert threads
+    assert loop_thread not in threads
+    assert bucket._pending == 0
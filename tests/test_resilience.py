@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.local_provider import LatencyProfile, LocalGenerativeModel
+from app.services.request_context import request_deadline
+from app.services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ModelCallError,
+    RequestDeadlineExceeded,
+    ResilientCaller,
+)
+
+
+def _model(latency="fixed:0", failure_rate=0.0):
+    return LocalGenerativeModel({"ok": True}, LatencyProfile.parse(latency), failure_rate, seed=0)
+
+
+def _caller(breaker=None, **kwargs):
+    kwargs.setdefault("base_delay", 0.0)
+    kwargs.setdefault("hedge", False)
+    return ResilientCaller("test", breaker or CircuitBreaker("test", failure_threshold=5), **kwargs)
+
+
+def _attempt(*models):
+    """Lần thử thứ i gọi models[i] (model cuối dùng cho các lần sau)"""
+    calls = []
+
+    async def attempt(timeout):
+        model = models[min(len(calls), len(models) - 1)]
+        calls.append(timeout)
+        response = await model.generate_content_async("prompt", request_options={"timeout": timeout})
+        return response.text
+
+    attempt.calls = calls
+    return attempt
+
+
+def test_retries_injected_failure_then_succeeds():
+    failing, healthy = _model(failure_rate=1.0), _model()
+    caller = _caller()
+    result = asyncio.run(caller.call(_attempt(failing, healthy)))
+    assert '"ok": true' in result
+    assert failing.failures == 1
+    assert healthy.calls == 1
+    assert caller.retries == 1
+    assert caller.breaker.state == "closed"
+
+
+def test_gives_up_after_max_attempts_and_opens_circuit():
+    failing = _model(failure_rate=1.0)
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    caller = _caller(breaker, max_attempts=3)
+    with pytest.raises(ModelCallError):
+        asyncio.run(caller.call(_attempt(failing)))
+    assert failing.calls == 3
+    assert breaker.state == "open"
+    # Breaker mở: fail ngay, không gọi model
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(caller.call(_attempt(failing)))
+    assert failing.calls == 3
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(ModelCallError):
+        asyncio.run(_caller(breaker, max_attempts=1).call(_attempt(_model(failure_rate=1.0))))
+    assert breaker.state == "open"
+    time.sleep(0.06)
+
+    breaker.check()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    # Probe lỗi: mở lại
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    healthy = _model()
+    asyncio.run(_caller(breaker).call(_attempt(healthy)))
+    assert healthy.calls == 1
+    assert breaker.state == "closed"
+
+
+def test_hedges_only_after_min_samples():
+    caller = _caller(hedge=True, hedge_min_samples=20)
+    fast, slow = _model("fixed:0.01"), _model("fixed:0.3")
+
+    async def run():
+        for _ in range(19):
+            await caller.call(_attempt(fast))
+        # 19 mẫu: chưa đủ để hedge, chờ hết request chậm
+        await caller.call(_attempt(slow))
+        assert caller.hedges == 0
+        assert len(caller.latency) == 20
+
+        started_at = time.monotonic()
+        await caller.call(_attempt(slow, fast))
+        return time.monotonic() - started_at
+
+    elapsed = asyncio.run(run())
+    assert caller.hedges == 1
+    assert caller.hedge_wins == 1
+    assert elapsed < 0.25
+
+
+def test_attempt_timeout_is_clamped_to_request_deadline():
+    caller = _caller(attempt_timeout=60)
+    attempt = _attempt(_model())
+
+    async def run():
+        request_deadline.set(time.monotonic() + 0.5)
+        await caller.call(attempt)
+
+    asyncio.run(run())
+    assert 0 < attempt.calls[0] <= 0.5
+
+
+def test_expired_deadline_fails_without_calling_model():
+    model = _model()
+    caller = _caller()
+
+    async def run():
+        request_deadline.set(time.monotonic() - 1)
+        await caller.call(_attempt(model))
+
+    with pytest.raises(RequestDeadlineExceeded):
+        asyncio.run(run())
+    assert model.calls == 0
+
+
+def test_retry_stops_when_backoff_exceeds_deadline():
+    failing = _model(failure_rate=1.0)
+    caller = _caller(base_delay=10.0, max_delay=10.0, max_attempts=5)
+
+    async def run():
+        request_deadline.set(time.monotonic() + 0.2)
+        await caller.call(_attempt(failing))
+
+    # Cố định backoff (bỏ jitter) để test không phụ thuộc random
+    caller._backoff = lambda attempt: 10.0
+    with pytest.raises(RequestDeadlineExceeded):
+        asyncio.run(run())
+    assert failing.calls == 1
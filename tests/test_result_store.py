@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from app.services.result_store import InMemoryResultStore, ResultHistory, ResultStore, SQLiteResultStore
+
+
+def test_result_store_is_abstract():
+    class WriteOnly(ResultStore):
+        def save(self, record):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: InMemoryResultStore(),
+    lambda tmp_path: SQLiteResultStore(path=str(tmp_path / "results.sqlite3")),
+])
+def test_history_pages_by_tenant_and_session(tmp_path, make_store):
+    history = ResultHistory(make_store(tmp_path))
+    result = {"success": True, "chart_analysis": {"chart_type": "bar_chart"}, "ielts_writing": {"word_count": 170}}
+
+    async def run():
+        for _ in range(3):
+            await history.record(result, "task", "sha", tenant="acme", session_id="s1")
+        await history.record(result, "task", "sha", tenant="other", session_id="s1")
+        first = await history.page("acme", session_id="s1", limit=2)
+        second = await history.page("acme", session_id="s1", limit=2, cursor=first["next_cursor"])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert len(first["items"]) == 2 and first["next_cursor"]
+    assert len(second["items"]) == 1 and second["next_cursor"] is None
+    ids = {item["result_id"] for item in first["items"] + second["items"]}
+    assert len(ids) == 3
+
+
+def test_results_listing_requires_a_session(client, chart_png):
+    headers = {"X-Session-ID": "student-private"}
+    response = client.post(
+        "/analyze",
+        data={"task_description": "The chart shows water consumption"},
+        files={"chart_image": ("chart.png", chart_png, "image/png")},
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    assert client.get("/results").status_code == 400
+    other = client.get("/results", headers={"X-Session-ID": "student-other"}).json()
+    assert all(item["session_id"] == "student-other" for item in other["items"])
+    own = client.get("/results", headers=headers).json()["items"]
+    assert own and all(item["session_id"] == "student-private" for item in own)
@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+from app.services.image_processing import prepare_image
+from app.services.langgraph_workflow import IELTSAnalysisWorkflow
+from app.services.request_context import request_tenant
+from app.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight("test")
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {"value": 1}
+
+    async def run():
+        return await asyncio.gather(flight.do("k", work), flight.do("k", work))
+
+    (first, first_shared), (second, second_shared) = asyncio.run(run())
+    assert len(runs) == 1
+    assert (first_shared, second_shared) == (False, True)
+    assert first is second
+    assert flight.in_flight() == 0
+
+
+def test_cancelling_one_waiter_keeps_the_run_for_others():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(flight.do("k", work))
+        follower = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == ("done", True)
+
+
+def test_cancelling_last_waiter_cancels_the_run():
+    flight = SingleFlight("test")
+
+    async def run():
+        state = {"cancelled": False}
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        waiter = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        return state["cancelled"]
+
+    assert asyncio.run(run())
+    assert flight.in_flight() == 0
+
+
+def test_exception_is_shared_with_followers():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(flight.do("k", work), flight.do("k", work), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_workflow_followers_get_a_deep_copy(chart_png, monkeypatch):
+    workflow = IELTSAnalysisWorkflow()
+    image = prepare_image(chart_png)
+    runs = []
+
+    async def fake_run(task_description, image, num_variants=1):
+        runs.append(task_description)
+        await asyncio.sleep(0.05)
+        return {"success": True, "ielts_writing": {"body_paragraphs": ["a", "b"]}}
+
+    monkeypatch.setattr(workflow, "_run_request", fake_run)
+
+    async def run():
+        return await asyncio.gather(
+            workflow.process_request("Describe the chart", image),
+            workflow.process_request("Describe the chart", image),
+        )
+
+    leader, follower = asyncio.run(run())
+    assert len(runs) == 1
+    assert follower["ielts_writing"] == leader["ielts_writing"]
+    # Mỗi request ghi history riêng
+    assert follower["result_id"] != leader["result_id"]
+    follower["ielts_writing"]["body_paragraphs"].append("c")
+    assert leader["ielts_writing"]["body_paragraphs"] == ["a", "b"]
+
+
+def test_caller_with_later_deadline_runs_separately():
+    flight = SingleFlight("test")
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("k", work, deadline=10.0),
+            flight.do("k", work, deadline=20.0),
+            flight.do("k", work, deadline=15.0),
+            flight.do("k", work, deadline=None),
+        )
+
+    results = asyncio.run(run())
+    # Run 10s không đủ cho 20s; 15s join run 20s; không deadline cần run riêng
+    assert len(runs) == 3
+    assert [shared for _, shared in results] == [False, False, True, False]
+    assert results[2][0] == results[1][0]
+    assert flight.in_flight() == 0
+
+
+def test_workflow_does_not_share_runs_across_tenants(chart_png, monkeypatch):
+    workflow = IELTSAnalysisWorkflow()
+    image = prepare_image(chart_png)
+    runs = []
+
+    async def fake_run(task_description, image, num_variants=1):
+        runs.append(request_tenant.get())
+        await asyncio.sleep(0.05)
+        return {"success": True, "ielts_writing": {"body_paragraphs": ["a", "b"]}}
+
+    monkeypatch.setattr(workflow, "_run_request", fake_run)
+
+    async def as_tenant(tenant):
+        request_tenant.set(tenant)
+        return await workflow.process_request("Describe the chart", image)
+
+    async def run():
+        return await asyncio.gather(as_tenant("acme"), as_tenant("globex"), as_tenant("acme"))
+
+    asyncio.run(run())
+    assert sorted(runs) == ["acme", "globex"]
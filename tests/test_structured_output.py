@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from app.models.schemas import ChartAnalysis
+from app.services.gemini_service import GeminiService
+from app.services.local_provider import CHART_ANALYSIS, LatencyProfile, LocalGenerativeModel, LocalProvider
+from app.services.structured_output import StructuredOutput, repair_json
+
+
+def _repaired(text):
+    return json.loads(repair_json(text))
+
+
+def test_repair_truncated_string():
+    assert _repaired('{"title": "Water use', ) == {"title": "Water use"}
+
+
+def test_repair_truncated_array_and_dangling_key():
+    assert _repaired('{"trends": ["up", "down",') == {"trends": ["up", "down"]}
+    assert _repaired('{"a": 1, "b') == {"a": 1}
+    assert _repaired('{"a": 1, "b":') == {"a": 1, "b": None}
+
+
+def test_repair_single_quotes_and_python_literals():
+    assert _repaired("{'title': 'It\\'s', 'ok': True, 'x': None,}") == {"title": "It's", "ok": True, "x": None}
+
+
+def test_repair_strips_fences_and_prose():
+    text = 'Here is the JSON:\n```json\n{"title": "Water", chart_type: bar_chart,}\n```\nLet me know!'
+    assert _repaired(text) == {"title": "Water", "chart_type": "bar_chart"}
+    assert _repaired('```json\n{"title": "Water\n```') == {"title": "Water"}
+    assert _repaired("Sure: [1, 2,") == [1, 2]
+
+
+def test_repair_leaves_text_without_json():
+    assert repair_json("I cannot read this chart.") == "I cannot read this chart."
+
+
+def test_structured_output_reports_missing_fields():
+    parser = StructuredOutput(ChartAnalysis)
+    parser.feed('```json\n{"chart_type": "bar", "title": "Water"')
+    data, missing = parser.result()
+    assert parser.repaired
+    assert data["chart_type"] == "bar_chart"
+    assert "description" in missing
+
+
+class _DirectCaller:
+    async def call(self, attempt):
+        return await attempt(5.0)
+
+
+def test_missing_fields_trigger_reask():
+    provider = LocalProvider(chart_latency=LatencyProfile.parse("fixed:0"),
+                             essay_latency=LatencyProfile.parse("fixed:0"))
+    service = GeminiService(provider=provider)
+    reask_model = LocalGenerativeModel(CHART_ANALYSIS, LatencyProfile.parse("fixed:0"))
+
+    parser = StructuredOutput(ChartAnalysis)
+    parser.feed('{"chart_type": "bar_chart", "title": "Water"}')
+    data, missing = asyncio.run(
+        service._complete_structured("analyze_chart", _DirectCaller(), reask_model, ["prompt"], parser, 100)
+    )
+    assert reask_model.calls == 1
+    assert missing == []
+    assert data["description"] == CHART_ANALYSIS["description"]
@@ -0,0 +1,19 @@
+from app.services.upload_limits import _too_large_detail
+
+
+def test_oversized_upload_gets_cors_headers(client):
+    origin = "http://localhost:3000"
+    response = client.post(
+        "/analyze",
+        content=b"x",
+        headers={"Origin": origin, "Content-Length": str(1024 * 1024 * 1024), "Content-Type": "multipart/form-data"},
+    )
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == origin
+
+
+def test_limit_detail_formats_small_and_fractional_limits():
+    assert _too_large_detail(25 * 1024 * 1024) == "Request body too large (max 25 MB)"
+    assert _too_large_detail(1536 * 1024) == "Request body too large (max 1.5 MB)"
+    assert _too_large_detail(512 * 1024) == "Request body too large (max 512 KB)"
+    assert _too_large_detail(100) == "Request body too large (max 100 bytes)"
@@ -0,0 +1,96 @@
+import asyncio
+
+from app.services.image_processing import prepare_image
+from app.services.langgraph_workflow import IELTSAnalysisWorkflow
+
+
+def test_variants_run_in_parallel_and_best_is_selected(chart_png):
+    workflow = IELTSAnalysisWorkflow()
+    result = asyncio.run(workflow.process_request("Describe the chart", prepare_image(chart_png), num_variants=2))
+    assert result["success"]
+    candidates = result["essay_candidates"]
+    assert sorted(candidate["variant"] for candidate in candidates) == [0, 1]
+    assert sum(candidate["selected"] for candidate in candidates) == 1
+    assert "generate_variant" not in result["node_timings"]
+    assert "select_essay" in result["node_timings"]
+
+
+def test_failed_variant_is_recorded_not_raised(chart_png, monkeypatch):
+    workflow = IELTSAnalysisWorkflow()
+    service = workflow.gemini_service
+    generate = service.generate_ielts_writing_async
+    calls = []
+
+    async def flaky_generate(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("model exploded")
+        return await generate(*args, **kwargs)
+
+    monkeypatch.setattr(service, "generate_ielts_writing_async", flaky_generate)
+    result = asyncio.run(workflow.process_request("Describe the chart", prepare_image(chart_png), num_variants=2))
+    assert result["success"]
+    errors = [candidate for candidate in result["essay_candidates"] if candidate.get("error")]
+    assert len(errors) == 1
+    assert "model exploded" in errors[0]["error"]
+
+
+def test_workflow_info_lists_variant_steps(client):
+    names = [step["name"] for step in client.get("/workflow-info").json()["steps"]]
+    assert names.index("generate_variant") < names.index("select_essay") < names.index("finalize_result")
+
+
+def test_progress_run_without_result_fails_instead_of_rerunning(chart_png, monkeypatch):
+    workflow = IELTSAnalysisWorkflow()
+    runs = []
+
+    async def broken_record(*args, **kwargs):
+        runs.append(1)
+        raise RuntimeError("history unavailable")
+
+    async def fail_rerun(*args, **kwargs):
+        raise AssertionError("workflow must not run a second time")
+
+    monkeypatch.setattr(workflow, "_record_result", broken_record)
+    monkeypatch.setattr(workflow, "_run_request", fail_rerun)
+    nodes = []
+
+    async def on_node(node, processing_step):
+        nodes.append(node)
+
+    result = asyncio.run(
+        workflow.process_request("Describe the chart", prepare_image(chart_png), on_node=on_node)
+    )
+    assert nodes
+    assert runs == [1]
+    assert result["success"] is False
+    assert "without a result" in result["error"]
+
+
+def test_history_failure_does_not_fail_request(chart_png, monkeypatch):
+    workflow = IELTSAnalysisWorkflow()
+
+    async def broken_record(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(workflow.result_history, "record", broken_record)
+    result = asyncio.run(workflow.process_request("Describe the chart", prepare_image(chart_png)))
+    assert result["success"]
+    assert "result_id" not in result
+
+
+def test_stored_analysis_is_hidden_from_other_tenants(client, chart_png):
+    headers = {"X-Tenant-ID": "acme"}
+    response = client.post(
+        "/analyze",
+        data={"task_description": "The chart shows water consumption"},
+        files={"chart_image": ("chart.png", chart_png, "image/png")},
+        headers=headers,
+    )
+    analysis_id = response.json()["metadata"]["analysis_id"]
+
+    other = {"X-Tenant-ID": "globex"}
+    assert client.get(f"/analyses/{analysis_id}", headers=other).status_code == 404
+    assert client.post(f"/analyses/{analysis_id}/regenerate", headers=other).status_code == 404
+    assert client.get(f"/analyses/{analysis_id}", headers=headers).json()["tenant"] == "acme"
+    assert client.post(f"/analyses/{analysis_id}/regenerate", headers=headers).status_code == 200